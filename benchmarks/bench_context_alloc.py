@@ -0,0 +1,102 @@
+"""
+每个请求的内存分配测试: 新建 context vs 复用 context (reuse_context=True).
+
+用法 (CPython):
+    python benchmarks/bench_context_alloc.py
+
+"objects" 一栏创建 ROUNDS 个 context 并全部保留, 用 tracemalloc 统计每个请求占用的内存块数量和字节数,
+"dict" 使用带有 __dict__ 的子类, 相当于没有 __slots__ 的旧版本.
+"server" 一栏在本机回环地址上用一个保持的连接发送 ROUNDS 个请求,
+比较处理期间 tracemalloc 记录的峰值内存和每个请求新分配 (未释放) 的内存块.
+"""
+import os, socket, sys, threading, time, tracemalloc
+
+sys.path.insert (0, os.path.join (os.path.dirname (os.path.abspath (__file__)), ".."))
+import micro_route
+
+ROUNDS = 2000
+PORT   = 18766
+HEAD   = ("GET", "/hello?name=bench", "HTTP/1.1")
+REQUEST = b"GET /hello?name=bench HTTP/1.1\r\nHost: bench\r\nAccept: */*\r\n\r\n"
+
+def measure (fn) -> tuple:
+    """
+    返回 fn () 执行期间新增的 (内存块数量, 字节数, 峰值字节数)
+    """
+    tracemalloc.start ()
+    before = tracemalloc.take_snapshot ()
+    tracemalloc.reset_peak ()
+    base = tracemalloc.get_traced_memory ()[0]
+    keep = fn ()
+    peak = tracemalloc.get_traced_memory ()[1] - base
+    after = tracemalloc.take_snapshot ()
+    tracemalloc.stop ()
+    diff = after.compare_to (before, "filename")
+    blocks = sum (d.count_diff for d in diff)
+    size = sum (d.size_diff for d in diff)
+    del keep
+    return blocks, size, peak
+
+# 带有 __dict__ 的子类, 模拟没有 __slots__ 时的内存占用
+class _Dict_Request (micro_route._Request): pass
+class _Dict_Response (micro_route._Response): pass
+class _Dict_Context (micro_route.Context): pass
+
+def objects (reuse):
+    a, b = socket.socketpair ()
+    headers = micro_route._Headers (b"Host: bench\r\nAccept: */*\r\n\r\n", 0)
+    buf = micro_route._Recv_Buffer (b)
+    def run ():
+        keep = []
+        context = None
+        for _ in range (ROUNDS):
+            if reuse is True and context is not None:
+                context.request._reset (HEAD, headers)
+                context.response._reset (True, True, False)
+            elif reuse == "dict":
+                request = _Dict_Request (b, ("127.0.0.1", 0), HEAD, headers, buffer=buf)
+                context = _Dict_Context (request, _Dict_Response (b, True, True, False, request))
+            else:
+                request = micro_route._Request (b, ("127.0.0.1", 0), HEAD, headers, buffer=buf)
+                context = micro_route.Context (request, micro_route._Response (b, True, True, False, request))
+            context.request.args # 解析 URL 参数
+            keep.append (context)
+        return keep
+    r = measure (run)
+    a.close ()
+    b.close ()
+    return r
+
+def server (reuse:bool):
+    app = micro_route.MICRO_ROUTE (bind_ip="127.0.0.1", bind_port=PORT + reuse, reuse_context=reuse)
+    app.gc_policy ("off")
+    @app.route ("/hello")
+    def hello (context):
+        return "hello " + context.request.args.get ("name", "")
+    threading.Thread (target=app.run, kwargs={"blocked": True, "muti_thread": True, "max_requests": ROUNDS * 2}, daemon=True).start ()
+    time.sleep (0.3)
+    sock = socket.create_connection (("127.0.0.1", PORT + reuse))
+    def request ():
+        sock.sendall (REQUEST)
+        data = b""
+        while not data.endswith (b"hello bench"):
+            data += sock.recv (4096)
+    request () # 预热
+    def run ():
+        for _ in range (ROUNDS):
+            request ()
+    r = measure (run)
+    sock.close ()
+    app.stop ()
+    return r
+
+def main ():
+    print ("{0:>8} {1:>8} {2:>14} {3:>14} {4:>12}".format ("case", "mode", "blocks/req", "bytes/req", "peak KiB"))
+    for name, fn, cases in (("objects", objects, ("dict", False, True)), ("server", server, (False, True))):
+        for reuse in cases:
+            blocks, size, peak = fn (reuse)
+            print ("{0:>8} {1:>8} {2:>14.2f} {3:>14.1f} {4:>12.1f}".format (
+                name, {"dict" : "dict", False : "new", True : "reuse"}[reuse], blocks / ROUNDS, size / ROUNDS, peak / 1024))
+
+if __name__ == "__main__":
+    main ()
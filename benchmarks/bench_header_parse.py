@@ -0,0 +1,95 @@
+"""
+请求头解析的基准测试: 旧的逐行 readline ().decode () 解析 vs 缓冲区解析.
+
+用法 (CPython):
+    python benchmarks/bench_header_parse.py
+
+两种方式都从同一个 socketpair 中读取一个典型浏览器请求, 然后访问两个 header.
+"parse only" 一栏去掉了 socket 的开销, 只比较解析本身.
+"""
+import io, os, re, socket, sys, time
+
+sys.path.insert (0, os.path.join (os.path.dirname (os.path.abspath (__file__)), ".."))
+import micro_route
+
+ROUNDS = 20000
+
+REQUEST = (
+    b"GET /static/js/app.3f9a1c.js?v=12 HTTP/1.1\r\n"
+    b"Host: 192.168.4.1\r\n"
+    b"Connection: keep-alive\r\n"
+    b"sec-ch-ua: \"Chromium\";v=\"118\", \"Google Chrome\";v=\"118\", \"Not=A?Brand\";v=\"99\"\r\n"
+    b"sec-ch-ua-mobile: ?0\r\n"
+    b"User-Agent: Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/118.0.0.0 Safari/537.36\r\n"
+    b"sec-ch-ua-platform: \"Windows\"\r\n"
+    b"Accept: */*\r\n"
+    b"Sec-Fetch-Site: same-origin\r\n"
+    b"Sec-Fetch-Mode: no-cors\r\n"
+    b"Sec-Fetch-Dest: script\r\n"
+    b"Referer: http://192.168.4.1/\r\n"
+    b"Accept-Encoding: gzip, deflate, br\r\n"
+    b"Accept-Language: zh-CN,zh;q=0.9,en;q=0.8\r\n"
+    b"Cookie: session=0f1e2d3c4b5a69788796a5b4c3d2e1f0; theme=dark\r\n"
+    b"\r\n"
+)
+
+_comper_agreement = re.compile ("(GET|POST|HEAD|PUT|DELETE|CONNECT|OPTIONS|TRACE|PATCH) (.*) (.*)")
+
+def old_parse (reader):
+    # micro_route 旧版本的 __process_handler 解析方式
+    line = reader.readline ().decode ().strip()
+    m = _comper_agreement.search (line)
+    head = [m.group (i) for i in range(1,4)]
+    headers = {}
+    while line:
+        line = reader.readline ().decode ().strip()
+        if line != "":
+            idx = line.find (':')
+            headers [line[:idx]] = line [idx+2:]
+        else:
+            break
+    return head, headers.get ("Connection"), headers.get ("Accept-Encoding")
+
+def new_parse (buf):
+    end = buf.find_head ()
+    while end < 0:
+        buf.fill ()
+        end = buf.find_head ()
+    head, headers = micro_route._parse_head (buf.take (end - buf.start))
+    return head, headers.get ("Connection"), headers.get ("Accept-Encoding")
+
+def run (name, parse, src, dst):
+    start = time.perf_counter ()
+    for _ in range (ROUNDS):
+        src.sendall (REQUEST)
+        parse (dst)
+    cost = (time.perf_counter () - start) / ROUNDS * 1e6
+    print ("{0:>8}: {1:8.2f} us/request".format (name, cost))
+
+def main ():
+    a, b = socket.socketpair ()
+    reader = b.makefile ("rb")
+    a.sendall (REQUEST)
+    old = old_parse (reader)
+    a.sendall (REQUEST)
+    new = new_parse (micro_route._Recv_Buffer (b))
+    assert old == new, (old, new)
+
+    print ("socketpair:")
+    run ("readline", old_parse, a, reader)
+    run ("buffered", new_parse, a, micro_route._Recv_Buffer (b))
+
+    print ("parse only:")
+    start = time.perf_counter ()
+    for _ in range (ROUNDS):
+        old_parse (io.BytesIO (REQUEST))
+    print ("{0:>8}: {1:8.2f} us/request".format ("readline", (time.perf_counter () - start) / ROUNDS * 1e6))
+    buf = micro_route._Recv_Buffer ()
+    start = time.perf_counter ()
+    for _ in range (ROUNDS):
+        buf.feed (REQUEST)
+        new_parse (buf)
+    print ("{0:>8}: {1:8.2f} us/request".format ("buffered", (time.perf_counter () - start) / ROUNDS * 1e6))
+
+if __name__ == "__main__":
+    main ()
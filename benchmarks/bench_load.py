@@ -0,0 +1,252 @@
+"""
+micro_route 的压力测试, 输出 JSON 格式的结果, 用于比较不同版本的性能.
+
+用法 (CPython, Linux):
+    python benchmarks/bench_load.py [--duration 3] [--concurrency 8] [--modes blocking,thread,async]
+        [--gc request] [--output result.json]
+
+每种运行模式 (blocking: run (blocked=True), thread: run (muti_thread=True), async: run_async (),
+prefork: run (muti_thread=True, workers=CPU 数量, 至少 2 个), poll: run (blocked=False) 后循环调用 poll ())
+在单独的子进程中启动服务器, 然后用 concurrency 个线程在本机回环地址上发送请求, 依次测试:
+    static   : 静态路由 GET /hello
+    typed    : 带类型变量的路由 GET /item/<int:gid>/<string:name>
+    form     : POST application/x-www-form-urlencoded 表单
+    file_1k, file_64k, file_1m : send_file () 发送不同大小的静态文件
+每项结果包括 requests/sec, p50 / p99 延迟 (毫秒) 和服务器进程的峰值 RSS (KiB, 读取 /proc, 其他平台为 null,
+prefork 模式为父进程和所有子进程之和).
+blocking 模式一次只能处理一个连接, 所以不保持连接. --gc 设置服务器的 gc_policy (), 默认每个请求回收一次.
+"""
+import argparse, json, os, platform, socket, subprocess, sys, tempfile, threading, time
+
+ROOT = os.path.join (os.path.dirname (os.path.abspath (__file__)), "..")
+sys.path.insert (0, ROOT)
+import micro_route
+
+PORT  = 18780
+MODES = ("blocking", "thread", "async", "prefork", "poll")
+FILES = (("file_1k", 1 << 10), ("file_64k", 64 << 10), ("file_1m", 1 << 20))
+FORM  = b"name=micro+route&city=%E4%B8%8A%E6%B5%B7&count=42&tags=a&tags=b"
+
+def scenarios () -> list:
+    """
+    返回 [(名称, 请求报文)]
+    """
+    get = "GET {0} HTTP/1.1\r\nHost: bench\r\nAccept: */*\r\n\r\n"
+    result = [
+        ("static", get.format ("/hello").encode ()),
+        ("typed", get.format ("/item/42/widget").encode ()),
+        ("form", b"POST /form HTTP/1.1\r\nHost: bench\r\nContent-Type: application/x-www-form-urlencoded\r\n"
+            + "Content-Length: {0}\r\n\r\n".format (len (FORM)).encode () + FORM),
+    ]
+    for name, size in FILES:
+        result.append ((name, get.format ("/" + name + ".bin").encode ()))
+    return result
+
+# ============== 服务器 (子进程) ==============
+
+def serve (mode:str,port:int,root:str,gc_mode:str):
+    app = micro_route.MICRO_ROUTE (bind_ip="127.0.0.1", bind_port=port, root_path=root)
+    app.gc_policy (gc_mode, every=100)
+
+    @app.route ("/hello")
+    def hello (context):
+        return "hello world"
+
+    @app.route ("/item/<int:gid>/<string:name>")
+    def item (context, gid, name):
+        return "{0}:{1}".format (gid, name)
+
+    @app.route ("/form", method="POST")
+    def form (context):
+        return "{0} {1}".format (context.request.form.get ("name"), len (context.request.form))
+
+    if mode == "async":
+        app.run_async (backlog=128)
+    elif mode == "prefork":
+        app.run (blocked=True, muti_thread=True, backlog=128, workers=max (2, os.cpu_count () or 1))
+    elif mode == "poll":
+        app.run (blocked=False, backlog=128)
+        while True:
+            app.poll (1)
+    else:
+        app.run (blocked=True, muti_thread=mode == "thread", keep_alive=mode != "blocking", backlog=128)
+
+# ============== 客户端 ==============
+
+class _Client ():
+    """
+    一个保持的连接, 只解析压力测试需要的 Content-Length 和 Connection
+    """
+    def __init__ (self,port:int):
+        self.port = port
+        self.sock = None
+        self.buf = b""
+        self.sink = bytearray (65536)
+
+    def close (self):
+        if self.sock:
+            self.sock.close ()
+        self.sock = None
+        self.buf = b""
+
+    def request (self,data:bytes):
+        if self.sock is None:
+            self.sock = socket.create_connection (("127.0.0.1", self.port))
+            self.sock.setsockopt (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.sendall (data)
+        while b"\r\n\r\n" not in self.buf:
+            chunk = self.sock.recv (65536)
+            if not chunk:
+                raise OSError ("connection closed")
+            self.buf += chunk
+        idx = self.buf.find (b"\r\n\r\n") + 4
+        head = self.buf[:idx].lower ()
+        if not head.startswith (b"http/1.1 200"):
+            raise OSError (head.split (b"\r\n")[0].decode ())
+        length = int (head.split (b"content-length:")[1].split (b"\r\n")[0])
+        got = len (self.buf) - idx
+        if got >= length:
+            self.buf = self.buf[idx + length:]
+        else:
+            self.buf = b""
+            while got < length:
+                n = self.sock.recv_into (self.sink, min (len (self.sink), length - got))
+                if not n:
+                    raise OSError ("connection closed")
+                got += n
+        if b"connection: close" in head:
+            self.close ()
+
+def load (port:int,data:bytes,duration:float,concurrency:int) -> dict:
+    """
+    concurrency 个线程在 duration 秒内不断发送 data, 返回 requests/sec 和延迟的统计
+    """
+    latencies = []
+    errors = [0]
+    deadline = time.perf_counter () + duration
+
+    def worker ():
+        client = _Client (port)
+        local = []
+        while time.perf_counter () < deadline:
+            start = time.perf_counter ()
+            try:
+                client.request (data)
+                local.append (time.perf_counter () - start)
+            except Exception:
+                errors[0] += 1
+                client.close ()
+        client.close ()
+        latencies.extend (local)
+
+    start = time.perf_counter ()
+    threads = [threading.Thread (target=worker) for _ in range (concurrency)]
+    for t in threads: t.start ()
+    for t in threads: t.join ()
+    cost = time.perf_counter () - start
+    latencies.sort ()
+
+    def percentile (q:float):
+        if not latencies:
+            return None
+        return round (latencies[int (q * (len (latencies) - 1))] * 1000, 3)
+
+    return {
+        "requests" : len (latencies),
+        "errors"   : errors[0],
+        "rps"      : round (len (latencies) / cost, 1),
+        "p50_ms"   : percentile (0.5),
+        "p99_ms"   : percentile (0.99),
+    }
+
+def peak_rss (pid:int) -> int:
+    """
+    读取进程 (以及它的子进程) 的峰值 RSS (KiB), 不支持时返回 None
+    """
+    try:
+        with open ("/proc/{0}/status".format (pid)) as f:
+            rss = None
+            for line in f:
+                if line.startswith ("VmHWM:"):
+                    rss = int (line.split ()[1])
+        with open ("/proc/{0}/task/{0}/children".format (pid)) as f:
+            for child in f.read ().split ():
+                rss += peak_rss (int (child)) or 0
+        return rss
+    except (OSError, TypeError):
+        return None
+
+def wait_port (port:int,timeout:float=10) -> bool:
+    deadline = time.time () + timeout
+    while time.time () < deadline:
+        try:
+            socket.create_connection (("127.0.0.1", port), timeout=1).close ()
+            return True
+        except OSError:
+            time.sleep (0.05)
+    return False
+
+def run_mode (mode:str,port:int,root:str,args) -> list:
+    proc = subprocess.Popen ([sys.executable, os.path.abspath (__file__), "--serve", mode, str (port), root, args.gc])
+    results = []
+    try:
+        if not wait_port (port):
+            raise RuntimeError ("server ({0}) did not start".format (mode))
+        for name, data in scenarios ():
+            r = load (port, data, args.duration, args.concurrency)
+            r["mode"] = mode
+            r["scenario"] = name
+            r["peak_rss_kb"] = peak_rss (proc.pid)
+            results.append (r)
+            print ("{0:>9} {1:>9} {2:>10} {3:>9} {4:>9} {5:>7} {6:>10}".format (
+                mode, name, r["rps"], r["p50_ms"], r["p99_ms"], r["errors"], r["peak_rss_kb"]), file=sys.stderr)
+    finally:
+        proc.terminate ()
+        proc.wait ()
+    return results
+
+def main ():
+    parser = argparse.ArgumentParser (description="micro_route load benchmark")
+    parser.add_argument ("--duration", type=float, default=3, help="每项测试的时间 (秒)")
+    parser.add_argument ("--concurrency", type=int, default=8, help="并发的连接数量")
+    parser.add_argument ("--modes", default=",".join (MODES), help="测试的运行模式, 用逗号分隔")
+    parser.add_argument ("--gc", default="request", help="服务器的 gc_policy (): request / every (100 个请求) / threshold / off")
+    parser.add_argument ("--output", default=None, help="把 JSON 结果写入这个文件, 默认输出到 stdout")
+    parser.add_argument ("--serve", nargs=4, metavar=("MODE", "PORT", "ROOT", "GC"), help=argparse.SUPPRESS)
+    args = parser.parse_args ()
+
+    if args.serve:
+        serve (args.serve[0], int (args.serve[1]), args.serve[2], args.serve[3])
+        return
+
+    root = tempfile.mkdtemp ()
+    for name, size in FILES:
+        with open (os.path.join (root, name + ".bin"), "wb") as f:
+            f.write (os.urandom (size))
+
+    print ("{0:>9} {1:>9} {2:>10} {3:>9} {4:>9} {5:>7} {6:>10}".format (
+        "mode", "scenario", "rps", "p50_ms", "p99_ms", "errors", "rss_kb"), file=sys.stderr)
+    results = []
+    for i, mode in enumerate (args.modes.split (",")):
+        if mode not in MODES:
+            parser.error ("unknown mode: " + mode)
+        results.extend (run_mode (mode, PORT + i, root, args))
+
+    report = {
+        "python"      : sys.version.split ()[0],
+        "implementation" : platform.python_implementation (),
+        "platform"    : platform.platform (),
+        "duration"    : args.duration,
+        "concurrency" : args.concurrency,
+        "gc"          : args.gc,
+        "results"     : results,
+    }
+    text = json.dumps (report, indent=2)
+    if args.output:
+        with open (args.output, "w") as f:
+            f.write (text)
+    else:
+        print (text)
+
+if __name__ == "__main__":
+    main ()
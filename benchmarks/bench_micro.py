@@ -0,0 +1,115 @@
+"""
+micro_route 热点函数的微基准测试, 输出 JSON 格式的结果, 与 bench_load.py 一起用于比较不同版本.
+
+用法 (CPython):
+    python benchmarks/bench_micro.py [--rounds 20000] [--output result.json]
+
+测试的函数:
+    translate_rule : _translate_rule () 转换带变量的路由
+    match_static   : MICRO_ROUTE.__match_rule () 匹配 200 个路由中最后注册的静态路由
+    match_typed    : 同上, 匹配带 int 变量的路由 (包括类型转换)
+    match_miss     : 同上, 不存在的 URL
+    form_small / form_large : load_form_data () 解析约 100 B / 8 KB 的编码表单
+    parse_head     : _parse_head () 解析典型的浏览器请求头, 并读取两个 header
+每项结果为每次调用的平均耗时 (微秒), 取 3 轮中最快的一轮.
+"""
+import argparse, json, os, platform, sys, time
+
+sys.path.insert (0, os.path.join (os.path.dirname (os.path.abspath (__file__)), ".."))
+import micro_route
+
+ROUTES = 200
+HEAD = (
+    b"GET /static/js/app.3f9a1c.js?v=12 HTTP/1.1\r\n"
+    b"Host: 192.168.4.1\r\n"
+    b"Connection: keep-alive\r\n"
+    b"User-Agent: Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/118.0.0.0 Safari/537.36\r\n"
+    b"Accept: */*\r\n"
+    b"Referer: http://192.168.4.1/\r\n"
+    b"Accept-Encoding: gzip, deflate, br\r\n"
+    b"Accept-Language: zh-CN,zh;q=0.9,en;q=0.8\r\n"
+    b"Cookie: session=0f1e2d3c4b5a69788796a5b4c3d2e1f0; theme=dark\r\n"
+    b"\r\n"
+)
+
+def make_app () -> micro_route.MICRO_ROUTE:
+    app = micro_route.MICRO_ROUTE ()
+    handler = lambda context, **kw: ""
+    for i in range (ROUTES):
+        if i % 2:
+            app.append_to_route_tree ("/api/v1/res{0}/<int:rid>/detail".format (i), handler, "GET", True)
+        else:
+            app.append_to_route_tree ("/static/page{0}".format (i), handler, "GET", True)
+    return app
+
+def make_form (size:int) -> bytes:
+    fields = []
+    length = 0
+    i = 0
+    while length < size:
+        field = "field{0}=value+{0}+".format (i) + "%E4%BD%A0%E5%A5%BD" * 4 # 字段不能超过 MAX_FORM_FIELDS 个
+        fields.append (field)
+        length += len (field) + 1
+        i += 1
+    return "&".join (fields).encode ()
+
+def parse_head ():
+    head, headers = micro_route._parse_head (HEAD)
+    return headers.get ("Connection"), headers.get ("Accept-Encoding")
+
+def cases () -> list:
+    match = make_app ()._MICRO_ROUTE__match_rule
+    small = make_form (100)
+    large = make_form (8192)
+    last = ROUTES - 1 if (ROUTES - 1) % 2 else ROUTES - 2
+    static_url = "/static/page{0}".format (ROUTES - 2)
+    typed_url = "/api/v1/res{0}/42/detail".format (last)
+    return [
+        ("translate_rule", lambda: micro_route._translate_rule ("/api/<string:name>/<int:gid>/<float:price>")),
+        ("match_static", lambda: match (static_url, "GET")),
+        ("match_typed", lambda: match (typed_url, "GET")),
+        ("match_miss", lambda: match ("/not/found", "GET")),
+        ("form_small", lambda: micro_route.load_form_data (small)),
+        ("form_large", lambda: micro_route.load_form_data (large)),
+        ("parse_head", parse_head),
+    ]
+
+def timeit (fn, rounds:int) -> float:
+    best = None
+    for _ in range (3):
+        start = time.perf_counter ()
+        for _ in range (rounds):
+            fn ()
+        cost = (time.perf_counter () - start) / rounds * 1e6
+        if best is None or cost < best:
+            best = cost
+    return best
+
+def main ():
+    parser = argparse.ArgumentParser (description="micro_route micro benchmarks")
+    parser.add_argument ("--rounds", type=int, default=20000, help="每轮调用的次数")
+    parser.add_argument ("--output", default=None, help="把 JSON 结果写入这个文件, 默认输出到 stdout")
+    args = parser.parse_args ()
+
+    results = {}
+    for name, fn in cases ():
+        rounds = max (1, args.rounds // 20) if name == "form_large" else args.rounds
+        results[name] = round (timeit (fn, rounds), 3)
+        print ("{0:>16}: {1:10.3f} us".format (name, results[name]), file=sys.stderr)
+
+    report = {
+        "python"         : sys.version.split ()[0],
+        "implementation" : platform.python_implementation (),
+        "platform"       : platform.platform (),
+        "rounds"         : args.rounds,
+        "us_per_call"    : results,
+    }
+    text = json.dumps (report, indent=2)
+    if args.output:
+        with open (args.output, "w") as f:
+            f.write (text)
+    else:
+        print (text)
+
+if __name__ == "__main__":
+    main ()
@@ -0,0 +1,63 @@
+"""
+路由匹配的基准测试: 旧的线性正则扫描 vs 路由树.
+
+用法 (CPython):
+    python benchmarks/bench_route_match.py
+
+对每个路由数量, 分别查找最后注册的静态路由, 最后注册的变量路由和一个不存在的 URL.
+线性扫描的耗时随路由数量增长, 路由树应当基本保持不变.
+"""
+import os, re, sys, time
+
+sys.path.insert (0, os.path.join (os.path.dirname (os.path.abspath (__file__)), ".."))
+import micro_route
+
+ROUNDS = 1000
+SIZES  = (10, 50, 150, 500)
+
+def make_rules (n:int) -> list:
+    rules = []
+    for i in range (n):
+        if i % 2:
+            rules.append ("/api/v1/res{0}/<int:rid>/detail".format (i))
+        else:
+            rules.append ("/static/page{0}".format (i))
+    return rules
+
+def linear_match (routes:list, url:str, method:str):
+    # micro_route 旧版本的 __match_rule 实现
+    for i in routes:
+        if re.match (i["rule"], url):
+            if not i["method"].lower () == method.lower ():
+                continue
+            return i
+    return None
+
+def timeit (fn, url:str) -> float:
+    start = time.perf_counter ()
+    for _ in range (ROUNDS):
+        fn (url, "GET")
+    return (time.perf_counter () - start) / ROUNDS * 1e6
+
+def main ():
+    print ("{0:>6} {1:>28} {2:>12} {3:>12}".format ("routes", "url", "linear(us)", "tree(us)"))
+    for n in SIZES:
+        rules = make_rules (n)
+        linear = []
+        tree = micro_route._Route_Tree ()
+        for idx, rule in enumerate (rules):
+            linear.append ({"rule": micro_route._translate_rule (rule)[0], "method": "GET"})
+            tree.insert (idx, rule, {"method": "GET"})
+
+        last_static = "/static/page{0}".format (n - 2)
+        last_var = "/api/v1/res{0}/42/detail".format (n - 1)
+        for url in (last_static, last_var, "/not/found"):
+            assert (linear_match (linear, url, "GET") is None) == (tree.match (url) is None)
+            print ("{0:>6} {1:>28} {2:>12.2f} {3:>12.2f}".format (
+                n, url,
+                timeit (lambda u, m: linear_match (linear, u, m), url),
+                timeit (lambda u, m: tree.match (u), url)
+            ))
+
+if __name__ == "__main__":
+    main ()
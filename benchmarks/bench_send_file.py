@@ -0,0 +1,60 @@
+"""
+静态文件发送的吞吐量测试: sendfile vs 分片复制.
+
+用法 (CPython):
+    python benchmarks/bench_send_file.py
+
+在本机回环地址上启动服务器, 分别下载 1 MB 和 50 MB 的文件,
+比较 socket.sendfile () 与 1 KiB / 64 KiB 缓冲区的分片复制.
+"""
+import os, socket, sys, tempfile, threading, time
+
+sys.path.insert (0, os.path.join (os.path.dirname (os.path.abspath (__file__)), ".."))
+import micro_route
+
+PORT  = 18765
+SIZES = ((1 << 20, 50), (50 << 20, 3)) # (文件大小, 下载次数)
+MODES = (
+    ("sendfile",  True,  65536),
+    ("copy 64k",  False, 65536),
+    ("copy 1k",   False, 1024),
+)
+
+def download (sock:socket.socket, name:str, buf:bytearray) -> int:
+    sock.sendall ("GET /{0} HTTP/1.1\r\nHost: bench\r\n\r\n".format (name).encode ())
+    head = b""
+    while b"\r\n\r\n" not in head:
+        head += sock.recv (1)
+    length = int (head.lower ().split (b"content-length:")[1].split (b"\r\n")[0])
+    got = 0
+    mv = memoryview (buf)
+    while got < length:
+        got += sock.recv_into (mv[:min (len (buf), length - got)])
+    return got
+
+def main ():
+    root = tempfile.mkdtemp ()
+    for size, _ in SIZES:
+        with open (os.path.join (root, "{0}.bin".format (size)), "wb") as f:
+            f.write (os.urandom (size))
+
+    app = micro_route.MICRO_ROUTE (bind_ip="127.0.0.1", bind_port=PORT, root_path=root)
+    threading.Thread (target=app.run, kwargs={"blocked": True, "muti_thread": True}, daemon=True).start ()
+    time.sleep (0.3)
+
+    buf = bytearray (1 << 20)
+    print ("{0:>10} {1:>10} {2:>12}".format ("mode", "file", "MB/s"))
+    for mode, use_sendfile, bufsize in MODES:
+        micro_route.USE_SENDFILE = use_sendfile
+        micro_route.FILE_BUFFER_SIZE = bufsize
+        for size, rounds in SIZES:
+            sock = socket.create_connection (("127.0.0.1", PORT))
+            start = time.perf_counter ()
+            for _ in range (rounds):
+                assert download (sock, "{0}.bin".format (size), buf) == size
+            cost = time.perf_counter () - start
+            sock.close ()
+            print ("{0:>10} {1:>8}MB {2:>12.1f}".format (mode, size >> 20, size * rounds / cost / (1 << 20)))
+
+if __name__ == "__main__":
+    main ()
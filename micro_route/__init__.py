@@ -26,13 +26,8 @@ app.run()
 
 @TODO:
     default 404 not found page
-    template render
-    file upload
     response.cookie
     session
-    gizp supported
-    cache control
-    Etag
     
     @app.berfore_request ()
     @app.after_request ()
@@ -58,7 +53,28 @@ except: import   ujson     as json
 try: import      _thread
 except: _thread = None
 
-import           gc, micropython, os   
+try: import      zlib
+except: zlib = None
+
+try: import      signal
+except: signal = None
+
+try: import      tempfile
+except: tempfile = None
+
+try: import      selectors
+except: selectors = None # MicroPython 中非阻塞模式使用 socket 的回调
+
+try:
+    import      micropython
+    _MICROPY = True
+except:
+    # CPython 中没有 micropython 模块, 提供一个兼容的 const ()
+    _MICROPY = False
+    class micropython ():
+        const = staticmethod (lambda x: x)
+
+import           gc, os, sys
 
 # ++++++++++++++++++++++++++++++++++++++++++++
 # ===================CONSTS===================
@@ -67,6 +83,8 @@ DEFAULT_PAGES = micropython.const ([
     "index.htm"
 ])
 charset = micropython.const ("utf-8")
+# 调试信息的级别, 见 debug_info (). 在 MicroPython 中是编译期常量, 高于它的调试语句在判断级别后直接跳过,
+# 不会构造参数
 DEBUG = micropython.const(1)
 _HTML_ESCAPE_CHARS = micropython.const({
     "&amp;"   :  "&",
@@ -78,13 +96,18 @@ _HTML_ESCAPE_CHARS = micropython.const({
 })
 STATU_CODES:dict = micropython.const({
     '200' : 'OK', # 客户端请求成功
+    '206' : 'Partial Content', # 范围请求成功, 只返回了部分内容
     '201' : 'Created', # 请求已经被实现，而且有一个新的资源已经依据请求的需要而创建，且其URI已经随Location头信息返回。
     '301' : 'Moved Permanently', # 被请求的资源已永久移动到新位置，并且将来任何对此资源的引用都应该使用本响应返回的若干个URI之一
     '302' : 'Found', # 在响应报文中使用首部“Location: URL”指定临时资源位置
     '304' : 'Not Modified', # 条件式请求中使用
+    '400' : 'Bad Request', # 请求报文存在语法错误
     '403' : 'Forbidden', # 请求被服务器拒绝
     '404' : 'Not Found', # 服务器无法找到请求的URL
     '405' : 'Method Not Allowed', # 不允许使用此方法请求相应的URL
+    '413' : 'Content Too Large', # 请求的数据过大
+    '416' : 'Range Not Satisfiable', # 请求的范围超出了文件的大小
+    '431' : 'Request Header Fields Too Large', # 请求头过大或者数量过多
     '500' : 'Internal Server Error', # 服务器内部错误
     '502' : 'Bad Gateway', # 代理服务器从上游收到了一条伪响应
     '503' : 'Service Unavailable', # 服务器此时无法提供服务，但将来可能可用
@@ -116,22 +139,63 @@ MIME_TYPES_MAP:dict = micropython.const({
     # others : "application/octet-stream"
 })
 
-_TEMPLATE_HTTPRESP:str = micropython.const ("""\
-{http_ver} {statu_code} {statu_explane}\r\n\
-{headers}\r\n\
-{content}\
-""")
-
 VERSION:str = micropython.const ('v0.1.1 aplha')
 
+HTTP_METHODS:tuple = micropython.const (("GET","POST","HEAD","PUT","DELETE","CONNECT","OPTIONS","TRACE","PATCH"))
+MAX_HEADER_SIZE:int = micropython.const (4096) # 请求行和 headers 的最大长度, 也是每个连接接收缓冲区的大小
+MAX_HEADER_COUNT:int = micropython.const (32)  # headers 的最大数量
+# send_file () 不能使用 sendfile 时, 每次读取文件的大小
+FILE_BUFFER_SIZE:int = micropython.const (1024) if _MICROPY else 65536
+USE_SENDFILE:bool = True # 支持时使用内核的零拷贝 sendfile 发送文件 (CPython)
+STATIC_CACHE_SIZE:int = micropython.const (32) # 缓存静态文件信息的数量
+STATIC_CACHE_TTL:int = micropython.const (2)    # 静态文件信息多久 (秒) 后重新检查文件是否修改
+# 静态文件的预压缩版本, 按优先级排列: (Content-Encoding, 文件后缀)
+PRECOMPRESSED:tuple = micropython.const ((("br", ".br"), ("gzip", ".gz")))
+GZIP_LEVEL:int = micropython.const (6) # 动态内容 gzip 压缩的等级
+MAX_RANGES:int = micropython.const (16) # 一个请求最多的范围数量, 超出时忽略 Range 发送整个文件
+BODY_CHUNK_SIZE:int = micropython.const (1024) if _MICROPY else 16384 # 迭代请求数据时每一段的大小
+MAX_BODY_SIZE:int = micropython.const (16384) if _MICROPY else 1048576 # 一次读取整个请求数据 (read () / json ()) 时的最大长度
+MAX_FORM_FIELDS:int = micropython.const (128) # 表单和 URL 参数最多的字段数量
+MAX_FORM_SIZE:int = micropython.const (16384) if _MICROPY else 1048576 # 表单数据的最大长度 (字节)
+# 性能统计 (enable_metrics ()) 的耗时分桶上限 (微秒), 超过最后一个的计入 +Inf
+METRICS_BUCKETS:tuple = micropython.const ((100, 500, 1000, 5000, 10000, 50000, 100000, 500000, 1000000))
+_PHASES:tuple = micropython.const (("parse", "match", "handler", "send"))
+# 访问日志 (enable_access_log ()) 的缓冲区大小 (字节) 和最长的刷新间隔 (秒)
+ACCESS_LOG_BUFFER_SIZE:int = micropython.const (512) if _MICROPY else 8192
+ACCESS_LOG_FLUSH_INTERVAL:int = micropython.const (2)
+# 路由响应缓存 (route (cache=...)) 默认的条目数量和总大小 (字节)
+RESPONSE_CACHE_SIZE:int = micropython.const (8) if _MICROPY else 128
+RESPONSE_CACHE_BYTES:int = micropython.const (8192) if _MICROPY else 4194304
+# multipart/form-data 上传: 每次读取的大小, 一个请求中保存在内存中的文件总大小, 超出后的文件写入 UPLOAD_DIR,
+# 一个请求上传的数据的最大总长度 (超出时回应 413)
+MULTIPART_BUFFER_SIZE:int = micropython.const (1024) if _MICROPY else 16384
+MULTIPART_MEMORY_SIZE:int = micropython.const (1024) if _MICROPY else 65536
+MAX_UPLOAD_SIZE:int = micropython.const (262144) if _MICROPY else 104857600
+UPLOAD_DIR:str = "" if _MICROPY else "/tmp" # "" 为当前目录
+# 流式响应 (处理函数返回生成器) 时合并小数据块的缓冲区大小, 攒够这么多数据才写出一次
+STREAM_BUFFER_SIZE:int = micropython.const (512) if _MICROPY else 16384
+# 事件循环 (poll ()) 中每个连接发送队列的最大长度 (字节), 超过时阻塞发送, 流式响应占用的内存不随响应大小增长
+LOOP_OUTPUT_LIMIT:int = micropython.const (65536)
+_WEEKDAYS:tuple = micropython.const (("Mon","Tue","Wed","Thu","Fri","Sat","Sun"))
+_MONTHS:tuple = micropython.const (("Jan","Feb","Mar","Apr","May","Jun","Jul","Aug","Sep","Oct","Nov","Dec"))
+
+# 预先编码好的响应头部, 每个响应都会用到, 不需要重复拼接和编码
+_SERVER_HEADER:bytes = ("Server: micro_route {0}\r\n".format (VERSION)).encode ()
+_STATUS_LINES:dict = {}
+for _code, _explain in STATU_CODES.items ():
+    _STATUS_LINES[_code] = "HTTP/1.1 {0} {1}\r\n".format (_code, _explain).encode ()
+_CONNECTION_KEEP_ALIVE:bytes = b"Connection: keep-alive\r\n"
+_CONNECTION_CLOSE:bytes = b"Connection: close\r\n"
+
+# 线程池队列已满时直接回应的报文
+_RESP_503:bytes = micropython.const (b"HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\nRetry-After: 1\r\nConnection: close\r\n\r\n")
+
 __REGXP_TYPE_STRING = micropython.const("([^\d][^/|.]*)")
 __REGXP_TYPE_INT = micropython.const("(\d*)")
 __REGXP_TYPE_FLOAT = micropython.const("(\d*\.?\d*)")
 __REGXP_TYPE_PATH = micropython.const("(.*)")
-__REGXP_AGREEMENT = micropython.const("(GET|POST|HEAD|PUT|DELETE|CONNECT|OPTIONS|TRACE|PATCH) (.*) (.*)")
-__REGXP_VAR_VERI = micropython.const("<(string|int|float|custom=.*):(\w+)>") # 匹配URL的规则是否为变量
+__REGXP_VAR_VERI = micropython.const("<(string|int|float|path|custom=.*):(\w+)>") # 匹配URL的规则是否为变量
 __comper_var_veri = re.compile (__REGXP_VAR_VERI)
-__comper_agreement = re.compile (__REGXP_AGREEMENT)
 # ===================CONSTS===================
 # --------------------------------------------
 
@@ -141,6 +205,7 @@ def debug_info (level:int,*args):
     """
     如果处于调试状态,打印相应的调试信息
     :param level: 0=crash 1=error 2=warn 3=info 4=debug
+    请求处理中的调用写作 `if DEBUG >= level: debug_info (level, ...)`, 关闭时不会格式化参数
     """
     if level <= DEBUG: print (*args)
 
@@ -202,9 +267,199 @@ def escape_chars (string:str) -> str:
                 string [idx] = string [idx].replace (k,v)
     return string
 
-def load_form_data (data:str):
+def _http_date (t:int) -> str:
+    """
+    将时间戳转换为 HTTP 使用的 GMT 时间格式
+    例如:
+    _http_date (784111777) -> "Sun, 06 Nov 1994 08:49:37 GMT"
+    """
+    t = time.gmtime (int (t))
+    return "{0}, {1:02d} {2} {3} {4:02d}:{5:02d}:{6:02d} GMT".format (
+        _WEEKDAYS[t[6]], t[2], _MONTHS[t[1]-1], t[0], t[3], t[4], t[5]
+    )
+
+def _accept_encodings (value:str) -> list:
+    """
+    解析 Accept-Encoding, 返回客户端可以接受的编码列表 (q=0 的除外)
+    例如:
+    _accept_encodings ("gzip, deflate, br;q=0") -> ["gzip", "deflate"]
+    """
+    result = []
+    if not value:
+        return result
+    for item in value.split (","):
+        idx = item.find (";")
+        name = (item if idx < 0 else item[:idx]).strip ().lower ()
+        if idx >= 0:
+            q = item[idx+1:].strip ()
+            if q.startswith ("q=") and q[2:].strip ().rstrip ("0").rstrip (".") in ("0", ""):
+                continue # q=0 表示不接受
+        result.append (name)
+    return result
+
+def _parse_range (value:str,size:int) -> list:
+    """
+    解析 Range 请求头, 返回 [(start, length), ...]
+    格式错误 (应当忽略 Range) 时返回 None, 所有范围都超出文件大小时返回 []
+    例如:
+    _parse_range ("bytes=0-99,-100", 1000) -> [(0, 100), (900, 100)]
+    """
+    if not value or not value.startswith ("bytes="):
+        return None
+    specs = value[6:].split (",")
+    if len (specs) > MAX_RANGES:
+        return None
+    ranges = []
+    try:
+        for spec in specs:
+            spec = spec.strip ()
+            idx = spec.find ("-")
+            if idx < 0:
+                return None
+            first, last = spec[:idx].strip (), spec[idx+1:].strip ()
+            if not first:
+                # -n : 最后 n 字节
+                n = int (last)
+                if n > 0 and size > 0:
+                    start = max (0, size - n)
+                    ranges.append ((start, size - start))
+                continue
+            start = int (first)
+            end = int (last) if last else start
+            if end < start:
+                return None
+            if not last:
+                end = size - 1
+            if start < size:
+                ranges.append ((start, min (end, size - 1) - start + 1))
+    except ValueError:
+        return None
+    return ranges
+
+def _gzip (data:bytes) -> bytes:
+    """
+    使用 gzip 压缩数据, 平台不支持时返回 None
+    """
+    if not zlib or not hasattr (zlib, "compressobj"):
+        return None
+    c = zlib.compressobj (GZIP_LEVEL, zlib.DEFLATED, 31) # wbits=31 生成 gzip 格式
+    return c.compress (data) + c.flush ()
+
+def _no_delay (sock:socket.socket):
+    """
+    关闭连接的 Nagle 算法. 响应头部和文件内容分开写出时, 小文件不需要等待客户端的延迟确认 (delayed ACK)
+    """
+    try: sock.setsockopt (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    except: pass # 部分 MicroPython 端口不支持
+
+if hasattr (time, "ticks_us"):
+    _ticks_us = time.ticks_us
+    _ticks_diff = time.ticks_diff
+else:
+    # CPython 中没有 ticks_us, 使用 perf_counter_ns 模拟
+    _ticks_us = lambda: time.perf_counter_ns () // 1000
+    _ticks_diff = lambda a, b: a - b
+
+def _mark (request,phase:int):
+    """
+    开启性能统计时, 把上一个时间点到现在的耗时计入 request._timing[phase]
+    """
+    timing = request._timing
+    if timing is not None:
+        now = _ticks_us ()
+        timing[phase] += _ticks_diff (now, timing[0])
+        timing[0] = now
+
+def _is_awaitable (obj) -> bool:
+    """
+    判断处理函数的返回值是否需要 await
+    """
+    if hasattr (obj, "__await__"):
+        return True
+    # MicroPython 的协程对象就是生成器
+    return _MICROPY and type (obj).__name__ == "generator"
+
+def _is_stream (obj) -> bool:
+    """
+    判断处理函数的返回值是否需要流式发送 (生成器, 迭代器, 异步迭代器)
+    """
+    return hasattr (obj, "__next__") or hasattr (obj, "__anext__") or type (obj).__name__ == "generator"
+
+def _get_header (headers:dict, name:str):
+    """
+    不区分大小写地获取一个 header 的值, 没有返回 None
+    """
+    v = headers.get (name)
+    if v is None:
+        name = name.lower ()
+        for k in headers:
+            if k.lower () == name:
+                return headers[k]
+    return v
+
+class _Form_Dict (dict):
+    """
+    表单数据, 重复的字段 [] 和 get () 返回第一个值, getlist () 返回全部的值
+    """
+    _lists:dict = None # 重复出现的字段 -> 全部的值
+
+    def add (self,key:str,value:str):
+        """
+        添加一个字段, 字段已经存在时保留原来的值并记录新的值
+        """
+        if key not in self:
+            self[key] = value
+            return
+        if self._lists is None:
+            self._lists = {}
+        values = self._lists.get (key)
+        if values is None:
+            self._lists[key] = [self[key], value]
+        else:
+            values.append (value)
+
+    def getlist (self,key:str) -> list:
+        """
+        获取一个字段全部的值, 没有该字段时返回 []
+        """
+        if self._lists and key in self._lists:
+            return self._lists[key]
+        return [self[key]] if key in self else []
+
+_HEX_BYTES:dict = {} # 已经解码过的 %XX -> bytes, 解码时逐渐填充
+_HEX_DIGITS:bytes = b"0123456789abcdefABCDEF"
+
+def _unquote (data:bytes) -> bytes:
+    """
+    一次解码整段数据中的 %XX, 不合法的编码原样保留
+    例如:
+    _unquote (b"a%20b%26c") -> b"a b&c"
     """
-    传入一个bytes或者str,将其解析成Python的dict对象,用于解析HTML的表单数据
+    try:
+        # CPython: 把 %XX 变为 \xXX 后交给 C 实现的 unicode_escape 解码, 比逐段拼接快很多
+        return data.replace (b"\\", b"%5C").replace (b"%", b"\\x").decode ("unicode_escape").encode ("latin-1")
+    except:
+        pass # MicroPython 没有 unicode_escape, 或者有不合法的编码
+    parts = data.split (b"%")
+    out = [parts[0]]
+    for part in parts[1:]:
+        byte = _HEX_BYTES.get (part[:2])
+        if byte is None:
+            # int () 会接受空白和正负号, 所以先检查两个字符都是十六进制数字
+            if len (part) < 2 or part[0] not in _HEX_DIGITS or part[1] not in _HEX_DIGITS:
+                out.append (b"%" + part)
+                continue
+            byte = bytes ((int (part[:2], 16),))
+            _HEX_BYTES[part[:2]] = byte
+        out.append (byte)
+        if len (part) > 2: out.append (part[2:])
+    return b"".join (out)
+
+def load_form_data (data,max_fields:int=MAX_FORM_FIELDS,max_size:int=MAX_FORM_SIZE) -> _Form_Dict:
+    """
+    传入一个bytes或者str,将其解析成 dict 对象,用于解析 URL 参数和 application/x-www-form-urlencoded 表单
+    会解码 %XX 和 +, 重复的字段可以通过 getlist () 获取全部的值.
+    数据超过 max_size 字节或者字段超过 max_fields 个时抛出 ValueError ("413"), 不是 UTF-8 时抛出 ValueError ("400")
     例如:
     load_form_data ("user_name=abc&user_passwd=123456")
     -> {
@@ -212,20 +467,77 @@ def load_form_data (data:str):
         "user_passwd" : "123456"
     }
     """
-    if type (data) == bytes:
-        data = data.decode (charset)
+    if type (data) == str:
+        data = data.encode (charset)
+    if len (data) > max_size:
+        raise ValueError ("413")
+
+    obj = _Form_Dict ()
+    if not data:
+        return obj
+    amps = data.count (b"&")
+    if amps >= max_fields:
+        raise ValueError ("413")
+    if b"+" in data:
+        data = data.replace (b"+", b" ") # + 不会是分隔符, 可以一次全部替换
+    try:
+        if b"%" not in data:
+            # 没有需要解码的字符, 整体转换为 str 后直接分割
+            fields, sep = data.decode (charset).split ("&"), "="
+        else:
+            # 整段数据只解码一次: 先把分隔符 & = 换成控制字符 \x00 \x01,
+            # 这样解码出来的 & = (%26 %3D) 不会被当作分隔符
+            text = _unquote (data.replace (b"&", b"\x00").replace (b"=", b"\x01"))
+            if text.count (b"\x00") == amps and text.count (b"\x01") == data.count (b"="):
+                fields, sep = text.decode (charset).split ("\x00"), "\x01"
+            else:
+                # 数据中本来就有 \x00 \x01 (例如 %00), 逐个字段解码
+                fields, sep = [], "="
+                for field in data.split (b"&"):
+                    idx = field.find (b"=")
+                    if idx < 0:
+                        fields.append (_unquote (field).decode (charset))
+                    else:
+                        fields.append ((_unquote (field[:idx]).decode (charset), _unquote (field[idx+1:]).decode (charset)))
+    except UnicodeError:
+        raise ValueError ("400")
+
+    for field in fields:
+        if type (field) == tuple:
+            key, value = field
+        else:
+            if not field:
+                continue
+            idx = field.find (sep)
+            if idx < 0:
+                key, value = field, ""
+            else:
+                key, value = field[:idx], field[idx+1:]
+                if sep == "\x01" and "\x01" in value:
+                    value = value.replace ("\x01", "=") # 只有第一个 = 是分隔符, 值中其他的 = 原样保留
+        if key in obj: obj.add (key, value)
+        else: obj[key] = value
+    return obj
 
-    obj = {}
-    data:list = data.split ("&")
+def _json_loads (data):
+    """
+    直接从 bytes / bytearray 解析 JSON, 不需要先 decode 成 str. 不是合法的 JSON 时抛出 ValueError ("400")
+    """
+    try:
+        try:
+            return json.loads (data)
+        except TypeError:
+            return json.loads (bytes (data).decode (charset)) # 只接受 str 的 json 模块
+    except ValueError:
+        raise ValueError ("400")
 
-    if not data == ['']: # data 有数据时再进行解析
-        data = escape_chars (data)
-        for line in data:
-            idx = line.find ("=")
-            # arg_name  : line [:idx]
-            # arg_value : line [idx+1:]
-            obj [line [:idx]] = line [idx+1:]
-    return obj
+def _error_code (e:Exception) -> str:
+    """
+    处理函数发生错误时回应的状态码, 解析请求时抛出的 ValueError ("4xx") 使用其中的状态码
+    """
+    if type (e) == ValueError and e.args and type (e.args[0]) == str and e.args[0][:1] == "4" and e.args[0] in STATU_CODES:
+        return e.args[0]
+    return "500"
 
 def _translate_rule (rule:str) -> tuple:
     """
@@ -268,298 +580,2157 @@ def _translate_rule (rule:str) -> tuple:
     rule = "^" + make_path(rule) + "/?(\?.*)?$"
     
     return (rule,url_vars)
-# =============Helper functions===============
-# --------------------------------------------
-class __Request ():
+
+def _split_rule (rule:str) -> tuple:
     """
-    用来获取请求的一些信息
+    将一个普通的路由字符串拆分为静态段和变量段, 用于构建路由树
+    :param rule: 欲拆分的规则文本
+    :return (segments:list, url_vars:list)
+    静态段为 str, 变量段为 (var_type, regex), regex 仅 custom 类型有值
+    例子:
+    => '/api/<int:gid>/info'
+    <= (['api', ('int', None), 'info'], [('gid', int)])
     """
-    method:str       = "" # 请求方式,一般为 (GET|POST|HEAD|PUT|DELETE|CONNECT|OPTIONS|TRACE|PATCH)
-    url:str          = "" # 请求的URL
-    http_version:str = "" # 报文的HTTP协议版本
-    headers:dict     = {} # HTTP报文的 Headers
-    addr:tuple       # 请求的TCP地址 (ip,port)
-    form:dict        = {} # method = post 时可用
-    args:dict        = {}
-    data:bytes       = b""
-    client:socket.socket
-    def __init__ (self,sock:socket.socket,addr:tuple,head:str,headers:str,content:str=None):
-        #head => ('GET','/',"HTTP/1.1")
-        self.method ,  self.url , self.http_version = head
-        self.addr = addr
-        self.headers = headers
-        self.client = sock
+    segments:list = []
+    url_vars:list = []
 
-        if "?" in self.url:
-            # 解析参数
-            idx = self.url.find ("?")
-            self.args = load_form_data (self.url[idx+1:])
-            self.url = self.url[:idx]
-            
-    def recv_data (self,bufsize:int=4096) -> bytes:
-        """
-        当请求为POST或者PUT时,服务器可能会接受到较大的数据.
-        这些数据的大小可能会超出芯片内存的限制, 所以程序默认不读取请求的数据.
-        可以调用本对象的 dump_data() 把表单或者 json 数据转换为 python 数据并返回.
-        """
-        self.client.recv_into ()
-        return self.client.recv (bufsize)
-    
-    # TODO: recv_data_into
+    for i in split_url (parse_url (rule)):
+        if segments and segments[-1] == ("path", None):
+            # path 会吃掉剩余的 URL, 后面的段永远不会被匹配
+            raise TypeError ("No segments are allowed after a path variable: {0}".format (rule))
+        m = __comper_var_veri.match (i)
+        if not m:
+            segments.append (i) # 静态段
+            continue
+
+        var_type = m.group (1)
+        if var_type == "string" or var_type == "path":
+            segments.append ((var_type, None))
+            url_vars.append ((m.group (2),))
+        elif var_type == "int":
+            segments.append ((var_type, None))
+            url_vars.append ((m.group (2),int))
+        elif var_type == "float":
+            segments.append ((var_type, None))
+            url_vars.append ((m.group (2),float))
+        elif var_type.startswith ("custom="):
+            # 自定义规则只作用于单个路径段, 在注册时预先编译
+            segments.append (("custom", re.compile ("^" + var_type[7:] + "$")))
+            url_vars.append ((m.group (2),))
+        else:
+            raise TypeError ("Cannot resolving this variable: {0}".format (i))
 
-class __SESSION ():
+    return (segments,url_vars)
+
+def _match_segment (var_type:str, regex, seg:str):
     """
-    利用COOKIE实现的SESSION对话
+    检查一个 URL 段是否符合变量类型, 符合返回变量的文本, 否则返回 None
+    除 custom 外均不使用正则表达式
+    """
+    if var_type == "string":
+        # 等价于 ([^\d][^/|.]*)
+        if seg[0] in "0123456789" or seg.find (".",1) >= 0 or seg.find ("|",1) >= 0:
+            return None
+        return seg
+    if var_type == "int":
+        return seg if seg.isdigit () else None
+    if var_type == "float":
+        # 最多一个小数点, 且至少有一个数字
+        return seg if seg.replace (".","",1).isdigit () else None
+    if var_type == "custom":
+        m = regex.match (seg)
+        if not m:
+            return None
+        try: return m.group (1)
+        except: return m.group (0) # 规则中没有分组
+    return None
+# =============Helper functions===============
+# --------------------------------------------
+
+# ++++++++++++++++++++++++++++++++++++++++++++
+# =================Route tree=================
+_NO_ROUTE = micropython.const (0x3fffffff) # 空子树的序号
+
+class _Route_Node ():
+    """
+    路由树的节点
     """
-    # TODO
     def __init__ (self):
-        pass
+        self.static:dict  = {}       # 静态段 -> 子节点, 使用字典直接查找
+        self.dynamic:list = []       # [(var_type, regex, 子节点), ...]
+        self.routes:list  = []       # 在此节点结束的路由 [(序号, route), ...]
+        self.first:int    = _NO_ROUTE # 子树中最先注册的路由序号, 用于剪枝
 
-class __Response ():
+class _Route_Tree ():
     """
-    用于回应浏览器发起的请求, 可以在处理函数中使用 return 返回内容, 程序将自动处理
-    如果您使用了 send () 或者 close () , 处理函数的返回值会自动被忽略.
+    按路径段组织的路由前缀树, 每个请求方式 (method) 一棵.
+    纯静态的规则直接放在字典中, 一次查找即可命中;
+    含变量的规则放在树中, 静态段通过字典查找, 变量段按类型检查, 只有 custom 类型会运行正则.
+    当多个规则同时匹配一个 URL 时, 依然是最先注册的规则生效.
     """
-    headers:dict = {
-        "Server" : "micro_route {0}".format (VERSION),
-    }
+    def __init__ (self):
+        self.root = _Route_Node ()
+        self.static:dict = {}            # "/api/goods" -> (序号, route)
+        self.first_dynamic:int = _NO_ROUTE # 最先注册的变量路由的序号
 
-    _responsed:bool = False # 是否已经回应过
-    _closed:bool = False
-    __header_sended = False
+    def insert (self,idx:int,rule:str,route:dict):
+        """
+        将一条路由插入树中, idx 为注册序号, route 中的 url_vars 由本函数填充
+        """
+        segments, route["url_vars"] = _split_rule (rule)
 
-    client:socket.socket
-    mime_type:str = "text/html" # 默认mime类型
-    statu_code:str = "200" # 默认状态
+        if not route["url_vars"]:
+            # 纯静态规则, 重复注册时保留先注册的
+            key = make_path (segments)
+            if key not in self.static:
+                self.static[key] = (idx, route)
+            return
 
+        if self.first_dynamic == _NO_ROUTE: self.first_dynamic = idx
+        node = self.root
+        if node.first == _NO_ROUTE: node.first = idx
+        for seg in segments:
+            if type (seg) == str:
+                child = node.static.get (seg)
+                if not child:
+                    child = node.static[seg] = _Route_Node ()
+            else:
+                var_type, regex = seg
+                child = None
+                for tp, rx, nd in node.dynamic:
+                    # 同类型的变量段共用一个节点 (custom 需要规则相同)
+                    if tp == var_type and (rx is None or rx is regex or rx.pattern == regex.pattern):
+                        child = nd
+                        break
+                if not child:
+                    child = _Route_Node ()
+                    node.dynamic.append ((var_type, regex, child))
+            node = child
+            if node.first == _NO_ROUTE: node.first = idx
+        node.routes.append ((idx, route))
+
+    def match (self,url:str):
+        """
+        查找匹配的路由, 返回 (route, values) 或者 None
+        values 为按顺序排列的变量文本
+        """
+        hit = self.static.get (url.rstrip ("/") or "/")
+        if hit:
+            if hit[0] < self.first_dynamic:
+                return (hit[1], ()) # 快速通道: 没有更早注册的变量路由
+            best = [hit[0], hit[1], ()]
+        else:
+            best = [_NO_ROUTE, None, None]
+
+        if self.first_dynamic < best[0]:
+            self.__walk (self.root, split_url (url), 0, [], best)
+        if best[1] is None:
+            return None
+        return (best[1], best[2])
+
+    def __walk (self,node:_Route_Node,segs:list,pos:int,values:list,best:list):
+        if node.first >= best[0]:
+            return # 子树中不可能有更早注册的路由
+
+        if pos == len (segs):
+            if node.routes and node.routes[0][0] < best[0]:
+                best[0], best[1] = node.routes[0]
+                best[2] = list (values)
+            return
 
-    def __init__ (self,sock:socket.socket):
-        self.client = sock
+        seg = segs[pos]
+        child = node.static.get (seg)
+        if child:
+            self.__walk (child, segs, pos + 1, values, best)
 
-    def __dump_headers (self) -> str:
+        for var_type, regex, child in node.dynamic:
+            if var_type == "path":
+                values.append ("/".join (segs[pos:]))
+                self.__walk (child, segs, len (segs), values, best)
+            else:
+                value = _match_segment (var_type, regex, seg)
+                if value is None:
+                    continue
+                values.append (value)
+                self.__walk (child, segs, pos + 1, values, best)
+            values.pop ()
+# =================Route tree=================
+# --------------------------------------------
+
+# ++++++++++++++++++++++++++++++++++++++++++++
+# =================Work queue=================
+class _Work_Queue ():
+    """
+    有容量限制的任务队列, 只依赖 _thread 的锁, MicroPython 上也可以使用.
+    put () 在队列满时立刻返回 False, get () 在队列空时阻塞.
+    """
+    def __init__ (self,size:int):
+        self.size = size
+        self.items:list = []
+        self.max_depth:int = 0 # 出现过的最大队列长度
+        self.__mutex = _thread.allocate_lock ()
+        self.__signal = _thread.allocate_lock () # 有任务时处于释放状态
+        self.__signal.acquire ()
+
+    def __wakeup (self):
+        try: self.__signal.release ()
+        except: pass # 已经是释放状态
+
+    def put (self,item,force:bool=False) -> bool:
         """
-        将一个dict类型的header变为str
+        放入一个任务, 队列已满时返回 False, force 为 True 时忽略容量限制
         """
-        s = ""
-        for k, v in self.headers.items ():
-            s += k + ": " + str(v) + "\r\n"
-        return s
+        with self.__mutex:
+            if not force and len (self.items) >= self.size:
+                return False
+            self.items.append (item)
+            if len (self.items) > self.max_depth:
+                self.max_depth = len (self.items)
+        self.__wakeup ()
+        return True
 
-    def send_header (self,
-        statu_explane:str = None,
-        content:str = ""
-    ):
+    def get (self):
         """
-        发送响应的头部内容(包括状态码), 然后你可以使用 send () 自定义发送你想要的数据.
-        可以传入一个dict,将会在默认 headers 的基础上添加作为 headers 的内容.
-        例如:
-            send_header ({
-                "Content-Type" : "text/plain"
-            })
+        取出一个任务, 队列为空时阻塞等待
         """
+        while True:
+            with self.__mutex:
+                if self.items:
+                    item = self.items.pop (0)
+                    if self.items:
+                        self.__wakeup () # 还有任务, 唤醒其他工作线程
+                    return item
+            self.__signal.acquire ()
+# =================Work queue=================
+# --------------------------------------------
 
-        if statu_explane: self.statu_explane = statu_explane
-        else: self.statu_explane = STATU_CODES.get (self.statu_code,"")
-        
-        self.headers["Content-Type"] = self.mime_type
-        self.headers["Connection"] = "close"
+# ++++++++++++++++++++++++++++++++++++++++++++
+# ================HTTP parser=================
+class _Recv_Buffer ():
+    """
+    连接的接收缓冲区, 同一个连接上的所有请求共用.
+    请求头读完后多读到的数据会留在缓冲区中, 作为报文或者下一个请求的开头.
+    """
+    __slots__ = ("buf", "mv", "start", "end", "scanned", "sock", "__recv_into")
 
-        try:
-            self.client.send (_TEMPLATE_HTTPRESP.format (
-                http_ver="HTTP/1.1",
-                statu_code=self.statu_code,
-                statu_explane=self.statu_explane,
-                headers = self.__dump_headers (),
-                content= content
-            ).encode (charset))
-            self.__header_sended = True
-            debug_info (3,"header sended.")
-        except:
-            raise TimeoutError ("Faild to send headers.")
+    def __init__ (self,sock=None,size:int=MAX_HEADER_SIZE):
+        self.buf = bytearray (size)
+        self.mv = memoryview (self.buf)
+        self.attach (sock)
 
-    def send (self,content:str):
+    def attach (self,sock):
         """
-        向客户发送数据,建议数据不宜过大,可能造成发送不完整
-        如果需要发送大量数据可以使用流式多次调用send()发送
-        如果您在相应期间调用过 send () , 那么您的处理函数返回的数据将会被忽略.
+        把缓冲区交给一个新的连接使用, 丢弃之前的数据. 工作线程用它在连接之间复用缓冲区
         """
-        if not self.__header_sended:
-            self.send_header ()
-
-        try:
-            if type (content) == bytes:
-                self.client.send (content)
-            else:
-                self.client.send (content.encode (charset))
-            self._responsed = True
-        except:
-            raise TimeoutError ("Can not send data.")
+        self.start = 0   # 未处理数据的开始位置
+        self.end = 0     # 未处理数据的结束位置
+        self.scanned = 0 # 已经找过 \r\n\r\n 的位置, 避免重复扫描
+        self.sock = sock
+        # MicroPython 的 socket 没有 recv_into
+        self.__recv_into = getattr (sock, "recv_into", None)
+
+    def pending (self) -> int:
+        """
+        缓冲区中未处理的数据长度
+        """
+        return self.end - self.start
 
-    def redirect (self,location:str,statu_code:str="302"):
+    def space (self) -> memoryview:
         """
-        将请求重定向到另一个地址
-        :param location   : 欲重定向的地址.
-        :param statu_code : http 状态码 , 302:临时定向 301:永久定向
-        例子: response.redirect ('https://www.baidu.com/') 重定向至百度
+        返回可以写入数据的空间, 必要时把未处理的数据移动到缓冲区开头
+        """
+        if self.start:
+            n = self.end - self.start
+            if n:
+                self.buf[:n] = self.mv[self.start:self.end]
+            self.scanned -= self.start
+            self.start = 0
+            self.end = n
+        return self.mv[self.end:]
+
+    def fill (self) -> int:
         """
+        从 socket 读取一次数据, 返回读取的长度, 连接关闭时返回 0
+        """
+        space = self.space ()
+        if self.__recv_into:
+            n = self.__recv_into (space)
+        else:
+            data = self.sock.recv (len (space))
+            n = len (data)
+            space[:n] = data
+        self.end += n
+        return n
 
-        self.headers ["Location"] = location
-        self.statu_code = statu_code
-        self.send_header ()
-        self._responsed = True
-        self.close ()
+    def load (self,data:bytearray):
+        """
+        把已经收到的全部数据作为缓冲区的内容, 不复制 (事件循环中收完的请求数据)
+        """
+        self.buf = data
+        self.mv = memoryview (data)
+        self.start = self.scanned = 0
+        self.end = len (data)
 
-    def close (self):
+    def feed (self,data:bytes):
         """
-        关闭客户发起的请求,此函数将会关闭
+        放入从其他地方 (例如 asyncio 的 StreamReader) 读取的数据
         """
-        if not self._closed:
-            self.client.close ()
-            self._responsed = True
-            self._closed = True
+        n = len (data)
+        self.space ()[:n] = data
+        self.end += n
 
-    def abort (self,statu_code:str=500,content:str="",statu_explane=None):
+    def find_head (self) -> int:
         """
-        中断请求, 发送一个 statu code 后关闭连接
+        查找请求头的结束位置 (\r\n\r\n 之后), 没有找到返回 -1
         """
-        if content: self.headers["Content-Length"] = len (content)
-        self.statu_code = statu_code
-        self.send_header (statu_explane=statu_explane,content=content)
-        self._responsed = True
-        self.close ()
+        idx = self.buf.find (b"\r\n\r\n", max (self.start, self.scanned - 3), self.end)
+        if idx < 0:
+            self.scanned = self.end
+            return -1
+        return idx + 4
 
-    def send_file (self,path:str) -> bool:
+    def take (self,n:int) -> bytes:
         """
-        传入url,发送本地的静态文件
-        :param path: 文件位于Flash中的绝对路径
-        成功返回True
-        失败返回False
+        取出最多 n 字节未处理的数据
         """
-        try:
-            file = os.stat (path)
-            if file [0] == 16384: # 如果是文件夹,放弃
-                return False
-            file_size = file[6]
-            #没报错就是找到文件了
-            debug_info (4, "found static file: ", path)
-            suffix = path[path.rfind ('.'):]
-            # 设定文档类型
-            self.mime_type = MIME_TYPES_MAP.get (suffix.lower (),"application/octet-stream")
-            self.headers.update(
-                {"Content-Length": str(file_size)}
-            ) # 将文件大小设置进 header
+        n = min (n, self.end - self.start)
+        data = bytes (self.mv[self.start:self.start + n])
+        self.start += n
+        if self.scanned < self.start: self.scanned = self.start
+        return data
 
-            self.send_header ()
-            # 分片传输文件, 一片 1k
-            with open (path, 'rb') as file:
-                try :
-                    buf = bytearray(1024)
-                    while file_size > 0 :
-                        x = file.readinto(buf,1024)
-                        if x < len(buf):
-                            buf = memoryview(buf)[:x]
-                        if not self.client.write (buf):
-                            return False
-                        file_size -= x
-                    debug_info (3, "send static file succeed.")
-                    return True
-                except:
-                    debug_info (3, "send static file faild")
-                    return False
-        except: # 报错说明没找到
-            debug_info (4, "not found static file: ", path)
-            self.abort (404)
-            return False
+    def take_into (self,buf) -> int:
+        """
+        把未处理的数据写入 buf 中, 返回写入的长度
+        """
+        n = min (len (buf), self.end - self.start)
+        buf[:n] = self.mv[self.start:self.start + n]
+        self.start += n
+        if self.scanned < self.start: self.scanned = self.start
+        return n
 
-class Context ():
-    request:__Request
-    session:__SESSION
-    response:__Response
-    def __init__ (self,request:__Request, response:__Response, session:__SESSION = None):
-        self.request = request
-        self.response = response
-        self.session = session
+class _Headers ():
+    """
+    请求的 headers, 解析请求时不做任何处理, 某个 header 被访问时才在原始数据中查找并解码.
+    名称不区分大小写, 用法与 dict 相同.
+    """
+    def __init__ (self,raw:bytes,start:int):
+        self._raw = raw     # 整个请求头, 包括结尾的空行
+        self._start = start # 请求行结尾的 \r\n 的位置
+        self._lower = None  # 转为小写的请求头, 第一次查找时生成
+        self._cache = {}    # 已经解码的 header: 小写名称 -> 值
+
+    def get (self,name:str,default=None):
+        key = name.lower ()
+        v = self._cache.get (key)
+        if v is not None:
+            return v
+        if self._lower is None:
+            self._lower = self._raw.lower ()
+        pattern = b"\r\n" + key.encode () + b":"
+        idx = self._lower.find (pattern, self._start)
+        if idx < 0:
+            return default
+        idx += len (pattern)
+        v = self._raw[idx:self._raw.find (b"\r\n", idx)].decode ().strip ()
+        self._cache[key] = v
+        return v
+
+    def __getitem__ (self,name:str):
+        v = self.get (name)
+        if v is None:
+            raise KeyError (name)
+        return v
+
+    def __contains__ (self,name:str) -> bool:
+        return self.get (name) is not None
+
+    def items (self) -> list:
+        result = []
+        for line in self._raw[self._start+2:].split (b"\r\n"):
+            idx = line.find (b":")
+            if idx > 0:
+                result.append ((line[:idx].decode (), line[idx+1:].decode ().strip ()))
+        return result
+
+    def keys (self) -> list:
+        return [k for k, v in self.items ()]
+
+    def __iter__ (self):
+        return iter (self.keys ())
+
+    def __len__ (self) -> int:
+        return len (self.items ())
+
+    def __repr__ (self) -> str:
+        return repr (dict (self.items ()))
+
+def _parse_head (block:bytes) -> tuple:
+    """
+    解析请求头 (包括结尾的空行), 返回 ([method, url, http_version], headers)
+    只解析请求行, headers 在访问时才会解码.
+    报文错误时抛出 ValueError, 参数为应当回应的状态码
+    """
+    pos = 0
+    while block.startswith (b"\r\n", pos):
+        pos += 2 # 忽略请求之间多余的空行
+
+    # 请求行
+    end = block.find (b"\r\n", pos)
+    head = block[pos:end].split (b" ")
+    if len (head) != 3:
+        raise ValueError ("400")
+    head = [head[0].decode (), head[1].decode (), head[2].decode ()]
+    if head[0] not in HTTP_METHODS or not head[2].startswith ("HTTP/"):
+        raise ValueError ("400")
+
+    # 请求头以 \r\n\r\n 结束, 除去请求行和结尾的空行就是 headers 的数量
+    if block.count (b"\r\n", end) - 2 > MAX_HEADER_COUNT:
+        raise ValueError ("431")
+    headers = _Headers (block, end)
+    length = headers.get ("Content-Length")
+    if length is not None and not length.isdigit ():
+        raise ValueError ("400") # 负数或者不是数字的 Content-Length
+    return (head, headers)
+
+def _error_response (statu_code:str) -> bytes:
+    """
+    生成一个没有内容的错误回应报文, 用于还没有创建 context 的情况
+    """
+    return "HTTP/1.1 {0} {1}\r\nContent-Length: 0\r\nConnection: close\r\n\r\n".format (
+        statu_code, STATU_CODES.get (statu_code, "")
+    ).encode ()
+# ================HTTP parser=================
+# --------------------------------------------
 
-class MICRO_ROUTE ():
-    bind_ip:str
-    bind_port:int
-    root_path:str
-    __SOCK:socket.socket
-    __routes:list = []
-    
-    # __routes = [
-    #     {
-    #         "rule"      : '/api/goods/([^\d][^/|.]*)/(\d*)/'
-    #         "func"      : function ()
-    #         "method"    : "GET"
-    #         "url_vars"  : [
-    #               ('goods_name', ), # str,缺省,减少转换步骤
-    #               ('gid', int)
-    #         ]
-    #     },
-    #     ...
-    # ]
+# ++++++++++++++++++++++++++++++++++++++++++++
+# =================File cache=================
+def _mime_type (path:str) -> str:
+    """
+    根据文件后缀获取 MIME 类型
+    """
+    suffix = path[path.rfind ('.'):]
+    return MIME_TYPES_MAP.get (suffix.lower (),"application/octet-stream")
 
-    def __init__ (self,
-        bind_ip:str     = "0.0.0.0",
-        bind_port:int   = 80,
-        root_path:str   = '/www',
-        sock_family:int = socket.AF_INET
-    ):
+class _File_Info ():
+    """
+    静态文件的信息, 包括预先编码好的 headers (不包括 Content-Type 和 Content-Length)
+    """
+    def __init__ (self,path:str,st:tuple,mime:str=None,encoding:str=None,vary:bool=False):
         """
-        实例化一个micro_route, 然后开始你的嵌入式编程之旅.
-        :param bind_ip   : 绑定的IP,默认为 "0.0.0.0",
-        :param bind_port : 绑定的端口,默认为 80
-        :param root_path : 静态文件的存放路径,默认为 '/www'
+        :param mime     : 文件的 MIME 类型, 默认根据后缀判断
+        :param encoding : 文件的 Content-Encoding, 用于预压缩的文件
+        :param vary     : 是否需要发送 Vary: Accept-Encoding
         """
-        self.bind_ip = bind_ip
-        self.bind_port = bind_port
-        self.sock_family = sock_family
+        self.path:str = path
+        self.size:int = st[6]
+        self.mtime:int = int (st[8])
+        self.mime:str = mime or _mime_type (path)
+        self.encoding:str = encoding
+        self.etag:str = '"{0:x}-{1:x}"'.format (self.mtime, self.size)
+        self.last_modified:str = _http_date (self.mtime)
+        headers = "ETag: {0}\r\nLast-Modified: {1}\r\nAccept-Ranges: bytes\r\n".format (
+            self.etag, self.last_modified
+        )
+        if encoding: headers += "Content-Encoding: {0}\r\n".format (encoding)
+        if vary: headers += "Vary: Accept-Encoding\r\n"
+        self.headers:bytes = headers.encode (charset)
+        self.variants:dict = {} # 预压缩的版本: Content-Encoding -> _File_Info
+        self.checked = time.time () # 上一次检查文件的时间
 
-        # 清除结尾的 /
-        if root_path.endswith ("/"): root_path = root_path [:-1]
-        self.root_path = root_path.replace ('../', '/')
+def _stat_file (path:str) -> tuple:
+    """
+    获取文件的 stat, 文件不存在或者是文件夹时返回 None
+    """
+    try:
+        st = os.stat (path)
+    except:
+        return None
+    if st[0] & 0xF000 == 0x4000: # 文件夹
+        return None
+    return st
 
-    def append_to_route_tree (self,rule:str,func:object,method:str,auto_recv:bool):
+def _load_file (path:str,st:tuple) -> _File_Info:
+    """
+    创建文件信息, 同时查找同目录下预压缩的版本 (例如 app.js.gz)
+    """
+    variants = {}
+    mime = _mime_type (path)
+    for encoding, suffix in PRECOMPRESSED:
+        vst = _stat_file (path + suffix)
+        if vst:
+            variants[encoding] = _File_Info (path + suffix, vst, mime, encoding, True)
+    info = _File_Info (path, st, mime, None, bool (variants))
+    info.variants = variants
+    return info
+
+class _File_Cache ():
+    """
+    静态文件信息的缓存, 以路径为键, 最多保存 size 个文件 (包括不存在的文件).
+    缓存超过 ttl 秒后会重新检查文件, 文件修改后缓存自动失效.
+    预压缩的文件只在原文件修改时重新查找, 单独修改它们后需要调用 invalidate ().
+    多线程模式下所有工作线程共用, 修改时加锁.
+    """
+    def __init__ (self,size:int=STATIC_CACHE_SIZE,ttl:int=STATIC_CACHE_TTL):
+        self.__mutex = _thread.allocate_lock () if _thread else None
+        self.size = size
+        self.ttl = ttl
+        self.entries:dict = {} # path -> _File_Info, 不存在的文件为 (None, 检查时间)
+
+    def get (self,path:str) -> _File_Info:
         """
-        添加到路由解析树中
+        获取文件信息, 文件不存在时返回 None
         """
-        rule , url_vars = _translate_rule (rule)
-        
-        debug_info (4,"append a route: " ,
-            {
-                "rule"      : rule,
-                "func"      : func,
-                "method"    : method,
-                "url_vars"  : url_vars,
-                "auto_recv" : auto_recv
-            }
-        )
-        self.__routes.append ({
-            "rule"      : rule,
-            "func"      : func,
-            "method"    : method,
-            "url_vars"  : url_vars,
-            "auto_recv" : auto_recv
-        })
-        gc.collect ()
-
-    def route (self,rule:str='/',method:str="GET",auto_recv:bool=True):
+        if self.__mutex: self.__mutex.acquire ()
+        try:
+            now = time.time ()
+            entry = self.entries.pop (path, None)
+            if entry is None:
+                if self.entries and len (self.entries) >= self.size:
+                    # 淘汰最久没有使用的 (MicroPython 的 dict 无序, 此时为任意一个)
+                    self.entries.pop (next (iter (self.entries)))
+                st = _stat_file (path)
+                entry = _load_file (path, st) if st else (None, now)
+            elif now - (entry[1] if type (entry) == tuple else entry.checked) >= self.ttl:
+                st = _stat_file (path)
+                if st and type (entry) != tuple and int (st[8]) == entry.mtime and st[6] == entry.size:
+                    entry.checked = now # 文件没有修改, 继续使用原来的信息
+                else:
+                    entry = _load_file (path, st) if st else (None, now)
+            if self.size:
+                self.entries[path] = entry # 重新插入, 最近使用的排在最后
+            return None if type (entry) == tuple else entry
+        finally:
+            if self.__mutex: self.__mutex.release ()
+
+    def invalidate (self,path:str=None):
         """
-        :param rule      : 响应的URL,支持变量方式定义,必须以 `/` 开头
-        :param method    : 响应的方式 GET | POST ...
-        :param auto_recv : 仅在 method 为 POST 或者 PUT 时可用\
-            由于传输的数据可能过大,可以控制程序是否自动解析客户端发送的数据
-            若为 False, 可以使用 context.request.recv_data () 
-            手动获取用户发送的数据.
+        使某个文件的缓存失效, 不传入 path 时清空全部缓存
+        """
+        if self.__mutex: self.__mutex.acquire ()
+        try:
+            if path is None:
+                self.entries.clear ()
+            else:
+                self.entries.pop (path, None)
+        finally:
+            if self.__mutex: self.__mutex.release ()
 
-        添加一个分发路由到服务器中.
-        当添加多个规则同时匹配到一个URL时,只会相应最先添加的那个函数
-        定义URL变量:
-        使用 <type:var_name> 方式定义
-        例如:
-            @app.route ("/api/<string:api_name>/<int:numbers>")
-            def api (context:micro_web.Context, api_name:str, numbers:int,**kwargs):
+class _Response_Cache ():
+    """
+    路由的响应缓存, 保存编码好的完整响应 (不包括 Connection 头部), 命中时不再调用处理函数.
+    以 URL (包括参数) 和 vary 中的请求头为键, 超过 ttl 秒后失效,
+    条目数量或者总大小超出限制时淘汰最久没有使用的. 多线程模式下所有工作线程共用, 修改时加锁.
+    """
+    def __init__ (self,ttl:int,size:int=RESPONSE_CACHE_SIZE,max_bytes:int=RESPONSE_CACHE_BYTES,vary:tuple=()):
+        self.__mutex = _thread.allocate_lock () if _thread else None
+        self.ttl = ttl
+        self.size = size
+        self.max_bytes = max_bytes
+        self.vary = vary
+        self.entries:dict = {} # key -> (过期时间, url, head, body)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key (self,request) -> str:
+        key = request.url + "?" + request._query if request._query else request.url
+        for name in self.vary:
+            key += "\n" + (_get_header (request.headers, name) or "")
+        return key
+
+    def get (self,key:str) -> tuple:
+        """
+        获取缓存的响应 (过期时间, url, head, body), 没有或者已经过期时返回 None
+        """
+        if self.__mutex: self.__mutex.acquire ()
+        try:
+            entry = self.entries.pop (key, None)
+            if entry is not None and time.time () < entry[0]:
+                self.entries[key] = entry # 重新插入, 最近使用的排在最后
+                self.hits += 1
+                return entry
+            if entry is not None:
+                self.bytes -= len (entry[2]) + len (entry[3])
+            self.misses += 1
+            return None
+        finally:
+            if self.__mutex: self.__mutex.release ()
+
+    def put (self,key:str,url:str,head:bytes,body:bytes):
+        n = len (head) + len (body)
+        if n > self.max_bytes or not self.size:
+            return
+        if self.__mutex: self.__mutex.acquire ()
+        try:
+            self.__remove (key)
+            while self.entries and (len (self.entries) >= self.size or self.bytes + n > self.max_bytes):
+                # 淘汰最久没有使用的 (MicroPython 的 dict 无序, 此时为任意一个)
+                self.__remove (next (iter (self.entries)))
+                self.evictions += 1
+            self.entries[key] = (time.time () + self.ttl, url, head, body)
+            self.bytes += n
+        finally:
+            if self.__mutex: self.__mutex.release ()
+
+    def __remove (self,key:str):
+        entry = self.entries.pop (key, None)
+        if entry is not None:
+            self.bytes -= len (entry[2]) + len (entry[3])
+
+    def invalidate (self,url:str=None):
+        """
+        删除某个 URL (包括所有参数) 的缓存, 不传入 url 时清空全部缓存
+        """
+        if self.__mutex: self.__mutex.acquire ()
+        try:
+            if url is None:
+                self.entries.clear ()
+                self.bytes = 0
+                return
+            for key in [k for k, e in self.entries.items () if e[1] == url]:
+                self.__remove (key)
+        finally:
+            if self.__mutex: self.__mutex.release ()
+# =================File cache=================
+# --------------------------------------------
+
+# ++++++++++++++++++++++++++++++++++++++++++++
+# ==================Metrics===================
+def _bucket (us:int) -> int:
+    """
+    返回耗时 (微秒) 所在的 METRICS_BUCKETS 分桶的下标, 超过所有上限时为 len (METRICS_BUCKETS)
+    """
+    i = 0
+    for bound in METRICS_BUCKETS:
+        if us <= bound:
+            break
+        i += 1
+    return i
+
+class _Route_Metrics ():
+    """
+    一个路由的统计: 请求数量, 状态码分布, 发送的字节数和各阶段耗时的直方图.
+    直方图使用固定的 METRICS_BUCKETS 分桶, 占用的内存不随请求数量增长
+    """
+    def __init__ (self):
+        self.count = 0
+        self.statuses:dict = {} # 状态码 -> 数量
+        self.bytes_sent = 0
+        n = len (METRICS_BUCKETS) + 1
+        self.buckets:list = [[0] * n for _ in _PHASES] # 每个阶段一个直方图
+        self.sums:list = [0] * len (_PHASES) # 每个阶段的总耗时 (微秒)
+
+    def record (self,status:str,bytes_sent:int,times:list):
+        self.count += 1
+        self.statuses[status] = self.statuses.get (status, 0) + 1
+        self.bytes_sent += bytes_sent
+        for phase, us in enumerate (times):
+            self.buckets[phase][_bucket (us)] += 1
+            self.sums[phase] += us
+
+    def dump (self) -> dict:
+        phases = {}
+        for i, name in enumerate (_PHASES):
+            phases[name] = {"sum_us" : self.sums[i], "buckets" : list (self.buckets[i])}
+        return {
+            "count"      : self.count,
+            "statuses"   : dict (self.statuses),
+            "bytes_sent" : self.bytes_sent,
+            "phases"     : phases
+        }
+
+def _prometheus (stats:dict) -> str:
+    """
+    将 stats () 的结果转换为 Prometheus 的文本格式
+    """
+    lines = [
+        "# TYPE micro_route_requests_total counter",
+        "# TYPE micro_route_bytes_sent_total counter",
+        "# TYPE micro_route_phase_seconds histogram"
+    ]
+    for route, m in stats.items ():
+        label = 'route="{0}"'.format (route.replace ("\\", "\\\\").replace ('"', '\\"'))
+        for status, n in m["statuses"].items ():
+            lines.append ('micro_route_requests_total{{{0},status="{1}"}} {2}'.format (label, status, n))
+        lines.append ("micro_route_bytes_sent_total{{{0}}} {1}".format (label, m["bytes_sent"]))
+        for phase, h in m["phases"].items ():
+            total = 0
+            for bound, n in zip (METRICS_BUCKETS + ("+Inf",), h["buckets"]):
+                total += n
+                le = bound if bound == "+Inf" else bound / 1000000
+                lines.append ('micro_route_phase_seconds_bucket{{{0},phase="{1}",le="{2}"}} {3}'.format (label, phase, le, total))
+            lines.append ('micro_route_phase_seconds_sum{{{0},phase="{1}"}} {2}'.format (label, phase, h["sum_us"] / 1000000))
+            lines.append ('micro_route_phase_seconds_count{{{0},phase="{1}"}} {2}'.format (label, phase, total))
+    return "\n".join (lines) + "\n"
+
+class _Access_Log ():
+    """
+    缓冲的访问日志, 每个请求一行 logfmt 格式的记录:
+        ts=1700000000 addr=127.0.0.1 method=GET url="/a?b=1" status=200 bytes=123 us=456 route="/a"
+    记录先放在内存中, 超过 buffer_size 或者距离上次写出超过 flush_interval 秒时一次写出.
+    多线程模式下所有工作线程共用, 修改时加锁
+    """
+    def __init__ (self,target,buffer_size:int,flush_interval:int):
+        self.__mutex = _thread.allocate_lock () if _thread else None
+        self.stream = open (target, "a") if type (target) == str else target
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.lines:list = []
+        self.size = 0
+        self.last_flush = time.time ()
+
+    def write (self,line:str):
+        if self.__mutex: self.__mutex.acquire ()
+        try:
+            self.lines.append (line)
+            self.size += len (line)
+            full = self.size >= self.buffer_size or time.time () - self.last_flush >= self.flush_interval
+        finally:
+            if self.__mutex: self.__mutex.release ()
+        if full:
+            self.flush ()
+
+    def flush (self):
+        if self.__mutex: self.__mutex.acquire ()
+        try:
+            lines, self.lines = self.lines, []
+            self.size = 0
+            self.last_flush = time.time ()
+            if not lines:
+                return
+            try:
+                self.stream.write ("".join (lines))
+                if hasattr (self.stream, "flush"): self.stream.flush ()
+            except Exception as e:
+                debug_info (1, "write access log faild: ", e)
+        finally:
+            if self.__mutex: self.__mutex.release ()
+# ==================Metrics===================
+# --------------------------------------------
+
+# ++++++++++++++++++++++++++++++++++++++++++++
+# =================Multipart==================
+def _header_params (value:str) -> tuple:
+    """
+    解析带参数的 header, 例如:
+    _header_params ('form-data; name="file"; filename="a.png"')
+    -> ("form-data", {"name": "file", "filename": "a.png"})
+    """
+    items = value.split (";")
+    params = {}
+    for item in items[1:]:
+        idx = item.find ("=")
+        if idx < 0:
+            continue
+        v = item[idx+1:].strip ()
+        if len (v) >= 2 and v[0] == '"' and v[-1] == '"':
+            v = v[1:-1]
+        params[item[:idx].strip ().lower ()] = v
+    return items[0].strip ().lower (), params
+
+class _Form_Part ():
+    """
+    multipart/form-data 中的一个部分, 内容需要通过 read () 按顺序读取.
+    读取下一个部分后, 这个部分没有读取的内容会被丢弃.
+    """
+    def __init__ (self,reader,headers:dict):
+        self._reader = reader
+        self.headers = headers # 小写的 header 名称 -> 值
+        disposition, params = _header_params (headers.get ("content-disposition", ""))
+        self.name:str = params.get ("name", "")
+        self.filename:str = params.get ("filename") # 不是文件时为 None
+        self.content_type:str = headers.get ("content-type", "text/plain")
+
+    def read (self,size:int=-1) -> bytes:
+        """
+        读取最多 size 字节的内容, 读完后返回 b"". size 小于 0 时读取全部内容
+        """
+        if size >= 0:
+            return self._reader._read (self, size)
+        chunks = []
+        while True:
+            chunk = self._reader._read (self, self._reader.bufsize)
+            if not chunk:
+                return b"".join (chunks)
+            chunks.append (chunk)
+
+    async def aread (self,size:int=-1) -> bytes:
+        """
+        read () 的异步版本
+        """
+        if size >= 0:
+            return await self._reader._aread (self, size)
+        chunks = []
+        while True:
+            chunk = await self._reader._aread (self, self._reader.bufsize)
+            if not chunk:
+                return b"".join (chunks)
+            chunks.append (chunk)
+
+class _Upload_File ():
+    """
+    上传的文件, 较小的文件保存在内存中 (data), 较大的文件保存在临时文件中 (path).
+    请求结束后临时文件会被删除, 需要保留时请调用 save ().
+    """
+    def __init__ (self,part:_Form_Part):
+        self.name:str = part.name
+        self.filename:str = part.filename
+        self.content_type:str = part.content_type
+        self.size:int = 0
+        self.data:bytes = None
+        self.path:str = None
+        self._temp:str = None # 临时文件的路径
+
+    def read (self) -> bytes:
+        """
+        读取文件的全部内容
+        """
+        if self.path is None:
+            return self.data
+        with open (self.path, "rb") as f:
+            return f.read ()
+
+    def save (self,path:str):
+        """
+        将上传的文件保存到 path
+        """
+        if self.path is None:
+            with open (path, "wb") as f:
+                f.write (self.data)
+            return
+        try:
+            os.rename (self.path, path) # 临时文件移动过去, 不需要复制
+        except OSError:
+            with open (self.path, "rb") as src, open (path, "wb") as dst:
+                buf = bytearray (MULTIPART_BUFFER_SIZE)
+                while True:
+                    x = src.readinto (buf)
+                    if not x:
+                        break
+                    dst.write (buf if x == len (buf) else buf[:x])
+            os.remove (self.path)
+        self.path = path
+
+class _Multipart_Reader ():
+    """
+    流式解析 multipart/form-data 请求, 每次最多读取 bufsize 字节, 不会把整个请求放在内存中.
+    例如:
+        for part in context.request.multipart ():
+            if part.filename:
+                with open ("/data/" + part.filename, "wb") as f:
+                    chunk = part.read (1024)
+                    while chunk:
+                        f.write (chunk)
+                        chunk = part.read (1024)
+            else:
+                print (part.name, part.read ())
+    在 serve () 启动的服务器中使用 async for 和 await part.aread ().
+    数据格式错误时抛出 ValueError ("400")
+    """
+    def __init__ (self,request,boundary:str,bufsize:int=MULTIPART_BUFFER_SIZE):
+        self._request = request
+        self._delim = b"\r\n--" + boundary.encode (charset)
+        self.bufsize = max (bufsize, len (self._delim) + 4)
+        self._buf = b"\r\n" # 第一个分隔符前面没有 \r\n, 补上后所有分隔符都一样
+        self._pos = 0
+        self._part = True # 正在读取的部分, 开始时为分隔符前的前言
+        self._done = False
+
+    def _try_read (self,part,size:int) -> bytes:
+        """
+        从缓冲区读取一个部分的内容, 数据不够判断时返回 None, 这个部分结束时返回 b""
+        """
+        if part is not self._part:
+            return b"" # 已经开始读取下一个部分
+        buf, pos = self._buf, self._pos
+        idx = buf.find (self._delim, pos)
+        # 没找到分隔符时, 结尾可能是分隔符的开头, 需要保留
+        end = idx if idx >= 0 else len (buf) - len (self._delim) + 1
+        if end > pos:
+            if end - pos > size: end = pos + size
+            self._pos = end
+            return buf[pos:end]
+        if idx >= 0:
+            self._part = None # 到达分隔符
+            return b""
+        return None
+
+    def _try_next (self):
+        """
+        读取下一个部分的头部, 数据不够时返回 None, 没有更多部分时返回 False
+        """
+        buf, pos = self._buf, self._pos
+        n = len (self._delim)
+        if len (buf) - pos < n + 2:
+            return None
+        tail = buf[pos+n:pos+n+2]
+        if tail == b"--":
+            self._done = True # 结束分隔符, 之后的内容由请求结束时丢弃
+            self._pos = pos + n + 2
+            return False
+        if tail != b"\r\n":
+            raise ValueError ("400")
+        start = pos + n + 2
+        if buf[start:start+2] == b"\r\n":
+            end = start # 这个部分没有 header
+        else:
+            end = buf.find (b"\r\n\r\n", start)
+            if end < 0:
+                if len (buf) - start > MAX_HEADER_SIZE:
+                    raise ValueError ("400")
+                return None
+            end += 2
+        headers = {}
+        for line in buf[start:end].split (b"\r\n"):
+            idx = line.find (b":")
+            if idx > 0:
+                headers[line[:idx].decode (charset).strip ().lower ()] = line[idx+1:].decode (charset).strip ()
+        self._pos = end + 2
+        self._part = _Form_Part (self, headers)
+        return self._part
+
+    def _fill (self,data:bytes):
+        if not data:
+            raise ValueError ("400") # 请求在结束分隔符之前就结束了
+        self._buf = self._buf[self._pos:] + data
+        self._pos = 0
+
+    def _read (self,part,size:int) -> bytes:
+        while True:
+            data = self._try_read (part, size)
+            if data is not None:
+                return data
+            self._fill (self._request.recv_data (self.bufsize))
+
+    async def _aread (self,part,size:int) -> bytes:
+        while True:
+            data = self._try_read (part, size)
+            if data is not None:
+                return data
+            self._fill (await self._request.arecv_data (self.bufsize))
+
+    def next_part (self) -> _Form_Part:
+        """
+        跳过当前部分剩下的内容, 返回下一个部分, 没有更多部分时返回 None
+        """
+        if self._done:
+            return None
+        while self._part and self._read (self._part, self.bufsize):
+            pass
+        while True:
+            part = self._try_next ()
+            if part is not None:
+                return part or None
+            self._fill (self._request.recv_data (self.bufsize))
+
+    async def anext_part (self) -> _Form_Part:
+        """
+        next_part () 的异步版本
+        """
+        if self._done:
+            return None
+        while self._part and await self._aread (self._part, self.bufsize):
+            pass
+        while True:
+            part = self._try_next ()
+            if part is not None:
+                return part or None
+            self._fill (await self._request.arecv_data (self.bufsize))
+
+    def __iter__ (self):
+        return self
+
+    def __next__ (self) -> _Form_Part:
+        part = self.next_part ()
+        if part is None:
+            raise StopIteration ()
+        return part
+
+    def __aiter__ (self):
+        return self
+
+    async def __anext__ (self) -> _Form_Part:
+        part = await self.anext_part ()
+        if part is None:
+            raise StopAsyncIteration ()
+        return part
+
+class _Upload_Writer ():
+    """
+    将 multipart 请求中的部分保存到 form 和 files 中.
+    保存在内存中的文件总大小超过 MULTIPART_MEMORY_SIZE 后, 之后的文件写入 upload_dir 中的临时文件,
+    所有部分的总大小超过 max_size 时抛出 ValueError ("413")
+    """
+    def __init__ (self,request,upload_dir:str,max_size:int=MAX_UPLOAD_SIZE):
+        self.request = request
+        self.upload_dir = upload_dir
+        self.max_size = max_size
+        self.form_size = 0
+        self.total = 0  # 所有部分的总大小
+        self.memory = 0 # 已经结束并保存在内存中的文件的总大小
+        self.file = None
+        request.form = _Form_Dict ()
+        request.files = _Form_Dict ()
+
+    def begin (self,part:_Form_Part):
+        self.part = part
+        self.chunks = []
+        self.size = 0
+        self.file = None
+        self.upload = _Upload_File (part) if part.filename is not None else None
+
+    def write (self,chunk:bytes):
+        self.size += len (chunk)
+        self.total += len (chunk)
+        if self.total > self.max_size:
+            raise ValueError ("413")
+        if self.upload is None:
+            # 普通的字段, 和 urlencoded 表单使用同样的大小限制
+            self.form_size += len (chunk)
+            if self.form_size > MAX_FORM_SIZE:
+                raise ValueError ("413")
+            self.chunks.append (chunk)
+        elif self.file:
+            self.file.write (chunk)
+        elif self.memory + self.size > MULTIPART_MEMORY_SIZE:
+            # 文件太大 (或者内存中已经有很多文件), 改为写入临时文件
+            if tempfile:
+                # 以 O_EXCL 创建随机名称的文件, 不会写入目录中预先放置的同名文件或者符号链接
+                fd, path = tempfile.mkstemp (prefix="mr_upload_", dir=self.upload_dir or ".")
+                self.file = os.fdopen (fd, "wb")
+            else:
+                path = "{0}mr_upload_{1:x}_{2:x}".format (
+                    self.upload_dir + "/" if self.upload_dir else "", int (time.time ()), id (self.upload)
+                )
+                self.file = open (path, "wb")
+            self.upload.path = self.upload._temp = path
+            if self.request._temp_files is None:
+                self.request._temp_files = []
+            self.request._temp_files.append (self.upload)
+            for c in self.chunks:
+                self.file.write (c)
+            self.file.write (chunk)
+            self.chunks = None
+        else:
+            self.chunks.append (chunk)
+
+    def end (self):
+        if self.upload is None:
+            try: value = b"".join (self.chunks).decode (charset)
+            except UnicodeError: raise ValueError ("400")
+            self.request.form.add (self.part.name, value)
+            return
+        if self.file:
+            self.file.close ()
+            self.file = None
+        else:
+            self.upload.data = b"".join (self.chunks)
+            self.memory += self.size
+        self.upload.size = self.size
+        self.request.files.add (self.part.name, self.upload)
+
+    def abort (self):
+        if self.file:
+            self.file.close ()
+            self.file = None
+# =================Multipart==================
+# --------------------------------------------
+
+# ++++++++++++++++++++++++++++++++++++++++++++
+# =================Event loop=================
+class _Connection ():
+    """
+    selectors 事件循环中的一个客户端连接 (CPython 的非阻塞模式).
+    作为 _Response 的 socket 使用时, 写出的数据先放入发送队列, 由事件循环在 socket 可写时发送,
+    所以一个读得很慢的客户端不会阻塞其他连接.
+    队列中的数据超过 LOOP_OUTPUT_LIMIT 时 (例如流式响应) 阻塞发送, 最多等待 timeout 秒
+    """
+    __slots__ = ("sock", "addr", "timeout", "buf", "head", "body", "length", "out", "offset", "pending", "served",
+        "context", "deadline", "closing", "events")
+
+    def __init__ (self,sock:socket.socket,addr:tuple,timeout:float=None):
+        self.sock = sock
+        self.addr = addr
+        self.timeout = timeout
+        self.buf = _Recv_Buffer (sock)
+        self.head = None     # 已经解析的 (head, headers, 开始解析的时间, 匹配的路由), 正在等待请求数据
+        self.body = None     # 正在接收的请求数据 (bytearray, 随着数据到达增长), 收完后交给 _Request
+        self.length = 0      # 请求数据的总长度
+        self.out = []        # 发送队列: bytes 或者 [文件, 开始位置, 剩余长度]
+        self.offset = 0      # 发送队列第一项已经发送的长度
+        self.pending = 0     # 发送队列中 bytes 的总长度 (不包括文件)
+        self.served = 0      # 已经处理的请求数量
+        self.context = None  # 上一个请求的 context, reuse_context 时复用
+        self.deadline = 0    # 超过这个时间没有活动时断开
+        self.closing = False # 发送完队列中的数据后断开
+        self.events = 0      # 当前在 selector 中注册的事件
+
+    def write (self,data):
+        if data:
+            self.out.append (bytes (data)) # data 可能是会被复用的缓冲区
+            self.pending += len (data)
+            if self.pending > LOOP_OUTPUT_LIMIT:
+                self.drain ()
+        return len (data)
+
+    def drain (self):
+        """
+        阻塞发送队列中的全部数据, 超时抛出 OSError
+        """
+        self.sock.settimeout (self.timeout)
+        try:
+            self.flush ()
+        finally:
+            self.sock.setblocking (False)
+
+    def writelines (self,parts:list):
+        self.write (b"".join (parts)) # 响应头和数据合并为一项, 一次 send () 发出
+
+    def sendfile (self,file,offset:int,count:int) -> int:
+        """
+        把文件的一段放入发送队列, 发送时才读取 (支持时使用 os.sendfile)
+        """
+        self.out.append ([open (file.name, "rb"), offset, count])
+        return count
+
+    def flush (self) -> bool:
+        """
+        发送队列中的数据直到 socket 的缓冲区满了, 全部发送完返回 True
+        """
+        out = self.out
+        sock = self.sock
+        try:
+            while out:
+                item = out[0]
+                if type (item) == list:
+                    file, offset, remaining = item
+                    if remaining > 0:
+                        n = min (remaining, FILE_BUFFER_SIZE)
+                        if USE_SENDFILE and hasattr (os, "sendfile"):
+                            n = os.sendfile (sock.fileno (), file.fileno (), offset, n)
+                        else:
+                            file.seek (offset)
+                            n = sock.send (file.read (n))
+                        if not n:
+                            raise OSError ("file truncated")
+                        item[1] += n
+                        item[2] -= n
+                        continue
+                    file.close ()
+                else:
+                    n = sock.send (memoryview (item)[self.offset:])
+                    self.offset += n
+                    self.pending -= n
+                    if self.offset < len (item):
+                        continue
+                    self.offset = 0
+                out.pop (0)
+        except (BlockingIOError, InterruptedError):
+            return False
+        return True
+
+    def close (self):
+        for item in self.out:
+            if type (item) == list:
+                item[0].close ()
+        self.out = []
+        self.pending = 0
+        try: self.sock.close ()
+        except: pass
+# =================Event loop=================
+# --------------------------------------------
+
+class _Request ():
+    """
+    用来获取请求的一些信息
+    """
+    method:str       # 请求方式,一般为 (GET|POST|HEAD|PUT|DELETE|CONNECT|OPTIONS|TRACE|PATCH)
+    url:str          # 请求的URL
+    http_version:str # 报文的HTTP协议版本
+    headers:dict     # HTTP报文的 Headers
+    addr:tuple       # 请求的TCP地址 (ip,port)
+    data:bytes       # 自动接收时为请求的数据, 由 read () 读取时为 bytearray (避免复制), 没有数据时为 b""
+    client:socket.socket
+    keep_alive:bool  # 客户端是否希望保持连接
+    max_body_size:int # read () 和 json () 允许读取的最大长度, 由路由设置
+    # 使用 __slots__ 不为每个请求创建 __dict__, 所有属性都在 _reset () 中初始化
+    __slots__ = (
+        "method", "url", "http_version", "headers", "addr", "data", "client", "reader",
+        "keep_alive", "max_body_size", "_form", "_files", "_args", "_query", "_buffer",
+        "_temp_files", "_remaining", "_timing", "_route"
+    )
+
+    def __init__ (self,sock:socket.socket,addr:tuple,head:str,headers:str,content:str=None,buffer:_Recv_Buffer=None,reader=None):
+        self.addr = addr
+        self.client = sock
+        self._buffer = buffer or _Recv_Buffer (sock,0) # 连接的接收缓冲区, 其中可能已经有报文的开头
+        self.reader = reader # asyncio 的 StreamReader
+        self._reset (head, headers)
+
+    def _reset (self,head:tuple,headers:dict,buffer:_Recv_Buffer=None):
+        """
+        初始化一个请求的状态, 同一个连接上的下一个请求可以复用这个对象
+        buffer 为这个请求读取数据的缓冲区, 事件循环中每个请求的数据在单独的缓冲区中
+        """
+        #head => ('GET','/',"HTTP/1.1")
+        if buffer is not None:
+            self._buffer = buffer
+        self.method ,  self.url , self.http_version = head
+        self.headers = headers
+        self.data = b""
+        self.max_body_size = MAX_BODY_SIZE
+        self._form = None  # method = post 时可用, 第一次访问时才创建
+        self._files = None # multipart/form-data 上传的文件, name -> _Upload_File
+        self._args = None  # URL 参数, 第一次访问 args 时才解析
+        self._temp_files = None # 上传文件时创建的临时文件, 请求结束后删除
+        self._timing = None # 开启性能统计时为 [上一个时间点, parse, match, handler, send] (微秒)
+        self._route = "unmatched" # 性能统计中这个请求所属的路由
+
+        idx = self.url.find ("?")
+        if idx >= 0:
+            # 参数在访问 args 时再解析
+            self._query = self.url[idx+1:]
+            self.url = self.url[:idx]
+        else:
+            self._query = ""
+
+        # HTTP/1.1 默认保持连接, HTTP/1.0 需要客户端显式要求
+        connection = (_get_header (headers, "Connection") or "").lower ()
+        if self.http_version == "HTTP/1.1":
+            self.keep_alive = connection != "close"
+        else:
+            self.keep_alive = connection == "keep-alive"
+
+        # 尚未读取的报文长度, 下一个请求开始前需要把它读完
+        try: self._remaining = int (_get_header (headers, "Content-Length") or 0)
+        except: self._remaining = 0
+        if _get_header (headers, "Transfer-Encoding"):
+            self.keep_alive = False # 不支持分块上传的报文, 无法确定下一个请求的位置
+            
+    def recv_data (self,bufsize:int=4096) -> bytes:
+        """
+        当请求为POST或者PUT时,服务器可能会接受到较大的数据.
+        这些数据的大小可能会超出芯片内存的限制, 所以程序默认不读取请求的数据.
+        可以多次调用本函数分段读取数据, 每次最多读取 bufsize 字节, 读完后返回 b"".
+        """
+        if self._remaining <= 0:
+            return b""
+        if self._buffer.pending ():
+            data = self._buffer.take (min (bufsize, self._remaining))
+        else:
+            data = self.client.recv (min (bufsize, self._remaining))
+        if not data:
+            self._remaining = 0
+            self.keep_alive = False # 客户端提前断开
+            return b""
+        self._remaining -= len (data)
+        return data
+    
+    async def arecv_data (self,bufsize:int=4096) -> bytes:
+        """
+        recv_data () 的异步版本, 用于 serve () 启动的 asyncio 服务器
+        """
+        if self._remaining <= 0:
+            return b""
+        if self._buffer.pending ():
+            data = self._buffer.take (min (bufsize, self._remaining))
+        else:
+            data = await self.reader.read (min (bufsize, self._remaining))
+        if not data:
+            self._remaining = 0
+            self.keep_alive = False
+            return b""
+        self._remaining -= len (data)
+        return data
+    
+    @property
+    def form (self) -> dict:
+        """
+        POST / PUT 自动接收时解析出的表单 (或者 JSON)
+        """
+        if self._form is None:
+            self._form = {}
+        return self._form
+
+    @form.setter
+    def form (self,value:dict):
+        self._form = value
+
+    @property
+    def files (self) -> dict:
+        """
+        multipart/form-data 上传的文件, name -> _Upload_File
+        """
+        if self._files is None:
+            self._files = {}
+        return self._files
+
+    @files.setter
+    def files (self,value:dict):
+        self._files = value
+
+    @property
+    def args (self) -> _Form_Dict:
+        """
+        URL 中的参数, 第一次访问时解析
+        """
+        if self._args is None:
+            self._args = load_form_data (self._query)
+        return self._args
+
+    def readinto (self,buf) -> int:
+        """
+        读取请求的数据到 buf 中, 返回读取的长度, 读完后返回 0.
+        不会读取超过 Content-Length 的数据, 不受 max_body_size 的限制
+        """
+        if self._remaining <= 0:
+            return 0
+        mv = memoryview (buf)
+        if len (mv) > self._remaining:
+            mv = mv[:self._remaining]
+        if self._buffer.pending ():
+            n = self._buffer.take_into (mv)
+        else:
+            # MicroPython 的 socket 没有 recv_into
+            n = (getattr (self.client, "recv_into", None) or self.client.readinto) (mv)
+        if not n:
+            self._remaining = 0
+            self.keep_alive = False # 客户端提前断开
+            return 0
+        self._remaining -= n
+        return n
+
+    async def areadinto (self,buf) -> int:
+        """
+        readinto () 的异步版本
+        """
+        n = min (len (buf), self._remaining)
+        if n <= 0:
+            return 0
+        if self._buffer.pending ():
+            return self.readinto (buf)
+        data = await self.reader.read (n)
+        if not data:
+            self._remaining = 0
+            self.keep_alive = False
+            return 0
+        buf[:len (data)] = data
+        self._remaining -= len (data)
+        return len (data)
+
+    def __body_buffer (self) -> bytearray:
+        """
+        为读取整个请求数据创建缓冲区, 数据超过 max_body_size 时抛出 ValueError ("413")
+        """
+        if self._remaining > self.max_body_size:
+            raise ValueError ("413")
+        return bytearray (self._remaining)
+
+    def read (self,n:int=-1) -> bytes:
+        """
+        读取请求的数据. n 小于 0 时读取剩下的全部数据 (返回 bytearray 而不是 bytes, 不需要再复制一次,
+        需要 bytes 时 (例如作为 dict 的键) 请使用 bytes (data)),
+        此时 Content-Length 超过 max_body_size 会抛出 ValueError ("413"), 服务器回应 413.
+        n 大于等于 0 时最多读取 n 字节, 读完后返回 b"".
+        """
+        if n >= 0:
+            return self.recv_data (n)
+        buf = self.__body_buffer ()
+        mv = memoryview (buf)
+        got = 0
+        while got < len (buf):
+            x = self.readinto (mv[got:])
+            if not x:
+                return buf[:got] # 客户端提前断开
+            got += x
+        return buf
+
+    async def aread (self,n:int=-1) -> bytes:
+        """
+        read () 的异步版本
+        """
+        if n >= 0:
+            return await self.arecv_data (n)
+        buf = self.__body_buffer ()
+        mv = memoryview (buf)
+        got = 0
+        while got < len (buf):
+            x = await self.areadinto (mv[got:])
+            if not x:
+                return buf[:got]
+            got += x
+        return buf
+
+    def json (self):
+        """
+        读取全部数据并按 JSON 解析, 数据不是合法的 JSON 时抛出 ValueError ("400")
+        """
+        return _json_loads (self.read ())
+
+    async def ajson (self):
+        """
+        json () 的异步版本
+        """
+        return _json_loads (await self.aread ())
+
+    def __iter__ (self):
+        return self
+
+    def __next__ (self) -> bytes:
+        """
+        for chunk in request: 按 BODY_CHUNK_SIZE 分段读取请求的数据
+        """
+        data = self.recv_data (BODY_CHUNK_SIZE)
+        if not data:
+            raise StopIteration ()
+        return data
+
+    def __aiter__ (self):
+        return self
+
+    async def __anext__ (self) -> bytes:
+        """
+        async for chunk in request: __next__ () 的异步版本
+        """
+        data = await self.arecv_data (BODY_CHUNK_SIZE)
+        if not data:
+            raise StopAsyncIteration ()
+        return data
+
+    def multipart (self,bufsize:int=MULTIPART_BUFFER_SIZE) -> _Multipart_Reader:
+        """
+        流式读取 multipart/form-data 格式的数据, 用于 auto_recv=False 的处理函数.
+        请求不是 multipart/form-data 时抛出 ValueError ("400")
+        """
+        content_type, params = _header_params (_get_header (self.headers, "Content-Type") or "")
+        if content_type != "multipart/form-data" or not params.get ("boundary"):
+            raise ValueError ("400")
+        return _Multipart_Reader (self, params["boundary"], bufsize)
+
+    def _cleanup (self):
+        """
+        删除上传文件时创建的, 没有被 save () 的临时文件
+        """
+        if not self._temp_files:
+            return
+        for upload in self._temp_files:
+            if upload.path == upload._temp:
+                try: os.remove (upload._temp)
+                except OSError: pass
+        self._temp_files = None
+
+
+    def _drain (self,limit:int=65536) -> bool:
+        """
+        丢弃处理函数没有读取的报文, 使连接可以继续处理下一个请求.
+        剩余数据超过 limit 时直接放弃这个连接, 返回 False
+        """
+        if self._remaining > limit:
+            return False
+        while self._remaining > 0:
+            if not self.recv_data ():
+                return False
+        return True
+
+    async def _adrain (self,limit:int=65536) -> bool:
+        """
+        _drain () 的异步版本
+        """
+        if self._remaining > limit:
+            return False
+        while self._remaining > 0:
+            if not await self.arecv_data ():
+                return False
+        return True
+
+class _SESSION ():
+    """
+    利用COOKIE实现的SESSION对话
+    """
+    # TODO
+    def __init__ (self):
+        pass
+
+class _Response ():
+    """
+    用于回应浏览器发起的请求, 可以在处理函数中使用 return 返回内容, 程序将自动处理
+    如果您使用了 send () 或者 close () , 处理函数的返回值会自动被忽略.
+    """
+    headers:dict # 本次响应的 headers, Server 头部会自动添加
+    client:socket.socket
+    mime_type:str # 默认为 "text/html"
+    statu_code:str # 默认为 "200"
+    keep_alive:bool # 响应结束后是否保持连接
+    bytes_sent:int # 已经发送的字节数 (包括头部)
+    # 使用 __slots__ 不为每个响应创建 __dict__, 所有属性都在 __init__ () 和 _reset () 中初始化
+    __slots__ = (
+        "headers", "client", "mime_type", "statu_code", "keep_alive", "bytes_sent",
+        "_responsed", "_closed", "__header_sended", "_chunked", "_chunk_ok", "_no_body",
+        "_raw_headers", "_capture", "_request", "_file_cache", "_file_buf",
+        "_write", "_sendmsg", "_writelines"
+    )
+
+    def __init__ (self,sock:socket.socket,keep_alive:bool=False,chunked:bool=False,no_body:bool=False,
+        request:_Request=None,file_cache:_File_Cache=None):
+        """
+        :param keep_alive : 响应结束后是否保持连接
+        :param chunked    : 客户端是否支持分块传输 (HTTP/1.1)
+        :param no_body    : 只发送头部, 用于 HEAD 请求
+        :param request    : 对应的请求, 用于条件请求等需要读取请求头的功能
+        :param file_cache : 静态文件信息的缓存
+        """
+        self.client = sock
+        self._request = request
+        self._file_cache = file_cache
+        self._file_buf = None # 分片发送文件的缓冲区, 复用这个对象时一起复用
+        self._write = getattr (sock, "sendall", None) or sock.write
+        # 可以一次写入多段数据时使用 sendmsg (socket) 或 writelines (asyncio), 避免拼接
+        self._sendmsg = getattr (sock, "sendmsg", None)
+        self._writelines = getattr (sock, "writelines", None)
+        self._reset (keep_alive, chunked, no_body)
+
+    def _reset (self,keep_alive:bool,chunked:bool,no_body:bool):
+        """
+        初始化一个响应的状态, 同一个连接上的下一个请求可以复用这个对象
+        """
+        self.headers = {} # 每个响应使用自己的 headers, 避免互相污染
+        self.mime_type = "text/html"
+        self.statu_code = "200"
+        self.keep_alive = keep_alive
+        self.bytes_sent = 0
+        self._responsed = False # 是否已经回应过
+        self._closed = False
+        self.__header_sended = False
+        self._chunked = False   # 是否使用分块传输 (Transfer-Encoding: chunked)
+        self._chunk_ok = chunked
+        self._no_body = no_body
+        self._raw_headers = b"" # 预先编码好的 headers, 用于静态文件
+        self._capture = None    # 不为 None 时记录发送的 [head, body...], 用于路由的响应缓存
+
+    def __dump_headers (self) -> bytes:
+        """
+        将一个dict类型的header变为bytes
+        """
+        if not self.headers:
+            return b""
+        return "".join ([k + ": " + str (v) + "\r\n" for k, v in self.headers.items ()]).encode (charset)
+
+    def _writev (self,parts:list):
+        """
+        将多段数据一次写出, 支持时使用 scatter/gather 写入 (socket.sendmsg)
+        """
+        total = 0
+        for part in parts:
+            total += len (part)
+        if self._sendmsg:
+            sent = self._sendmsg (parts)
+            if sent < total:
+                # 只写出了一部分, 剩下的用 sendall 写完
+                self._write (b"".join (parts)[sent:])
+        elif self._writelines:
+            self._writelines (parts)
+        else:
+            self._write (b"".join (parts))
+        self.bytes_sent += total
+
+    def send_header (self,
+        statu_explane:str = None,
+        content:str = ""
+    ):
+        """
+        发送响应的头部内容(包括状态码), 然后你可以使用 send () 自定义发送你想要的数据.
+        发送前可以修改 response.headers 添加或者覆盖 headers, 例如:
+            response.headers["Cache-Control"] = "no-cache"
+            response.send_header ()
+        传入 content 时会和头部一起写出.
+        """
+
+        if statu_explane: status = "HTTP/1.1 {0} {1}\r\n".format (self.statu_code, statu_explane).encode (charset)
+        else: status = _STATUS_LINES.get (self.statu_code) or "HTTP/1.1 {0} \r\n".format (self.statu_code).encode (charset)
+
+        self.headers["Content-Type"] = self.mime_type
+        if self.keep_alive and "Content-Length" not in self.headers and self.statu_code not in ("204","304"):
+            # 长度未知, 只能通过分块传输或者断开连接来标记结束
+            if self._chunk_ok and not self._no_body:
+                self._chunked = True
+                self.headers["Transfer-Encoding"] = "chunked"
+            else:
+                self.keep_alive = False
+        parts = [status, _SERVER_HEADER, self.__dump_headers (), self._raw_headers,
+            _CONNECTION_KEEP_ALIVE if self.keep_alive else _CONNECTION_CLOSE, b"\r\n"]
+        if self._capture is not None:
+            # 只缓存长度确定的成功响应, Connection 头部在发送缓存时根据连接重新添加
+            if self._chunked or self.statu_code != "200":
+                self._capture = None
+            else:
+                self._capture.append (b"".join (parts[:4]))
+        if type (content) == str:
+            content = content.encode (charset)
+        if content and self._capture is not None:
+            self._capture.append (content)
+        if content and not self._no_body:
+            if self._chunked:
+                parts[-1] += ("%x\r\n" % len (content)).encode ()
+                parts.append (content)
+                parts.append (b"\r\n")
+            else:
+                parts.append (content)
+        try:
+            self._writev (parts)
+            self.__header_sended = True
+            if DEBUG >= 3: debug_info (3,"header sended.")
+        except:
+            self.keep_alive = False
+            raise TimeoutError ("Faild to send headers.")
+
+    def send (self,content:str):
+        """
+        向客户发送数据, 可以流式多次调用 send () 发送大量数据.
+        没有设置 Content-Length 时, 数据会以分块传输的方式发送.
+        如果您在相应期间调用过 send () , 那么您的处理函数返回的数据将会被忽略.
+        """
+        self._responsed = True
+        if type (content) == str:
+            content = content.encode (charset)
+        if not self.__header_sended:
+            self.send_header (content=content) # 第一块数据和头部一起写出
+            return
+        if self._capture is not None and content:
+            self._capture.append (content)
+        if self._no_body or not content:
+            return # 空的数据块会被当作分块传输的结束标记
+
+        try:
+            if self._chunked:
+                self._writev ([("%x\r\n" % len (content)).encode (), content, b"\r\n"])
+            else:
+                self._write (content)
+                self.bytes_sent += len (content)
+        except:
+            self.keep_alive = False
+            raise TimeoutError ("Can not send data.")
+
+    def _send_cached (self,head:bytes,body:bytes):
+        """
+        发送缓存的响应, 不再经过 send_header ()
+        """
+        self._responsed = True
+        self.__header_sended = True
+        parts = [head, _CONNECTION_KEEP_ALIVE if self.keep_alive else _CONNECTION_CLOSE, b"\r\n"]
+        if not self._no_body:
+            parts.append (body)
+        try:
+            self._writev (parts)
+        except:
+            self.keep_alive = False
+            raise TimeoutError ("Can not send data.")
+        self._closed = True
+
+    async def asend (self,content:str):
+        """
+        send () 的异步版本, 发送后等待数据写出, 用于 serve () 启动的 asyncio 服务器
+        """
+        self.send (content)
+        drain = getattr (self.client, "drain", None)
+        if drain:
+            await drain ()
+
+    def stream (self,iterable,bufsize:int=None) -> bool:
+        """
+        流式发送一个生成器 (或其他可迭代对象) 产生的 str / bytes 数据块, 然后结束响应.
+        小数据块会先合并到缓冲区, 攒够 bufsize (默认 STREAM_BUFFER_SIZE) 再写出一次.
+        没有设置 Content-Length 时使用分块传输, 整个内容不需要同时放在内存中.
+        处理函数直接返回生成器时会自动调用.
+        例如:
+            def rows ():
+                for i in range (10000):
+                    yield "{0},{1}\n".format (i, i * i)
+            context.response.stream (rows ())
+        """
+        limit = bufsize or STREAM_BUFFER_SIZE
+        pending = []
+        size = 0
+        try:
+            if not self._no_body:
+                for chunk in iterable:
+                    if type (chunk) == str:
+                        chunk = chunk.encode (charset)
+                    if not chunk:
+                        continue
+                    pending.append (chunk)
+                    size += len (chunk)
+                    if size >= limit:
+                        self.send (b"".join (pending))
+                        pending = []
+                        size = 0
+            self.send (b"".join (pending))
+        except Exception as e:
+            debug_info (0, "stream has some error: ", e)
+            self.abort ("500")
+            return False
+        self.close ()
+        return True
+
+    async def astream (self,iterable,bufsize:int=None) -> bool:
+        """
+        stream () 的异步版本, 可以传入异步迭代器 (例如 async def 定义的异步生成器),
+        每写出一次缓冲区都会等待数据写出, 用于 serve () 启动的 asyncio 服务器.
+        在 MicroPython 上普通的生成器和协程无法区分, 处理函数需要自己 await response.astream (gen)
+        """
+        limit = bufsize or STREAM_BUFFER_SIZE
+        pending = []
+        size = 0
+        if hasattr (iterable, "__anext__") or hasattr (iterable, "__aiter__"):
+            iterator = iterable.__aiter__ () if hasattr (iterable, "__aiter__") else iterable
+        else:
+            iterator = None
+            iterable = iter (iterable)
+        try:
+            while not self._no_body:
+                if iterator is not None:
+                    try: chunk = await iterator.__anext__ ()
+                    except StopAsyncIteration: break
+                else:
+                    try: chunk = next (iterable)
+                    except StopIteration: break
+                if type (chunk) == str:
+                    chunk = chunk.encode (charset)
+                if not chunk:
+                    continue
+                pending.append (chunk)
+                size += len (chunk)
+                if size >= limit:
+                    await self.asend (b"".join (pending))
+                    pending = []
+                    size = 0
+            await self.asend (b"".join (pending))
+        except Exception as e:
+            debug_info (0, "stream has some error: ", e)
+            self.abort ("500")
+            return False
+        self.close ()
+        return True
+
+    def redirect (self,location:str,statu_code:str="302"):
+        """
+        将请求重定向到另一个地址
+        :param location   : 欲重定向的地址.
+        :param statu_code : http 状态码 , 302:临时定向 301:永久定向
+        例子: response.redirect ('https://www.baidu.com/') 重定向至百度
+        """
+
+        self.headers ["Location"] = location
+        self.headers ["Content-Length"] = "0"
+        self.statu_code = str (statu_code)
+        self.send_header ()
+        self._responsed = True
+        self.close ()
+
+    def close (self):
+        """
+        结束本次响应.
+        如果还没有发送过任何内容, 或者连接不能保持, 本次响应结束后服务器会关闭与客户端的连接.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._responsed = True
+
+        if not self.__header_sended:
+            self.keep_alive = False # 没有任何回应, 直接断开
+        elif self._chunked:
+            try:
+                self._write (b"0\r\n\r\n") # 分块传输的结束标记
+                self.bytes_sent += 5
+            except: self.keep_alive = False
+
+    def abort (self,statu_code:str="500",content:str="",statu_explane=None):
+        """
+        中断请求, 发送一个 statu code 后结束响应
+        """
+        if self.__header_sended:
+            # 头部已经发出, 无法再修改状态码, 只能断开连接
+            # 不发送分块传输的结束标记, 让客户端知道响应不完整
+            self.keep_alive = False
+            self._chunked = False
+            self.close ()
+            return
+        self.headers["Content-Length"] = str (len (content.encode (charset)))
+        self.statu_code = str (statu_code)
+        self.send_header (statu_explane=statu_explane,content=content)
+        self._responsed = True
+        self.close ()
+
+    def __not_modified (self,info:_File_Info) -> bool:
+        """
+        检查条件请求 (If-None-Match / If-Modified-Since), 客户端缓存仍然有效时返回 True
+        """
+        if not self._request:
+            return False
+        headers = self._request.headers
+        tags = _get_header (headers, "If-None-Match")
+        if tags is not None:
+            if tags.strip () == "*":
+                return True
+            for tag in tags.split (","):
+                tag = tag.strip ()
+                if tag.startswith ("W/"): tag = tag[2:] # 弱校验
+                if tag == info.etag:
+                    return True
+            return False
+        # 浏览器会原样发回 Last-Modified 的值
+        return _get_header (headers, "If-Modified-Since") == info.last_modified
+
+    def __ranges (self,info:_File_Info) -> list:
+        """
+        根据 Range 和 If-Range 获取需要发送的范围, 返回 [(start, length), ...]
+        不是范围请求时返回 None
+        """
+        if not self._request:
+            return None
+        headers = self._request.headers
+        ranges = _parse_range (_get_header (headers, "Range"), info.size)
+        if ranges is None:
+            return None
+        if_range = _get_header (headers, "If-Range")
+        if if_range is not None and if_range != info.etag and if_range != info.last_modified:
+            return None # 文件已经改变, 发送整个文件
+        return ranges
+
+    def __send_file_header (self,path:str) -> tuple:
+        """
+        检查静态文件并发送响应头部, 返回 (文件信息, [(前缀, start, length), ...], 后缀)
+        前缀和后缀是多范围请求时 multipart/byteranges 的分隔内容.
+        找不到文件时回应 404 并返回 None, 客户端缓存有效时回应 304 并不再发送内容
+        """
+        if self._file_cache:
+            info = self._file_cache.get (path)
+        else:
+            st = _stat_file (path)
+            info = _load_file (path, st) if st else None
+        if not info: # 没找到
+            if DEBUG >= 4: debug_info (4, "not found static file: ", path)
+            self.abort ("404")
+            return None
+
+        #找到文件了
+        if DEBUG >= 4: debug_info (4, "found static file: ", path)
+        if info.variants and self._request:
+            # 客户端支持时发送预压缩的版本
+            accepted = _accept_encodings (_get_header (self._request.headers, "Accept-Encoding"))
+            for encoding, suffix in PRECOMPRESSED:
+                if encoding in accepted and encoding in info.variants:
+                    info = info.variants[encoding]
+                    break
+        self.mime_type = info.mime
+        self._raw_headers = info.headers
+        parts = [(b"", 0, info.size)]
+        suffix = b""
+
+        if self.__not_modified (info):
+            if DEBUG >= 4: debug_info (4, "static file not modified: ", path)
+            self.statu_code = "304"
+            self._no_body = True
+            self.send_header ()
+            return (info, parts, suffix)
+
+        ranges = self.__ranges (info)
+        if ranges == []:
+            # 范围全部超出文件大小
+            self.headers["Content-Range"] = "bytes */{0}".format (info.size)
+            self._raw_headers = b""
+            self.abort ("416")
+            return None
+        if ranges and len (ranges) == 1:
+            start, length = ranges[0]
+            self.statu_code = "206"
+            self.headers["Content-Range"] = "bytes {0}-{1}/{2}".format (start, start + length - 1, info.size)
+            parts = [(b"", start, length)]
+        elif ranges:
+            # 多个范围, 使用 multipart/byteranges
+            boundary = "mr{0:x}{1:x}".format (int (time.time ()), id (self))
+            parts = []
+            for start, length in ranges:
+                parts.append (("\r\n--{0}\r\nContent-Type: {1}\r\nContent-Range: bytes {2}-{3}/{4}\r\n\r\n".format (
+                    boundary, info.mime, start, start + length - 1, info.size
+                ).encode (charset), start, length))
+            suffix = "\r\n--{0}--\r\n".format (boundary).encode (charset)
+            self.statu_code = "206"
+            self.mime_type = "multipart/byteranges; boundary=" + boundary
+
+        length = len (suffix)
+        for part in parts:
+            length += len (part[0]) + part[2]
+        self.headers["Content-Length"] = str (length) # 将文件大小设置进 header
+        self.send_header ()
+        return (info, parts, suffix)
+
+    def send_file (self,path:str,bufsize:int=None) -> bool:
+        """
+        传入url,发送本地的静态文件, 客户端支持时会发送同目录下预压缩的 .br / .gz 文件
+        :param path: 文件位于Flash中的绝对路径
+        :param bufsize: 不能使用 sendfile 时每次读取的大小, 默认为 FILE_BUFFER_SIZE
+        成功返回True
+        失败返回False
+        在 CPython 中会通过 socket.sendfile () 使用内核的零拷贝发送 (Linux 上为 os.sendfile)
+        支持 Range 请求 (包括多个范围) 和 If-Range, 只会读取需要发送的部分
+        """
+        r = self.__send_file_header (path)
+        if not r:
+            return False
+        if self._no_body:
+            return True
+        info, parts, suffix = r
+        bufsize = bufsize or FILE_BUFFER_SIZE
+        try :
+            with open (info.path, 'rb') as file:
+                for prefix, start, length in parts:
+                    if prefix: self._write (prefix)
+                    if USE_SENDFILE and hasattr (self.client, "sendfile"):
+                        sent = self.client.sendfile (file, start, length)
+                    else:
+                        sent = self.__copy_file (file, start, length, bufsize)
+                    if sent < length:
+                        raise OSError ("file truncated")
+                if suffix: self._write (suffix)
+            self.bytes_sent += int (self.headers["Content-Length"])
+            if DEBUG >= 3: debug_info (3, "send static file succeed.")
+            return True
+        except:
+            if DEBUG >= 3: debug_info (3, "send static file faild")
+            self.keep_alive = False # 文件没有发送完整, 不能继续使用这个连接
+            return False
+
+    def __file_buffer (self,bufsize:int) -> bytearray:
+        """
+        返回分片发送文件的缓冲区, 同一个对象上大小相同时不再重新分配
+        """
+        buf = self._file_buf
+        if buf is None or len (buf) != bufsize:
+            buf = self._file_buf = bytearray (bufsize)
+        return buf
+
+    def __copy_file (self,file,start:int,length:int,bufsize:int) -> int:
+        """
+        从 start 开始分片读取文件并发送 length 字节, 返回发送的长度
+        """
+        if start: file.seek (start)
+        buf = self.__file_buffer (bufsize)
+        mv = memoryview (buf)
+        sent = 0
+        while sent < length:
+            x = file.readinto (mv[:min (bufsize, length - sent)])
+            if not x:
+                break
+            self._write (mv[:x] if x < bufsize else buf) # 读取不完整时只发送读到的部分
+            sent += x
+        return sent
+
+    async def asend_file (self,path:str,bufsize:int=None) -> bool:
+        """
+        send_file () 的异步版本, 每发送一片都会等待数据写出, 用于 serve () 启动的 asyncio 服务器
+        在 CPython 中会使用事件循环的 sendfile ()
+        """
+        r = self.__send_file_header (path)
+        if not r:
+            return False
+        if self._no_body:
+            return True
+        info, parts, suffix = r
+        bufsize = bufsize or FILE_BUFFER_SIZE
+        try :
+            with open (info.path, 'rb') as file:
+                transport = getattr (self.client, "transport", None)
+                use_sendfile = USE_SENDFILE and transport and hasattr (asyncio, "get_running_loop")
+                buf = None if use_sendfile else self.__file_buffer (bufsize)
+                for prefix, start, length in parts:
+                    if prefix: self._write (prefix)
+                    await self.client.drain () # 先把头部写出
+                    if use_sendfile:
+                        sent = await asyncio.get_running_loop ().sendfile (transport, file, start, length)
+                    else:
+                        file.seek (start)
+                        sent = 0
+                        while sent < length :
+                            x = file.readinto (buf)
+                            if not x:
+                                break
+                            x = min (x, length - sent)
+                            self._write (buf if x == bufsize else buf[:x]) # 写入时数据会被复制到缓冲区
+                            await self.client.drain ()
+                            sent += x
+                    if sent < length:
+                        raise OSError ("file truncated")
+                if suffix: self._write (suffix)
+            self.bytes_sent += int (self.headers["Content-Length"])
+            if DEBUG >= 3: debug_info (3, "send static file succeed.")
+            return True
+        except:
+            if DEBUG >= 3: debug_info (3, "send static file faild")
+            self.keep_alive = False
+            return False
+
+class Context ():
+    request:_Request
+    session:_SESSION
+    response:_Response
+    __slots__ = ("request", "response", "session")
+    def __init__ (self,request:_Request, response:_Response, session:_SESSION = None):
+        self.request = request
+        self.response = response
+        self.session = session
+
+class MICRO_ROUTE ():
+    bind_ip:str
+    bind_port:int
+    root_path:str
+    __SOCK:socket.socket
+    __server = None # serve () 启动的 asyncio 服务器
+    __queue:_Work_Queue = None # 多线程模式的任务队列
+    __pool_size:int = 0
+    __accepted:int = 0
+    __rejected:int = 0
+    __routes:dict # {"GET" : _Route_Tree, "POST" : _Route_Tree, ...}
+    __route_count:int
+    __caches:list
+    __metrics:dict = None # 路由 -> _Route_Metrics, 调用 enable_metrics () 后才会统计
+    __access_log:_Access_Log = None # 调用 enable_access_log () 后才会记录
+    __log_flusher:_Access_Log = None # 定时写出线程正在处理的访问日志
+    __timing:bool = False # 是否记录每个请求各阶段的耗时 (统计或者访问日志需要)
+    __gc_mode:str = "request" # 垃圾回收策略, 见 gc_policy ()
+    __gc_every:int = 1
+    __gc_threshold:int = 0
+    __gc_idle:bool = False
+    __gc_pending:int = 0 # 上次回收之后处理的请求数量
+    __gc_count:int = 0 # 回收次数
+    __gc_sum:int = 0 # 回收的总耗时 (微秒)
+    __gc_max:int = 0 # 最长的一次回收耗时 (微秒)
+    __gc_buckets:list # 回收耗时按照 METRICS_BUCKETS 分桶的次数
+    __active:int = 0 # 正在处理的连接数量
+    __children:dict = None # run (workers=N) 时, 子进程的 pid -> 启动时间
+    __stopping:bool = False # 父进程正在停止子进程, 或者子进程收到了退出的信号
+    __stopped:bool = False # 调用 stop () 后阻塞的 accept 循环退出
+    __inherited:socket.socket = None # 子进程共用的监听 socket
+    __reuse_port:bool = False
+    __selector = None # 非阻塞模式的 selectors 事件循环, 由 poll () 驱动
+    __sweep:float = 0 # 上次检查超时连接的时间
+    
+    # 每个请求方式一棵前缀树, 树中的路由形如:
+    #     {
+    #         "rule"      : "/api/<int:gid>"
+    #         "func"      : function ()
+    #         "method"    : "GET"
+    #         "url_vars"  : [
+    #               ('goods_name', ), # str,缺省,减少转换步骤
+    #               ('gid', int)
+    #         ],
+    #         "auto_recv" : True,
+    #         "max_body_size" : None,
+    #         "cache"     : _Response_Cache or None
+    #     }
+
+    def __init__ (self,
+        bind_ip:str     = "0.0.0.0",
+        bind_port:int   = 80,
+        root_path:str   = '/www',
+        sock_family:int = socket.AF_INET,
+        gzip_min_size:int = 0,
+        upload_dir:str  = UPLOAD_DIR,
+        max_body_size:int = MAX_BODY_SIZE,
+        reuse_context:bool = False,
+        max_upload_size:int = MAX_UPLOAD_SIZE
+    ):
+        """
+        实例化一个micro_route, 然后开始你的嵌入式编程之旅.
+        :param bind_ip   : 绑定的IP,默认为 "0.0.0.0",
+        :param bind_port : 绑定的端口,默认为 80
+        :param root_path : 静态文件的存放路径,默认为 '/www'
+        :param gzip_min_size : 处理函数返回的内容达到这个大小(字节)时使用 gzip 压缩, 0 为不压缩.
+            需要平台的 zlib 支持压缩 (CPython)
+        :param upload_dir : 上传的较大文件 (内存中的文件总大小超过 MULTIPART_MEMORY_SIZE 时) 保存的目录, 请求结束后会被删除
+        :param max_body_size : 路由没有设置 max_body_size 时, 一次读取整个请求数据的最大长度
+        :param reuse_context : 保持连接时, 同一个连接上的请求复用 context, request 和 response 对象,
+            减少每个请求的内存分配. 开启后处理函数不能在请求结束后继续使用 context
+        :param max_upload_size : multipart/form-data 请求上传的数据的最大总长度, 超出时回应 413.
+            multipart 请求不受 max_body_size 限制
+        """
+        self.bind_ip = bind_ip
+        self.bind_port = bind_port
+        self.sock_family = sock_family
+        self.gzip_min_size = gzip_min_size
+        self.upload_dir = upload_dir
+        self.max_body_size = max_body_size
+        self.reuse_context = reuse_context
+        self.max_upload_size = max_upload_size
+        self.__routes = {}
+        self.__route_count = 0
+        self.__caches = [] # [(处理函数, _Response_Cache)]
+        self.__gc_buckets = [0] * (len (METRICS_BUCKETS) + 1)
+        # 静态文件信息的缓存, 修改 root_path 中的文件后可以调用 static_cache.invalidate () 立即生效
+        self.static_cache = _File_Cache ()
+
+        # 清除结尾的 /
+        if root_path.endswith ("/"): root_path = root_path [:-1]
+        self.root_path = root_path.replace ('../', '/')
+
+    def append_to_route_tree (self,rule:str,func:object,method:str,auto_recv:bool,max_body_size:int=None,cache=None):
+        """
+        添加到路由解析树中
+        """
+        method = method.upper () # 注册时统一大小写, 请求时不再转换
+        if cache is not None:
+            if type (cache) != dict:
+                cache = {"ttl" : cache}
+            vary = tuple (cache.get ("vary", ()))
+            if self.gzip_min_size and "Accept-Encoding" not in vary:
+                cache = dict (cache, vary=vary + ("Accept-Encoding",)) # 返回值可能被压缩, 需要区分客户端
+            cache = _Response_Cache (**cache)
+            self.__caches.append ((func, cache))
+        route = {
+            "rule"      : rule,
+            "func"      : func,
+            "method"    : method,
+            "auto_recv" : auto_recv,
+            "max_body_size" : max_body_size,
+            "cache"     : cache
+        }
+        tree = self.__routes.get (method)
+        if not tree:
+            tree = self.__routes[method] = _Route_Tree ()
+        tree.insert (self.__route_count,rule,route)
+        self.__route_count += 1
+        if DEBUG >= 4: debug_info (4,"append a route: " , rule, route)
+
+    def route (self,rule:str='/',method:str="GET",auto_recv:bool=True,max_body_size:int=None,cache=None):
+        """
+        :param rule      : 响应的URL,支持变量方式定义,必须以 `/` 开头
+        :param method    : 响应的方式 GET | POST ...
+        :param auto_recv : 仅在 method 为 POST 或者 PUT 时可用\
+            由于传输的数据可能过大,可以控制程序是否自动解析客户端发送的数据
+            若为 False, 可以使用 context.request.read () / readinto () 或者 for chunk in context.request
+            手动获取用户发送的数据.
+        :param max_body_size : 自动接收或者 read () 读取整个请求数据时的最大长度, 超过时回应 413,
+            默认使用 MICRO_ROUTE 的 max_body_size. multipart 上传的文件不受这个限制
+        :param cache     : 缓存 GET 请求的响应, 有效期内的请求直接发送编码好的响应, 不再调用处理函数.
+            可以是有效期 (秒), 或者一个 dict:
+            {
+                "ttl"       : 有效期 (秒),
+                "size"      : 最多缓存的响应数量, 默认 RESPONSE_CACHE_SIZE,
+                "max_bytes" : 缓存的总大小, 默认 RESPONSE_CACHE_BYTES,
+                "vary"      : 除 URL 和参数外, 作为缓存键的请求头, 例如 ("Accept-Language",)
+            }
+            设置了 gzip_min_size 时 vary 总是包括 Accept-Encoding.
+            只缓存长度确定的 200 响应, 数据改变后可以调用 invalidate_cache ()
+
+        添加一个分发路由到服务器中.
+        当添加多个规则同时匹配到一个URL时,只会相应最先添加的那个函数
+        定义URL变量:
+        使用 <type:var_name> 方式定义
+        例如:
+            @app.route ("/api/<string:api_name>/<int:numbers>")
+            def api (context:micro_web.Context, api_name:str, numbers:int,**kwargs):
                 ...
         使用这种方式定义之后,当WEB服务器获得相应的请求时,会将参数传递到您的响应函数中.
         请确保您的参数名填写正确
@@ -568,8 +2739,11 @@ class MICRO_ROUTE ():
             string : 接受任何不包含斜杠的文本(缺省值) 例如: apple11 pair miui12.5
             int    : 接受正整数 例如: 20 30 21
             float  : 接受正浮点数,包括整数 例如: 12.5 20
-            path   : 包含 string int float 使用path变量后面的所有变量会作废,例如 /<path:p>/<int:n>/ , 此时 n 作废
-            custom : 自定义ure解析式,例如: @app.route ("/api/<custom="(.*)":var>/") 请谨慎使用此类型,可能会造成服务器的崩溃
+            path   : 剩余的整个路径 (可以包含斜杠), 至少有一段, 例如 /p/<path:p> 匹配 /p/a/b 但不匹配 /p/.
+                     path 必须是规则的最后一段, 后面还有其他段时 (例如 /<path:p>/<int:n>) 注册时抛出 TypeError
+            custom : 自定义ure解析式,例如: @app.route ("/api/<custom="(.*)":var>/") 请谨慎使用此类型,可能会造成服务器的崩溃.
+                     正则只匹配一个路径段 (不包含斜杠), 例如 /c/<custom=(.*):v> 匹配 /c/a 但不匹配 /c/a/b,
+                     需要匹配多段时请使用 path
             
 
         Example:
@@ -579,55 +2753,44 @@ class MICRO_ROUTE ():
         """
         def decorater (func):
             # "^" + make_path(l_rule) + "/?\??" : 强制匹配开头结尾
-            self.append_to_route_tree (rule,func,method,auto_recv)
+            self.append_to_route_tree (rule,func,method,auto_recv,max_body_size,cache)
             return func
         return decorater
 
     def __match_rule (self,url:str,method:str) -> (callable,dict):
         """
         检索 _routes 查找是否有相应的规则被匹配
-        如果被匹配,将会返回一个元组 (func,{var_name : value},auto_recv)
+        如果被匹配,将会返回一个元组 (func,{var_name : value},auto_recv,max_body_size,cache,rule)
         如果没有被匹配,返回None
+        method 需要是大写的, 只会检索该请求方式的路由
         """
-        result  = None
+        tree = self.__routes.get (method)
+        m = tree.match (url) if tree else None
+        if not m and method == "HEAD":
+            tree = self.__routes.get ("GET") # 没有 HEAD 的规则时使用 GET 的处理函数, 只发送头部
+            m = tree.match (url) if tree else None
+        if not m:
+            return None
+
+        route, values = m
         kw_args = {}
-        for i in self.__routes:
-            result = re.match (i ['rule'],url)
-            if result:
-                # 有结果代表匹配到了
-
-                if not i["method"].lower () == method.lower ():
-                    # 访问方式不匹配,跳过
-                    continue
+        for var_tp, value in zip (route["url_vars"], values):
+            # var_tp = (var_name, var_type), 无类型说明默认为str
+            try:
+                kw_args [var_tp[0]] = var_tp[1](value) if len (var_tp) == 2 else value
+            except:
+                return None # 类型转换失败, 视为没有匹配
+        return (route["func"],kw_args,route["auto_recv"],route["max_body_size"],route["cache"],route["rule"])
 
-                # 检测是否有变量列表
-                if i.get ("url_vars"): 
-                    try:
-                        # 获取 result 中的所的组
-                        idx = 1
-                        while True:
-                            var_tp = i ["url_vars"][idx-1] 
-                            # var_tp = (var_name, var_type)
-                            # var_name = var_tp[0]
-
-                            # 有类型则进行转化,无类型则跳过
-                            if len (var_tp) == 2: # 有类型
-                                # 有类型则转化
-                                value = var_tp[1](result.group (idx))
-                            else:
-                                # 无类型说明默认为str
-                                value = result.group (idx)
-                            
-                            # var_tp[0] 变量名
-                            kw_args [var_tp[0]] = value
-                            # 按顺序取出变量,放入kw_args中
-                            idx += 1
-                    except:
-                        # 报错说明没了
-                        pass
-                return (i["func"],kw_args,i["auto_recv"])
-        # 没有被截胡说明没有被匹配到
-        return None
+    def __allowed_methods (self,url:str) -> list:
+        """
+        返回能够匹配这个 URL 的所有请求方式, 用于 405 响应的 Allow 头
+        HEAD 会使用 GET 的处理函数, 所以允许 GET 时也允许 HEAD
+        """
+        allowed = [m for m, tree in self.__routes.items () if tree.match (url)]
+        if "GET" in allowed and "HEAD" not in allowed:
+            allowed.append ("HEAD")
+        return allowed
 
     def __accept_handler (self,sock:socket.socket):
         """
@@ -640,16 +2803,18 @@ class MICRO_ROUTE ():
                 client, addr = sock.accept ()
                 self.__process_handler (client, addr)
             except Exception as e:
-                debug_info (4,"Accept request faild: ", e)
+                if DEBUG >= 4: debug_info (4,"Accept request faild: ", e)
 
         if self.__blocked and not self.__muti_thread:
             # 单线程 - 阻塞
-            while True:
+            while not (self.__stopped or self.__stopping):
                 try:
                     client, addr = sock.accept ()
                     self.__process_handler (client, addr)
                 except Exception as e:
-                    debug_info (4,"Accept request faild: ", e)
+                    if self.__stopped or self.__stopping:
+                        break # stop () 关闭了监听的 socket
+                    if DEBUG >= 4: debug_info (4,"Accept request faild: ", e)
 
 
         if self.__muti_thread and not self.__blocked:
@@ -657,141 +2822,971 @@ class MICRO_ROUTE ():
             # 被回调调用
             try:
                 client, addr = sock.accept ()
-                _thread.start_new_thread (self.__process_handler,(client,addr))
-                debug_info (3,"====Accepted a new request :", addr, " ====")
+                self.__dispatch (client,addr)
             except Exception as e:
-                debug_info (4,"Accept request faild: ", e)
+                if DEBUG >= 4: debug_info (4,"Accept request faild: ", e)
 
 
         if self.__muti_thread and self.__blocked:
             # 多线程 - 阻塞
-            while True:
+            while not (self.__stopped or self.__stopping):
                 try:
                     client, addr = sock.accept ()
-                    _thread.start_new_thread (self.__process_handler,(client,addr))
-                    debug_info (3,"====Accepted a new request :", addr, " ====")
+                    self.__dispatch (client,addr)
                 except Exception as e:
-                    debug_info (4,"Accept request faild: ", e)
-        
-    def __process_handler (self,client:socket.socket,addr:tuple):
+                    if self.__stopped or self.__stopping:
+                        break # stop () 关闭了监听的 socket
+                    if DEBUG >= 4: debug_info (4,"Accept request faild: ", e)
+
+    def __dispatch (self,client:socket.socket,addr:tuple):
         """
-        处理请求的函数
+        将连接交给线程池处理, 队列已满时直接回应 503 并断开
         """
+        if self.__queue.put ((client,addr)):
+            self.__accepted += 1
+            if DEBUG >= 3: debug_info (3,"====Accepted a new request :", addr, " ====")
+            return
+        self.__rejected += 1
+        if DEBUG >= 2: debug_info (2,"worker queue is full, reject: ", addr)
+        # 尽力而为, 不在 accept 的线程中等待: 非阻塞地写出 503,
+        # 再读掉已经到达的请求 (关闭时有未读的数据会发送 RST, 客户端就收不到 503 了)
         try:
-            # 解析headers
-            line = client.readline ().decode ().strip()
-            # 读请求地址
-            m = __comper_agreement.search (line)
-            head = [m.group (i) for i in range(1,4)]
-
-            headers = {}
-            # Headers 解析
-            while line:
-                line = client.readline ().decode ().strip()
-                if line != "":
-                    #非空就是headers
-                    idx = line.find (':')
-                    headers [line[:idx]] = line [idx+2:]
-                else:
-                    # 空行代表报文结束
+            client.setblocking (False)
+            (getattr (client, "send", None) or client.write) (_RESP_503)
+            client.shutdown (socket.SHUT_WR)
+            client.recv (MAX_HEADER_SIZE)
+        except: pass
+        client.close ()
+
+    def __worker (self,queue:_Work_Queue):
+        """
+        工作线程, 从队列中取出连接并处理, 取到 None 时退出
+        """
+        buf = _Recv_Buffer () # 每个工作线程一个接收缓冲区, 处理的连接依次使用
+        while True:
+            job = queue.get ()
+            if job is None:
+                break
+            try:
+                self.__process_handler (job[0], job[1], buf)
+            except Exception as e:
+                debug_info (1,"worker error: ", e)
+
+    def pool_stats (self) -> dict:
+        """
+        返回线程池的运行状态, 用于调整 pool_size 和 queue_size
+        {
+            "pool_size"   : 工作线程数量,
+            "queue_size"  : 队列容量,
+            "queue_depth" : 当前排队的连接数量,
+            "max_depth"   : 出现过的最大排队数量,
+            "accepted"    : 交给线程池处理的连接数量,
+            "rejected"    : 因队列已满被 503 拒绝的连接数量
+        }
+        """
+        queue = self.__queue
+        return {
+            "pool_size"   : self.__pool_size,
+            "queue_size"  : queue.size if queue else 0,
+            "queue_depth" : len (queue.items) if queue else 0,
+            "max_depth"   : queue.max_depth if queue else 0,
+            "accepted"    : self.__accepted,
+            "rejected"    : self.__rejected
+        }
+
+    def gc_policy (self,mode:str="request",every:int=1,threshold:int=0,idle:bool=False):
+        """
+        设置处理请求后的垃圾回收策略
+        :param mode : "request"   每个请求结束后回收一次 (默认)
+                      "every"     每处理 every 个请求回收一次
+                      "threshold" MicroPython 中剩余内存 (gc.mem_free ()) 低于 threshold 字节时回收,
+                                  CPython 中没有 mem_free (), 交给解释器自动的分代回收
+                      "off"       不主动回收
+        :param idle : 为 True 时, 所有连接都处理完 (服务器空闲) 并且有未回收的请求时也回收一次,
+            把回收的停顿放到没有请求在等待的时候
+        回收的耗时可以通过 gc_stats () 查看, 用于选择合适的策略
+        """
+        if mode not in ("request", "every", "threshold", "off"):
+            raise ValueError ("unknown gc policy: " + str (mode))
+        self.__gc_mode = mode
+        self.__gc_every = max (1, every)
+        self.__gc_threshold = threshold
+        self.__gc_idle = idle
+
+    def gc_stats (self) -> dict:
+        """
+        返回处理请求时垃圾回收的统计
+        {
+            "mode"    : 当前的回收策略,
+            "count"   : 回收次数,
+            "sum_us"  : 回收的总耗时 (微秒),
+            "max_us"  : 最长的一次回收耗时,
+            "buckets" : 按照 METRICS_BUCKETS 分桶的次数, 最后一个为 +Inf,
+            "pending" : 上次回收之后处理的请求数量
+        }
+        """
+        return {
+            "mode"    : self.__gc_mode,
+            "count"   : self.__gc_count,
+            "sum_us"  : self.__gc_sum,
+            "max_us"  : self.__gc_max,
+            "buckets" : list (self.__gc_buckets),
+            "pending" : self.__gc_pending
+        }
+
+    def __collect (self):
+        """
+        回收一次并记录耗时
+        """
+        start = _ticks_us ()
+        gc.collect ()
+        us = _ticks_diff (_ticks_us (), start)
+        self.__gc_pending = 0
+        self.__gc_count += 1
+        self.__gc_sum += us
+        if us > self.__gc_max:
+            self.__gc_max = us
+        self.__gc_buckets[_bucket (us)] += 1
+
+    def __after_request (self):
+        """
+        一个请求结束后按照回收策略决定是否回收
+        """
+        self.__gc_pending += 1
+        mode = self.__gc_mode
+        if mode == "request":
+            self.__collect ()
+        elif mode == "every":
+            if self.__gc_pending >= self.__gc_every:
+                self.__collect ()
+        elif mode == "threshold":
+            if hasattr (gc, "mem_free") and gc.mem_free () < self.__gc_threshold:
+                self.__collect ()
+
+    def __after_connection (self):
+        """
+        一个连接结束后, 服务器空闲时回收 (gc_policy (idle=True))
+        """
+        self.__active -= 1
+        if self.__gc_idle and self.__active <= 0 and self.__gc_pending:
+            self.__collect ()
+        if not _thread and self.__access_log is not None and self.__active <= 0:
+            self.__access_log.flush () # 没有定时写出的线程, 空闲时写出
+
+    def cache_stats (self) -> dict:
+        """
+        返回所有路由响应缓存的统计
+        {
+            "hits"      : 命中次数,
+            "misses"    : 没有命中 (包括过期) 的次数,
+            "evictions" : 因数量或者大小超出限制被淘汰的次数,
+            "entries"   : 当前缓存的响应数量,
+            "bytes"     : 当前缓存的总大小
+        }
+        """
+        stats = {"hits" : 0, "misses" : 0, "evictions" : 0, "entries" : 0, "bytes" : 0}
+        for func, cache in self.__caches:
+            stats["hits"] += cache.hits
+            stats["misses"] += cache.misses
+            stats["evictions"] += cache.evictions
+            stats["entries"] += len (cache.entries)
+            stats["bytes"] += cache.bytes
+        return stats
+
+    def invalidate_cache (self,target=None):
+        """
+        使路由的响应缓存失效
+        :param target : 处理函数 (清空这个路由的缓存), URL (删除这个 URL 所有参数的缓存),
+            不传入时清空所有缓存
+        """
+        for func, cache in self.__caches:
+            if target is None:
+                cache.invalidate ()
+            elif type (target) == str:
+                cache.invalidate (target)
+            elif func is target:
+                cache.invalidate ()
+
+    def enable_metrics (self,path:str="/metrics"):
+        """
+        开始统计每个路由的请求数量, 状态码, 发送的字节数和各阶段的耗时,
+        阶段为 parse (解析请求头), match (匹配路由), handler (接收数据和处理函数), send (发送响应).
+        耗时按照 METRICS_BUCKETS (微秒) 分桶计数, 内存占用和请求数量无关.
+        没有匹配到处理函数的请求计入 "static" (交给静态文件处理, 包括文件不存在的 404) 或者 "unmatched" (405 等)
+        :param path : 以 Prometheus 文本格式输出统计的 URL, 为 None 时不添加这个路由
+        """
+        if self.__metrics is None:
+            self.__metrics = {}
+        self.__timing = True
+        if path:
+            def metrics (context:Context):
+                context.response.mime_type = "text/plain; version=0.0.4"
+                return _prometheus (self.stats ())
+            self.append_to_route_tree (path, metrics, "GET", False)
+
+    def enable_access_log (self,target=None,buffer_size:int=ACCESS_LOG_BUFFER_SIZE,flush_interval:int=ACCESS_LOG_FLUSH_INTERVAL):
+        """
+        开始记录访问日志, 每个请求结束后记录一行 (logfmt 格式), 包括状态码, 发送的字节数和总耗时 (微秒).
+        日志先缓冲在内存中, 不会每个请求都 print () 一次
+        :param target : 日志写入的文件路径或者有 write () 方法的对象, 默认 sys.stdout
+        :param buffer_size : 缓冲的日志达到这个大小 (字节) 时写出
+        :param flush_interval : 距离上次写出超过这个时间 (秒) 时, 下一条日志会连同缓冲一起写出.
+            支持 _thread 时还有一个线程每隔 flush_interval 秒写出一次, 没有新的请求时日志也不会一直留在缓冲中,
+            否则在服务器空闲 (所有连接都结束) 时写出
+        """
+        self.__access_log = _Access_Log (sys.stdout if target is None else target, buffer_size, flush_interval)
+        self.__timing = True
+        self.__start_log_flusher ()
+
+    def __start_log_flusher (self):
+        """
+        启动定时写出访问日志的线程, 每个进程一个 (run (workers=N) 的子进程在 run () 中启动)
+        """
+        log = self.__access_log
+        if log is None or not _thread or self.__log_flusher is log:
+            return
+        self.__log_flusher = log
+        _thread.start_new_thread (self.__log_flush_loop, (log,))
+
+    def __log_flush_loop (self,log:_Access_Log):
+        """
+        定时写出访问日志, 更换了日志或者 stop () 后退出
+        """
+        while self.__log_flusher is log:
+            time.sleep (log.flush_interval)
+            log.flush ()
+
+    def flush_access_log (self):
+        """
+        立即写出缓冲中的访问日志, stop () 时会自动调用
+        """
+        if self.__access_log is not None:
+            self.__access_log.flush ()
+
+    def stats (self) -> dict:
+        """
+        返回 enable_metrics () 之后的统计, 没有开启时返回空的 dict
+        {
+            路由 : {
+                "count"      : 请求数量,
+                "statuses"   : {状态码 : 数量},
+                "bytes_sent" : 发送的字节数 (包括头部),
+                "phases"     : {
+                    "parse" : {"sum_us" : 总耗时, "buckets" : [每个 METRICS_BUCKETS 分桶的数量..., +Inf 的数量]},
+                    "match" : ..., "handler" : ..., "send" : ...
+                }
+            }
+        }
+        """
+        if self.__metrics is None:
+            return {}
+        return {route : m.dump () for route, m in self.__metrics.items ()}
+
+    def __record (self,context:Context):
+        """
+        响应结束后把这个请求计入对应路由的统计, 并写入访问日志
+        """
+        request = context.request
+        response = context.response
+        _mark (request, 4)
+        times = request._timing[1:]
+        if self.__metrics is not None:
+            m = self.__metrics.get (request._route)
+            if m is None:
+                m = self.__metrics[request._route] = _Route_Metrics ()
+            m.record (response.statu_code, response.bytes_sent, times)
+        if self.__access_log is not None:
+            self.__access_log.write ('ts={0} addr={1} method={2} url={3} status={4} bytes={5} us={6} route={7}\n'.format (
+                int (time.time ()), request.addr[0] if request.addr else "-", request.method,
+                json.dumps (request.url + "?" + request._query if request._query else request.url), response.statu_code, response.bytes_sent, sum (times),
+                json.dumps (request._route)
+            ))
+
+    def __cache_lookup (self,context:Context,f:tuple):
+        """
+        GET 请求的路由有缓存时返回 (缓存, 键). 命中时直接发送缓存的响应并返回 None,
+        没有命中时开始记录本次响应
+        """
+        cache = f[4]
+        if not cache or context.request.method != "GET":
+            return (None, None)
+        key = cache.key (context.request)
+        entry = cache.get (key)
+        if entry:
+            if DEBUG >= 3: debug_info (3, "response cache hitted.")
+            context.response._send_cached (entry[2], entry[3])
+            return None
+        context.response._capture = []
+        return (cache, key)
+
+    def __cache_store (self,context:Context,cache:_Response_Cache,key:str):
+        """
+        响应完整时把记录下来的响应存入缓存
+        """
+        captured = context.response._capture
+        context.response._capture = None
+        if not captured or context.response.statu_code != "200":
+            return
+        body = b"".join (captured[1:])
+        length = context.response.headers.get ("Content-Length")
+        if length is not None and int (length) == len (body):
+            cache.put (key, context.request.url, captured[0], body)
+
+    def __recv_head (self,client:socket.socket,buf:_Recv_Buffer) -> tuple:
+        """
+        读取并解析一个请求的请求行和 headers
+        成功返回 (head, headers, 开始解析的时间), 连接关闭或者报文错误返回 None
+        """
+        try:
+            end = buf.find_head ()
+            while end < 0:
+                if buf.pending () >= len (buf.buf):
+                    raise ValueError ("431") # 缓冲区满了还没有读完请求头
+                if not buf.fill ():
+                    return None # 连接已关闭
+                end = buf.find_head ()
+            start = _ticks_us () if self.__timing else 0
+            head, headers = _parse_head (buf.take (end - buf.start))
+            if DEBUG >= 4: debug_info (4,"parse headers: ", headers)
+            return (head, headers, start)
+        except ValueError as e:
+            if DEBUG >= 3: debug_info (3,"bad request: ", e)
+            try: (getattr (client, "sendall", None) or client.write) (_error_response (e.args[0]))
+            except: pass
+            return None
+        except Exception as e:
+            if DEBUG >= 3: debug_info (3,"faild to recv headers: ", e)
+            return None
+
+    async def __async_recv_head (self,reader,writer,buf:_Recv_Buffer) -> tuple:
+        """
+        __recv_head () 的异步版本
+        """
+        try:
+            end = buf.find_head ()
+            while end < 0:
+                space = len (buf.space ())
+                if not space:
+                    raise ValueError ("431")
+                data = await reader.read (space)
+                if not data:
+                    return None
+                buf.feed (data)
+                end = buf.find_head ()
+            start = _ticks_us () if self.__timing else 0
+            head, headers = _parse_head (buf.take (end - buf.start))
+            if DEBUG >= 4: debug_info (4,"parse headers: ", headers)
+            return (head, headers, start)
+        except ValueError as e:
+            if DEBUG >= 3: debug_info (3,"bad request: ", e)
+            writer.write (_error_response (e.args[0]))
+            return None
+        except Exception as e:
+            if DEBUG >= 3: debug_info (3,"faild to recv headers: ", e)
+            return None
+
+    def __create_context (self,client,addr:tuple,head:list,headers:dict,buf:_Recv_Buffer,reader,served:int,start:int=0,last:Context=None,writer=None) -> Context:
+        """
+        为一个请求创建 context, served 为这个连接已经处理的请求数量 (包括本次)
+        start 为开始解析请求头的时间, 开启性能统计时使用
+        last 为这个连接上一个请求的 context, reuse_context 为 True 时重置后复用
+        writer 为响应写出数据的对象, 默认为 client
+        """
+        keep_alive = self.__keep_alive and served < self.__max_requests
+        if last is not None and self.reuse_context:
+            context = last
+            request = context.request
+            request._reset (head, headers, buf)
+            context.response._reset (keep_alive and request.keep_alive, request.http_version == "HTTP/1.1", request.method == "HEAD")
+            context.session = None
+        else:
+            request = _Request (client,addr,head,headers,buffer=buf,reader=reader)
+            context = Context (
+                request,
+                _Response (writer or client,
+                    keep_alive = keep_alive and request.keep_alive,
+                    chunked = request.http_version == "HTTP/1.1",
+                    no_body = request.method == "HEAD",
+                    request = request,
+                    file_cache = self.static_cache
+                )
+            )
+        if self.__timing:
+            request._timing = [start, 0, 0, 0, 0]
+            _mark (request, 1)
+        if DEBUG >= 3: debug_info (3,"Context create: ", context)
+        if DEBUG >= 3: debug_info (3,"New request: ", context.request.url)
+        return context
+
+    def __process_handler (self,client:socket.socket,addr:tuple,buf:_Recv_Buffer=None):
+        """
+        处理一个连接, 在保持连接 (keep-alive) 时依次处理这个连接上的多个请求
+        :param buf : 复用的接收缓冲区, 不传入时为这个连接创建一个
+        """
+        _no_delay (client)
+        if buf is None:
+            buf = _Recv_Buffer (client)
+        else:
+            buf.attach (client)
+        context = None
+        served = 0
+        self.__active += 1
+        try:
+            while True:
+                # 等待下一个请求, 空闲超时后断开. 第一个请求没有设置 timeout 时同样使用 keep_alive_timeout,
+                # 否则不发送请求的连接会一直占用工作线程
+                client.settimeout (self.__keep_alive_timeout if served else (self.__timeout or self.__keep_alive_timeout))
+                r = self.__recv_head (client,buf)
+                client.settimeout (self.__timeout)
+                if not r:
+                    break
+                served += 1
+
+                context = self.__create_context (client,addr,r[0],r[1],buf,None,served,r[2],context)
+                try:
+                    self.__handle_request (context)
+                finally:
+                    context.response.close () # 结束响应
+                if self.__timing:
+                    self.__record (context)
+                self.__after_request ()
+                if DEBUG >= 4: debug_info (4,"------responsed------")
+
+                request = context.request
+                if not context.response.keep_alive or not request.keep_alive or not request._drain ():
+                    break
+        except Exception as e:
+            if DEBUG >= 3: debug_info (3,"connection aborted: ", e)
+        finally:
+            try: client.close ()
+            except: pass
+            self.__after_connection ()
+
+    async def __async_process_handler (self,reader,writer):
+        """
+        __process_handler () 的异步版本, 由 asyncio.start_server 为每个连接调用
+        """
+        addr = writer.get_extra_info ("peername")
+        buf = _Recv_Buffer ()
+        context = None
+        served = 0
+        self.__active += 1
+        try:
+            while True:
+                try:
+                    r = await asyncio.wait_for (self.__async_recv_head (reader,writer,buf),
+                        self.__keep_alive_timeout if served else self.__timeout)
+                except asyncio.TimeoutError:
+                    r = None # 空闲超时
+                except Exception as e:
+                    if DEBUG >= 3: debug_info (3,"faild to recv headers: ", e)
+                    r = None
+                if not r:
+                    break
+                served += 1
+
+                context = self.__create_context (writer,addr,r[0],r[1],buf,reader,served,r[2],context)
+                try:
+                    await self.__async_handle_request (context)
+                finally:
+                    context.response.close () # 结束响应
+                    await writer.drain ()
+                if self.__timing:
+                    self.__record (context)
+                self.__after_request ()
+                if DEBUG >= 4: debug_info (4,"------responsed------")
+
+                request = context.request
+                if not context.response.keep_alive or not request.keep_alive or not await request._adrain ():
                     break
-            debug_info (4,"parse headers: ", headers)
         except Exception as e:
-            debug_info (3,"faild to recv headers: ", e)
+            if DEBUG >= 3: debug_info (3,"connection aborted: ", e)
+        finally:
+            try:
+                writer.close ()
+                await writer.wait_closed ()
+            except: pass
+            self.__after_connection ()
+
+    def poll (self,timeout:float=0) -> int:
+        """
+        非阻塞模式 (run (blocked=False)) 下处理一次已经就绪的连接, 最多等待 timeout 秒, None 为一直等待.
+        返回处理的事件数量. 主循环中可以在其他工作之间调用, 例如:
+            app.run ()
+            while True:
+                app.poll (0.05)
+                do_other_work ()
+        所有连接在调用 poll () 的线程中处理, 请求数据按到达的顺序逐步解析, 响应放入每个连接的发送队列,
+        socket 可写时再发送. 请求数据超过 max_body_size (例如上传文件) 时, 处理函数读取数据期间会阻塞
+        (每次读取最多等待 timeout 秒, 没有设置时为 keep_alive_timeout),
+        流式响应的发送队列超过 LOOP_OUTPUT_LIMIT 时也会阻塞发送, 所以内存占用不随响应大小增长.
+        MicroPython 中使用 socket 的回调处理连接, 不需要调用 poll ()
+        """
+        selector = self.__selector
+        if selector is None:
+            return 0
+        events = selector.select (timeout)
+        for key, mask in events:
+            conn = key.data
+            if conn is None:
+                self.__loop_accept ()
+            elif conn.sock is not None:
+                if mask & selectors.EVENT_READ:
+                    self.__loop_read (conn)
+                else:
+                    self.__loop_process (conn)
+        now = time.time ()
+        if now - self.__sweep >= 1:
+            # 断开超时没有活动的连接
+            self.__sweep = now
+            for key in list (selector.get_map ().values ()):
+                if key.data is not None and now > key.data.deadline:
+                    self.__loop_close (key.data)
+        return len (events)
+
+    def __loop_start (self):
+        """
+        为非阻塞模式创建 selectors 事件循环
+        """
+        self.__SOCK.setblocking (False)
+        self.__selector = selectors.DefaultSelector () # Linux 上为 epoll
+        self.__selector.register (self.__SOCK, selectors.EVENT_READ, None)
+        self.__sweep = time.time ()
+
+    def __loop_accept (self):
+        """
+        接受所有等待中的连接. 多线程模式下交给线程池处理, 否则注册到事件循环中
+        """
+        while True:
+            try:
+                client, addr = self.__SOCK.accept ()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                if DEBUG >= 4: debug_info (4,"Accept request faild: ", e)
+                return
+            if self.__muti_thread:
+                client.setblocking (True)
+                client.settimeout (self.__timeout)
+                self.__dispatch (client, addr)
+                continue
+            client.setblocking (False)
+            _no_delay (client)
+            conn = _Connection (client, addr, self.__timeout or self.__keep_alive_timeout)
+            conn.deadline = time.time () + (self.__timeout or self.__keep_alive_timeout)
+            conn.events = selectors.EVENT_READ
+            self.__selector.register (client, conn.events, conn)
+            self.__active += 1
+            if DEBUG >= 3: debug_info (3,"====Accepted a new request :", addr, " ====")
+
+    def __loop_close (self,conn:_Connection):
+        if conn.sock is None:
             return
+        try: self.__selector.unregister (conn.sock)
+        except: pass
+        conn.close ()
+        conn.sock = None
+        self.__after_connection ()
 
-        # 创建 context
-        context = Context (
-            __Request  (client,addr,head,headers),
-            __Response (client)
-        )
-        debug_info (3,"Context create: ", context)
-        debug_info (3,"New request: ", context.request.url)
+    def __loop_read (self,conn:_Connection):
+        """
+        socket 可读时接收数据, 正在接收请求数据时直接写入请求数据的缓冲区
+        """
+        try:
+            if conn.body is None:
+                n = conn.buf.fill ()
+            else:
+                data = conn.sock.recv (min (conn.length - len (conn.body), BODY_CHUNK_SIZE))
+                conn.body += data
+                n = len (data)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            n = 0
+        if not n:
+            self.__loop_close (conn) # 连接已关闭
+            return
+        conn.deadline = time.time () + (self.__timeout or self.__keep_alive_timeout)
+        self.__loop_process (conn)
+
+    def __loop_process (self,conn:_Connection):
+        """
+        发送队列中的数据, 发送完后依次处理已经完整收到的请求, 最后根据状态注册需要等待的事件
+        """
+        while True:
+            if conn.out:
+                try:
+                    done = conn.flush ()
+                except OSError:
+                    done = None
+                if done is None:
+                    self.__loop_close (conn)
+                    return
+                if not done:
+                    self.__loop_wait (conn, selectors.EVENT_WRITE) # 等待可写, 期间不再读取新的请求
+                    conn.deadline = time.time () + self.__keep_alive_timeout
+                    return
+            if conn.closing:
+                self.__loop_close (conn)
+                return
+            if not self.__loop_next (conn):
+                self.__loop_wait (conn, selectors.EVENT_READ)
+                return
+
+    def __loop_wait (self,conn:_Connection,events:int):
+        if conn.events != events:
+            conn.events = events
+            self.__selector.modify (conn.sock, events, conn)
+
+    def __loop_next (self,conn:_Connection) -> bool:
+        """
+        解析并处理连接上的下一个请求, 数据还不完整时返回 False
+        """
+        buf = conn.buf
+        if conn.head is None:
+            end = buf.find_head ()
+            if end < 0:
+                if buf.pending () >= len (buf.buf):
+                    conn.write (_error_response ("431")) # 缓冲区满了还没有读完请求头
+                    conn.closing = True
+                    return True
+                return False
+            start = _ticks_us () if self.__timing else 0
+            try:
+                head, headers = _parse_head (buf.take (end - buf.start))
+            except ValueError as e:
+                if DEBUG >= 3: debug_info (3,"bad request: ", e)
+                conn.write (_error_response (e.args[0]))
+                conn.closing = True
+                return True
+            try: length = int (_get_header (headers, "Content-Length") or 0)
+            except: length = 0
+            f = False # 还没有匹配路由, 由 __handle_request () 匹配
+            if length > 0:
+                # 请求数据不超过路由的 max_body_size 时先全部接收, 处理函数读取数据时不会阻塞.
+                # 缓冲区随着数据到达增长, 不按 Content-Length 预先分配
+                f = self.__match_rule (head[1].split ("?", 1)[0], head[0])
+                if length <= (self.max_body_size if not f or f[3] is None else f[3]):
+                    conn.body = bytearray (buf.take (length))
+                    conn.length = length
+            conn.head = (head, headers, start, f)
+        if conn.body is not None and len (conn.body) < conn.length:
+            return False # 等待剩下的请求数据
+        self.__loop_request (conn)
+        return True
+
+    def __loop_request (self,conn:_Connection):
+        """
+        处理一个已经收到的请求, 响应放入连接的发送队列
+        """
+        head, headers, start, f = conn.head
+        body = conn.body
+        conn.head = conn.body = None
+        if body is not None:
+            data, body = body, _Recv_Buffer (conn.sock, 0)
+            body.load (data)
+        conn.served += 1
+        context = self.__create_context (conn.sock,conn.addr,head,headers,body or conn.buf,None,conn.served,start,conn.context,conn)
+        request = context.request
+        blocking = body is None and request._remaining > 0
+        try:
+            if blocking:
+                # 请求数据太大, 没有预先接收, 处理函数读取期间阻塞.
+                # 总是使用有限的超时, 一个很慢的上传不会让事件循环一直停住
+                conn.sock.setblocking (True)
+                conn.sock.settimeout (self.__timeout or self.__keep_alive_timeout)
+            try:
+                self.__handle_request (context, f)
+            finally:
+                context.response.close () # 结束响应
+            if self.__timing:
+                self.__record (context)
+            self.__after_request ()
+            if DEBUG >= 4: debug_info (4,"------responsed------")
+            if not context.response.keep_alive or not request.keep_alive or not request._drain ():
+                conn.closing = True
+        except Exception as e:
+            if DEBUG >= 3: debug_info (3,"connection aborted: ", e)
+            conn.closing = True
+        finally:
+            if blocking and conn.sock is not None:
+                conn.sock.setblocking (False)
+        conn.context = context if self.reuse_context else None
+        conn.deadline = time.time () + self.__keep_alive_timeout
+
+    def __parse_form (self,context:Context):
+        """
+        尝试将请求的数据解析为表单或者 json
+        """
+        if DEBUG >= 4: debug_info (4, "try to load the data to form obj.")
+        content_type = _get_header (context.request.headers, "Content-Type") or ""
+        if content_type.startswith ("application/x-www-form-urlencoded"):
+            context.request.form = load_form_data (context.request.data)
+        elif "application/json" in content_type:
+            context.request.form = _json_loads (context.request.data)
+
+    def __abort_error (self,context:Context,e:Exception):
+        """
+        处理函数或者接收数据时发生错误, 回应对应的状态码
+        """
+        code = _error_code (e)
+        if code == "413":
+            context.response.keep_alive = False # 剩下的数据太多, 不再读取, 直接断开
+        context.response.abort (code)
+
+    def __is_multipart (self,context:Context) -> bool:
+        return (_get_header (context.request.headers, "Content-Type") or "").startswith ("multipart/form-data")
 
-        rst = None
+    def __recv_multipart (self,context:Context):
+        """
+        接收 multipart/form-data 数据, 普通字段保存到 request.form, 文件保存到 request.files
+        """
+        writer = _Upload_Writer (context.request, self.upload_dir, self.max_upload_size)
+        try:
+            for part in context.request.multipart ():
+                writer.begin (part)
+                chunk = part.read (MULTIPART_BUFFER_SIZE)
+                while chunk:
+                    writer.write (chunk)
+                    chunk = part.read (MULTIPART_BUFFER_SIZE)
+                writer.end ()
+        finally:
+            writer.abort ()
+
+    async def __arecv_multipart (self,context:Context):
+        """
+        __recv_multipart () 的异步版本
+        """
+        writer = _Upload_Writer (context.request, self.upload_dir, self.max_upload_size)
+        try:
+            async for part in context.request.multipart ():
+                writer.begin (part)
+                chunk = await part.aread (MULTIPART_BUFFER_SIZE)
+                while chunk:
+                    writer.write (chunk)
+                    chunk = await part.aread (MULTIPART_BUFFER_SIZE)
+                writer.end ()
+        finally:
+            writer.abort ()
+
+    def __send_result (self,context:Context,rst):
+        """
+        发送处理函数的返回值
+        """
+        if not context.response._responsed and rst:
+            # 如果用户还没操作过且有返回数据
+            # 对其进行传输
+            if _is_stream (rst):
+                if hasattr (rst, "__anext__"):
+                    debug_info (0, "async iterator can only be returned in serve () mode.")
+                    context.response.abort ("500")
+                else:
+                    context.response.stream (rst)
+                return
+            if type (rst) == str:
+                rst = rst.encode (charset)
+            if self.gzip_min_size and len (rst) >= self.gzip_min_size:
+                rst = self.__compress (context, rst)
+            context.response.headers.update(
+                {"Content-Length": str(len (rst))}
+            ) # 设置 header
+            context.response.send (rst)
+
+    def __compress (self,context:Context,rst:bytes) -> bytes:
+        """
+        客户端支持时使用 gzip 压缩处理函数的返回值
+        """
+        headers = context.response.headers
+        if "Content-Encoding" in headers:
+            return rst # 处理函数自己设置了编码
+        headers["Vary"] = "Accept-Encoding"
+        if "gzip" not in _accept_encodings (_get_header (context.request.headers, "Accept-Encoding")):
+            return rst
+        data = _gzip (rst)
+        if data is None or len (data) >= len (rst):
+            return rst
+        headers["Content-Encoding"] = "gzip"
+        return data
+
+    def __static_file (self,url:str) -> str:
+        """
+        获取 URL 对应的本地文件路径, 访问根目录时返回第一个存在的默认页, 没有则返回 None
+        """
+        if url == "" or url == "/":
+            if DEBUG >= 3: debug_info (3, "try to send default index page.")
+            for file_name in DEFAULT_PAGES:
+                # 发送默认页文件, 文件信息会被缓存, send_file () 时不需要再次检查
+                if self.static_cache.get (self.root_path + '/' + file_name):
+                    return self.root_path + '/' + file_name
+            return None
+        return self.root_path + url
+
+    def __handle_request (self,context:Context,f=False):
+        """
+        处理一个请求: 匹配规则并调用处理函数, 没有匹配时尝试发送静态文件
+        f 为已经匹配的结果 (事件循环中有请求数据时已经匹配过), False 为还没有匹配
+        """
         # 匹配规则
-        f = self.__match_rule (context.request.url,context.request.method)
+        if f is False:
+            f = self.__match_rule (context.request.url,context.request.method)
+        allowed = None if f else self.__allowed_methods (context.request.url)
+        _mark (context.request, 2)
         if f:
             # 有处理函数
-            debug_info (3,"rule hitted.")
-
-            method = context.request.method.lower()
-            if f[2] and method == 'post' or method == 'put': # auto_recv
-                debug_info (4, "recv the data part.")
-                context.request.data = context.request.recv_data ()
-                # 尝试解析数据
-                debug_info (4, "try to load the data to form obj.")
-                content_type = context.request.headers["Content-Type"]
-                if content_type in ("application/x-www-form-urlencoded", "multipart/form-data"):
-                    context.request.form = context.request.dump_form_data (context.request.data.decode (charset))
-                elif "application/json" in context.request.headers ["Content-Type"]:
-                    context.request.form = json.loads (context.request.data.decode (charset))
-            del (method)
-
+            if DEBUG >= 3: debug_info (3,"rule hitted.")
+            context.request._route = f[5]
+            method = context.request.method
+            cached = self.__cache_lookup (context, f)
+            if not cached:
+                return # 已经发送了缓存的响应
+            context.request.max_body_size = self.max_body_size if f[3] is None else f[3]
             try:
+                if f[2] and (method == 'POST' or method == 'PUT'): # auto_recv
+                    if DEBUG >= 4: debug_info (4, "recv the data part.")
+                    if self.__is_multipart (context):
+                        self.__recv_multipart (context)
+                    else:
+                        context.request.data = context.request.read ()
+                        self.__parse_form (context)
                 rst = f[0](context,**f[1])
             except Exception as e:
-                # 用户处理函数发生错误, 抛出 500 错误码
-                context.response.abort (500)
-                rts = None # 跳过发送用户数据
+                # 用户处理函数发生错误, 抛出 500 错误码 (请求的数据有问题时为 4xx)
+                self.__abort_error (context, e)
+                rst = None # 跳过发送用户数据
                 debug_info (0, "handle func has some error: ", e)
-
-            if not context.response._responsed and rst:
-                # 如果用户还没操作过且有返回数据
-                # 对其进行传输
-                context.response.headers.update(
-                    {"Content-Length": str(len (rst))}
-                ) # 设置 header
-                context.response.send (rst)
+            _mark (context.request, 3)
+            try: self.__send_result (context, rst)
+            finally: context.request._cleanup ()
+            if cached[0]: self.__cache_store (context, cached[0], cached[1])
+        elif allowed:
+            # URL 能匹配到其他请求方式的规则, 只是请求方式不对
+            if DEBUG >= 3: debug_info (3,"method not allowed.")
+            context.response.headers ["Allow"] = ", ".join (allowed)
+            context.response.abort ("405")
         else:
             # 没有处理函数, 尝试寻找本地文件
-            debug_info (3,"rule not hit")
-            if context.request.url == "" or context.request.url == "/":
-                debug_info (3, "try to send default index page.")
-                for file_name in DEFAULT_PAGES:
-                    # 发送默认页文件
-                    try:
-                        os.stat (self.root_path + '/' + file_name)
-                        # 没报错说明有文件
-                        context.response.send_file (self.root_path + '/' + file_name)
-                        break
-                    except: ...
-                 
-            else:
-                context.response.send_file (self.root_path + context.request.url)
-                
-
-        context.response.close () # 关闭连接
-        gc.collect ()
-        debug_info (4,"------responsed------")
+            if DEBUG >= 3: debug_info (3,"rule not hit")
+            path = self.__static_file (context.request.url)
+            if path:
+                context.request._route = "static"
+                context.response.send_file (path)
+            else: context.response.abort ("404")
+
+    async def __async_handle_request (self,context:Context):
+        """
+        __handle_request () 的异步版本, 处理函数可以是 async def 定义的协程
+        """
+        f = self.__match_rule (context.request.url,context.request.method)
+        allowed = None if f else self.__allowed_methods (context.request.url)
+        _mark (context.request, 2)
+        if f:
+            if DEBUG >= 3: debug_info (3,"rule hitted.")
+            context.request._route = f[5]
+            method = context.request.method
+            cached = self.__cache_lookup (context, f)
+            if not cached:
+                return
+            context.request.max_body_size = self.max_body_size if f[3] is None else f[3]
+            try:
+                if f[2] and (method == 'POST' or method == 'PUT'): # auto_recv
+                    if DEBUG >= 4: debug_info (4, "recv the data part.")
+                    if self.__is_multipart (context):
+                        await self.__arecv_multipart (context)
+                    else:
+                        context.request.data = await context.request.aread ()
+                        self.__parse_form (context)
+                rst = f[0](context,**f[1])
+                if _is_awaitable (rst):
+                    rst = await rst
+            except Exception as e:
+                self.__abort_error (context, e)
+                rst = None
+                debug_info (0, "handle func has some error: ", e)
+            _mark (context.request, 3)
+            try:
+                if rst and not context.response._responsed and _is_stream (rst):
+                    await context.response.astream (rst)
+                else:
+                    self.__send_result (context, rst)
+            finally:
+                context.request._cleanup ()
+            if cached[0]: self.__cache_store (context, cached[0], cached[1])
+        elif allowed:
+            if DEBUG >= 3: debug_info (3,"method not allowed.")
+            context.response.headers ["Allow"] = ", ".join (allowed)
+            context.response.abort ("405")
+        else:
+            if DEBUG >= 3: debug_info (3,"rule not hit")
+            path = self.__static_file (context.request.url)
+            if path:
+                context.request._route = "static"
+                await context.response.asend_file (path)
+            else: context.response.abort ("404")
 
     def run (self,
         timeout:int      = None,
         backlog:int      = 5,
         blocked:bool     = False,
-        muti_thread:bool = False
+        muti_thread:bool = False,
+        keep_alive:bool  = None,
+        keep_alive_timeout:int = 5,
+        max_requests:int = 100,
+        pool_size:int    = 4,
+        queue_size:int   = 16,
+        workers:int      = 1
     ):
         """
         :param timeout: 等待超时的时间
         :param backlog: 最多同时连接的TCP数量
         :param blocked: 是否阻塞线程,设置为True之后除非发生错误或者用户手动中断,此函数将一直不返回
+            为 False 时, MicroPython 通过 socket 的回调处理连接, CPython 中需要循环调用 poll ()
         :param muti_thread: 是否启用多线程
+        :param keep_alive: 是否支持 HTTP 长连接, 默认 (None) 只在多线程模式和 CPython 的非阻塞模式 (poll ()) 下开启.
+            单线程阻塞模式一次只能处理一个连接, 一个空闲的长连接会让其他客户端等待最多 keep_alive_timeout 秒,
+            所以默认不保持连接, 确实需要时可以传入 True. MicroPython 的单线程非阻塞模式下总是不保持连接, 以免阻塞主线程
+        :param keep_alive_timeout: 长连接等待下一个请求的最长时间(秒), 没有设置 timeout 时也是新连接等待第一个请求头的最长时间
+        :param max_requests: 一个连接最多处理的请求数量, 达到后断开连接
+        :param pool_size: 多线程模式下工作线程的数量
+        :param queue_size: 多线程模式下等待处理的连接数量上限, 超出后直接回应 503
+        :param workers: 大于 1 时启动 workers 个子进程 (需要 os.fork (), 仅 CPython), 每个进程使用相同的路由
+            和上面的参数处理请求, 当前进程负责监督: 重启意外退出的子进程, stop () 时通知所有子进程退出.
+            此时 run () 一直阻塞到 stop (), 统计信息 (stats () 等) 只记录在各自的子进程中
         :return: None
         启动WEB服务器.
         可以指定是否阻塞模式.
         """
-        self.__SOCK = socket.socket (self.sock_family, socket.SOCK_STREAM)
-        self.__SOCK.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1) # 设置快速重启 TCP
-        if timeout: self.__SOCK.settimeout (timeout)  
-        self.__SOCK.bind ((self.bind_ip,self.bind_port))
-        self.__SOCK.listen (backlog)
+        if workers > 1:
+            self.__prefork (workers, {
+                "timeout" : timeout, "backlog" : backlog, "blocked" : True, "muti_thread" : muti_thread,
+                "keep_alive" : keep_alive, "keep_alive_timeout" : keep_alive_timeout,
+                "max_requests" : max_requests, "pool_size" : pool_size, "queue_size" : queue_size
+            })
+            return
+
+        self.__SOCK = self.__listen (backlog)
+        if timeout: self.__SOCK.settimeout (timeout)
 
         self.__muti_thread = muti_thread
+        self.__stopped = False
+        self.__start_log_flusher ()
         self.__blocked = blocked
+        self.__timeout = timeout
+        if keep_alive is None:
+            keep_alive = muti_thread or (not blocked and selectors is not None)
+        self.__keep_alive = keep_alive and (blocked or muti_thread or selectors is not None)
+        self.__keep_alive_timeout = keep_alive_timeout
+        self.__max_requests = max_requests
 
         if muti_thread and not _thread:
             raise Exception ("This board may be not support to muti-thread.")
 
+        if muti_thread:
+            # 启动线程池
+            self.__pool_size = pool_size
+            self.__queue = _Work_Queue (queue_size)
+            for _ in range (pool_size):
+                _thread.start_new_thread (self.__worker,(self.__queue,))
+
         if blocked:
             try:
                 # 开始 loop
@@ -801,16 +3796,170 @@ class MICRO_ROUTE ():
                 debug_info (0 , "listen faild: ", e, " the server will stop.")
                 gc.collect ()
                 self.stop ()
+        elif selectors:
+            self.__loop_start () # 由 poll () 处理连接
         else:
             self.__SOCK.setsockopt(socket.SOL_SOCKET, 20, self.__accept_handler) # 设置回调函数
 
+    def __listen (self,backlog:int) -> socket.socket:
+        """
+        创建监听的 socket. 子进程使用父进程创建好的 socket, 或者使用 SO_REUSEPORT 各自监听同一个端口
+        """
+        if self.__inherited is not None:
+            return self.__inherited
+        sock = socket.socket (self.sock_family, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1) # 设置快速重启 TCP
+        if self.__reuse_port:
+            sock.setsockopt (socket.SOL_SOCKET, socket.SO_REUSEPORT, 1) # 由内核在各个进程之间分配连接
+        sock.bind ((self.bind_ip,self.bind_port))
+        sock.listen (backlog)
+        return sock
+
+    def __prefork (self,workers:int,options:dict):
+        """
+        启动 workers 个子进程运行 run (**options) 并监督它们, 直到调用 stop ()
+        支持 SO_REUSEPORT 时每个子进程各自监听, 否则共用在这里创建的 socket
+        """
+        if not hasattr (os, "fork"):
+            raise Exception ("This platform may be not support to fork workers.")
+        self.__reuse_port = hasattr (socket, "SO_REUSEPORT")
+        if not self.__reuse_port:
+            self.__inherited = self.__listen (options["backlog"])
+        self.__stopping = False
+        self.__children = {}
+        previous = {} # 原来的信号处理函数, 返回前恢复
+        if signal:
+            try:
+                for signum in (signal.SIGTERM, signal.SIGINT):
+                    previous[signum] = signal.signal (signum, lambda signum, frame: self.stop ())
+            except ValueError:
+                pass # 不在主线程中, 只能通过 stop () 停止
+        try:
+            gc.collect ()
+            if hasattr (gc, "freeze"):
+                gc.freeze () # 已有的对象不再被回收扫描, 减少子进程中的写时复制
+            for _ in range (workers):
+                self.__spawn (options)
+
+            while self.__children:
+                try:
+                    pid, status = os.wait ()
+                except ChildProcessError:
+                    break
+                started = self.__children.pop (pid, None)
+                if started is None or self.__stopping:
+                    continue
+                debug_info (1, "worker exited, restart it: ", pid, status)
+                if time.time () - started < 1:
+                    time.sleep (1) # 子进程一启动就退出时, 避免不停地重启
+                if not self.__stopping:
+                    self.__spawn (options)
+        finally:
+            for signum, handler in previous.items ():
+                signal.signal (signum, handler)
+            if self.__inherited is not None:
+                self.__inherited.close ()
+                self.__inherited = None
+            self.__children = None
+            self.__stopping = False
+
+    def __spawn (self,options:dict):
+        """
+        fork 一个子进程运行服务器, 子进程在 run () 返回或者出错后退出
+        """
+        pid = os.fork ()
+        if pid:
+            self.__children[pid] = time.time ()
+            return
+        code = 0
+        try:
+            self.__children = None
+            self.__log_flusher = None # 定时写出的线程只在父进程中, 子进程在 run () 中重新启动
+            if signal:
+                signal.signal (signal.SIGTERM, self.__worker_exit)
+                signal.signal (signal.SIGINT, signal.SIG_IGN) # Ctrl-C 由父进程处理
+            self.run (**options)
+        except SystemExit:
+            pass
+        except BaseException as e:
+            debug_info (0, "worker crashed: ", e)
+            code = 1
+        finally:
+            os._exit (code)
+
+    def __worker_exit (self,signum,frame):
+        """
+        子进程收到父进程的 SIGTERM 时停止服务器, accept 循环检查 __stopping 后退出, run () 返回后子进程结束.
+        不在这里抛出 SystemExit, 它可能被请求处理中的 except 吞掉, 导致 accept 循环继续运行
+        """
+        self.__stopping = True
+        self.stop ()
+
+    async def serve (self,
+        timeout:int      = None,
+        backlog:int      = 5,
+        keep_alive:bool  = True,
+        keep_alive_timeout:int = 5,
+        max_requests:int = 100
+    ):
+        """
+        :param timeout: 等待第一个请求头的超时时间(秒)
+        其他参数与 run () 相同
+        以 asyncio 协程的方式启动WEB服务器, 所有连接在同一个线程中并发处理, 直到调用 stop ().
+        处理函数可以是普通函数, 也可以是 async def 定义的协程,
+        在协程中可以使用 await response.asend () 和 await response.asend_file ().
+        例子:
+            asyncio.create_task (app.serve ())
+        """
+        self.__timeout = timeout
+        self.__keep_alive = keep_alive
+        self.__keep_alive_timeout = keep_alive_timeout
+        self.__max_requests = max_requests
+
+        self.__server = await asyncio.start_server (
+            self.__async_process_handler, self.bind_ip, self.bind_port, backlog=backlog
+        )
+        gc.collect ()
+        await self.__server.wait_closed ()
+
+    def run_async (self,**kwargs):
+        """
+        启动 asyncio 事件循环并运行 serve (), 参数与 serve () 相同.
+        此函数将一直不返回, 直到调用 stop ()
+        """
+        asyncio.run (self.serve (**kwargs))
 
     def stop (self) -> bool:
         """
         停止服务器的运行,成功返回True,出错返回Fasle
         """
         try:
-            self.__SOCK.close()
+            if self.__children is not None:
+                # 父进程: 通知所有子进程退出, run () 会等待它们结束后返回
+                self.__stopping = True
+                for pid in list (self.__children):
+                    try: os.kill (pid, signal.SIGTERM)
+                    except OSError: pass
+                return True
+            self.__stopped = True
+            if self.__selector is not None:
+                for key in list (self.__selector.get_map ().values ()):
+                    if key.data is not None:
+                        self.__loop_close (key.data)
+                self.__selector.close ()
+                self.__selector = None
+            if self.__server:
+                self.__server.close ()
+                self.__server = None
+            else:
+                self.__SOCK.close()
+            if self.__queue:
+                # 通知工作线程退出
+                for _ in range (self.__pool_size):
+                    self.__queue.put (None,force=True)
+                self.__queue = None
+            self.flush_access_log ()
+            self.__log_flusher = None
             gc.collect()
             return True
         except:
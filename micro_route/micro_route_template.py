@@ -13,24 +13,46 @@
 # @E-mail m-jay-1376@qq.com
 """
 micro_route 的模板渲染模块.
+
+模板语法:
+    {[ name ]}                     输出表达式的值
+    {% if a > 1 %} ... {% elif a %} ... {% else %} ... {% end %}
+    {% for item in items %} ... {% end %}
+{% end %} 也可以写作 {% endif %} / {% endfor %}.
+
+模板第一次使用时会被编译为一个 Python 函数, 之后每次渲染只调用一次这个函数.
+例子:
+    render = Template_Render ()
+    html = render.rende_file ("/www/list.html", items=[1, 2, 3])
+
+较大的页面可以边渲染边发送, 不需要把整个页面放在内存中:
+    render.rende_to (context.response, "/www/list.html", items=items)
 """
-import micropython
-from micropython import const
+try:
+    import      micropython
+except:
+    # CPython 中没有 micropython 模块, 提供一个兼容的 const ()
+    class micropython ():
+        const = staticmethod (lambda x: x)
 
+try: import      os
+except: import   uos       as os
 
+TEMPLATE_CACHE_SIZE:int = micropython.const (8) # 每个 Template_Render 缓存的已编译模板数量
 
 
 class Template_Render (object):
-    _tags = ("if", "elif", "else", "for")
+    _tags = ("if", "elif", "else", "for", "end", "endif", "endfor")
     _data:str
     _global:dict
     _local:dict
-    
-    def __init__ (self, 
+
+    def __init__ (self,
         sct_prefix:str  = "{%",
         sct_suffix:str  = "%}",  # 结构控制后缀
         var_prefix:str  = "{[", # 获取变量前缀
         var_suffix:str  = "]}", # 获取变量后缀
+        cache_size:int  = TEMPLATE_CACHE_SIZE,
     ):
         self._sct_prefix = sct_prefix   # 结构控制前缀
         self._sct_suffix = sct_suffix   # 结构控制后缀
@@ -38,43 +60,180 @@ class Template_Render (object):
         self._var_prefix  = var_prefix # 获取变量前缀
         self._var_suffix  = var_suffix # 获取变量后缀
         self._var_fix_len = len (self._var_prefix)
+        self._data = ""
+        self._code = None # _data 编译后的代码
+        self._stream_code = None # _data 编译后的生成器代码
+        self._global = {} # 所有模板都可以使用的变量
+        self._local = {}  # 最近一次渲染传入的变量
+        self._cache_size = cache_size
+        self._cache:dict = {} # (path, stream) -> ((mtime, size), code), 最近使用的排在最后
 
-    
-    def rende (self) -> str:
+    def set_template (self,data:str):
         """
-        :return: str
-        rende the template.
-        """
-        result = ""
-        length = len (self._data)
-        cursor = 0 # 游标
-
-        def next_ (n=1) -> str:
-            """
-            :param n: 欲获取的字符数量
-            获取下一个字符
-            """
-            nonlocal cursor
-            char = self._data[cursor:cursor+n]
-            cursor += n
-            return char
-            
-        def tag_handler ():
-            nonlocal result
-            char = next_ () # 获取一个字符
-            
-            
-        while cursor < length:
-            char = next_ ()
-            if char == self._sct_prefix[0]: # 匹配到结构语法前缀
-                prefix = char + next_ ( self._sct_fix_len - 1 )
-                if prefix == self._sct_prefix:
-                    # 匹配到结构前缀
-                    ...
-            elif char == self._var_prefix[0]: # 匹配到变量语法前缀
-                prefix = char + next_ ( self._var_fix_len - 1 )
-                if prefix == self._var_prefix:
-                    # 匹配到变量结构前缀.
-                    ...
+        设置 rende () 使用的模板内容
+        """
+        self._data = data
+        self._code = None
+        self._stream_code = None
+
+    def compile (self,data:str,name:str="<template>",stream:bool=False):
+        """
+        将模板编译为代码, 执行后会定义函数 _render (_emit), 它依次调用 _emit () 输出每一段 str.
+        stream 为 True 时 _render () 是一个生成器, 依次 yield 每一段 str.
+        不支持 compile () 的 MicroPython 固件会返回源码, 每次渲染时再编译.
+        模板语法错误时抛出 SyntaxError
+        """
+        if stream:
+            lines = ["def _render (_str=str):"]
+            output = "yield {0}"
+        else:
+            lines = ["def _render (_emit, _str=str):"]
+            output = "_emit ({0})"
+        stack = [] # 还没有结束的 if / for
+        pos = 0
+        length = len (data)
+        while pos < length:
+            # 找到下一个语法前缀, 中间的内容原样输出
+            sct = data.find (self._sct_prefix, pos)
+            var = data.find (self._var_prefix, pos)
+            if sct < 0 and var < 0:
+                start = length
+            elif sct < 0 or (0 <= var < sct):
+                start = var
+            else:
+                start = sct
+            if start > pos:
+                lines.append (" " * (len (stack) + 1) + output.format (repr (data[pos:start])))
+            if start == length:
+                break
+
+            if start == var:
+                prefix_len, suffix = self._var_fix_len, self._var_suffix
             else:
-                result += char # 没有特殊语义,直接添加到结果中
\ No newline at end of file
+                prefix_len, suffix = self._sct_fix_len, self._sct_suffix
+            end = data.find (suffix, start + prefix_len)
+            if end < 0:
+                raise SyntaxError ("{0}: unclosed tag at {1}".format (name, start))
+            body = data[start + prefix_len:end].strip ()
+            pos = end + len (suffix)
+            if not body:
+                raise SyntaxError ("{0}: empty tag at {1}".format (name, start))
+
+            if start == var:
+                lines.append (" " * (len (stack) + 1) + output.format ("_str (" + body + ")"))
+                continue
+
+            tag = body.split (None, 1)[0]
+            if tag not in self._tags:
+                raise SyntaxError ("{0}: unknown tag '{1}' at {2}".format (name, tag, start))
+            if tag == "if" or tag == "for":
+                lines.append (" " * (len (stack) + 1) + body + ":")
+                stack.append (tag)
+                lines.append (" " * (len (stack) + 1) + "pass") # 允许空的代码块
+            elif tag == "elif" or tag == "else":
+                if not stack or stack[-1] != "if":
+                    raise SyntaxError ("{0}: '{1}' without 'if' at {2}".format (name, tag, start))
+                lines.append (" " * len (stack) + body + ":")
+                lines.append (" " * (len (stack) + 1) + "pass")
+            else:
+                if not stack or (tag != "end" and tag != "end" + stack[-1]):
+                    raise SyntaxError ("{0}: unexpected '{1}' at {2}".format (name, tag, start))
+                stack.pop ()
+        if stack:
+            raise SyntaxError ("{0}: '{1}' is not closed".format (name, stack[-1]))
+        if stream:
+            lines.append (' yield ""') # 保证空模板也是生成器
+
+        source = "\n".join (lines)
+        try:
+            return compile (source, name, "exec")
+        except NameError:
+            return source
+
+    def _run (self,code,emit,kwargs:dict):
+        """
+        使用传入的变量执行编译好的模板, 每一段输出都会传给 emit ()
+        emit 为 None 时 (流式编译的代码) 返回产生每一段输出的生成器
+        """
+        env = dict (self._global)
+        env.update (kwargs)
+        self._local = kwargs
+        exec (code, env)
+        if emit is None:
+            return env["_render"] ()
+        env["_render"] (emit)
+
+    def _load (self,path:str,stream:bool=False):
+        """
+        获取模板文件编译后的代码, 以路径和修改时间 (以及文件大小) 缓存
+        """
+        st = os.stat (path)
+        mtime = (st[8], st[6])
+        key = (path, stream)
+        entry = self._cache.pop (key, None)
+        if entry is None or entry[0] != mtime:
+            if self._cache and len (self._cache) >= self._cache_size:
+                # 淘汰最久没有使用的 (MicroPython 的 dict 无序, 此时为任意一个)
+                self._cache.pop (next (iter (self._cache)))
+            with open (path, "r") as f:
+                entry = (mtime, self.compile (f.read (), path, stream))
+        if self._cache_size:
+            self._cache[key] = entry # 重新插入, 最近使用的排在最后
+        return entry[1]
+
+    def invalidate (self,path:str=None):
+        """
+        使某个模板文件的缓存失效, 不传入 path 时清空全部缓存
+        """
+        if path is None:
+            self._cache.clear ()
+        else:
+            self._cache.pop ((path, False), None)
+            self._cache.pop ((path, True), None)
+
+    def rende (self,**kwargs) -> str:
+        """
+        :return: str
+        rende the template set by set_template (), kwargs are the variables.
+        """
+        if self._code is None:
+            self._code = self.compile (self._data)
+        result = []
+        self._run (self._code, result.append, kwargs)
+        return "".join (result)
+
+    def rende_file (self,path:str,**kwargs) -> str:
+        """
+        :return: str
+        rende a template file, the compiled template is cached by path and mtime.
+        """
+        result = []
+        self._run (self._load (path), result.append, kwargs)
+        return "".join (result)
+
+    def iter_rende (self,**kwargs):
+        """
+        流式渲染 set_template () 设置的模板, 返回依次产生每一段 str 的生成器
+        """
+        if self._stream_code is None:
+            self._stream_code = self.compile (self._data, stream=True)
+        return self._run (self._stream_code, None, kwargs)
+
+    def iter_rende_file (self,path:str,**kwargs):
+        """
+        流式渲染模板文件, 返回依次产生每一段 str 的生成器
+        """
+        return self._run (self._load (path, True), None, kwargs)
+
+    def rende_to (self,response,path:str=None,bufsize:int=None,**kwargs) -> bool:
+        """
+        边渲染边发送模板, 不传入 path 时渲染 set_template () 设置的模板.
+        输出会合并到 bufsize (默认 micro_route.STREAM_BUFFER_SIZE) 大小的缓冲区再写出,
+        所以占用的内存只和缓冲区大小有关, 和页面大小无关. 发送完成后响应结束.
+        在 serve () 启动的服务器中请使用 await response.astream (render.iter_rende_file (path))
+        """
+        if path is None:
+            fragments = self.iter_rende (**kwargs)
+        else:
+            fragments = self.iter_rende_file (path, **kwargs)
+        return response.stream (fragments, bufsize)
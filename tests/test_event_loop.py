@@ -0,0 +1,126 @@
+"""
+run (blocked=False) + poll () 事件循环的测试 (CPython)
+
+用法:
+    python -m unittest discover tests
+"""
+import os, socket, sys, threading, time, unittest
+
+sys.path.insert (0, os.path.join (os.path.dirname (os.path.abspath (__file__)), ".."))
+import micro_route
+
+PORT = 18790
+
+def read_responses (sock:socket.socket,count:int) -> list:
+    """
+    读取 count 个带有 Content-Length 的响应, 返回 [(状态行, 数据)]
+    """
+    data = b""
+    result = []
+    while len (result) < count:
+        idx = data.find (b"\r\n\r\n")
+        if idx >= 0:
+            head = data[:idx].decode ()
+            length = 0
+            for line in head.split ("\r\n")[1:]:
+                name, _, value = line.partition (":")
+                if name.strip ().lower () == "content-length":
+                    length = int (value)
+            if len (data) >= idx + 4 + length:
+                result.append ((head.split ("\r\n")[0], data[idx + 4:idx + 4 + length]))
+                data = data[idx + 4 + length:]
+                continue
+        chunk = sock.recv (65536)
+        if not chunk:
+            break
+        data += chunk
+    return result
+
+class Event_Loop_Test (unittest.TestCase):
+    def setUp (self):
+        self.app = micro_route.MICRO_ROUTE (bind_ip="127.0.0.1", bind_port=PORT, reuse_context=True)
+
+        @self.app.route ("/get")
+        def get (context):
+            return "get"
+
+        @self.app.route ("/post", method="POST")
+        def post (context):
+            return b"post " + context.request.data
+
+        @self.app.route ("/stream")
+        def stream (context):
+            return self.stream ()
+
+        self.app.run (blocked=False)
+        self.running = True
+        self.thread = threading.Thread (target=self.loop)
+        self.thread.start ()
+
+    def loop (self):
+        while self.running:
+            self.app.poll (0.05)
+
+    def stream (self):
+        """
+        产生约 4 MiB 的数据, 同时记录连接发送队列的最大长度
+        """
+        self.queued = 0
+        for i in range (256):
+            for key in self.app._MICRO_ROUTE__selector.get_map ().values ():
+                if key.data is not None:
+                    self.queued = max (self.queued, key.data.pending)
+            yield "{0:015d}\n".format (i) * 1024
+
+    def tearDown (self):
+        self.running = False
+        self.thread.join ()
+        self.app.stop ()
+
+    def test_pipelined_reuse_context (self):
+        sock = socket.create_connection (("127.0.0.1", PORT), timeout=5)
+        try:
+            sock.sendall (
+                b"GET /get HTTP/1.1\r\nHost: t\r\n\r\n"
+                b"POST /post HTTP/1.1\r\nHost: t\r\nContent-Length: 5\r\n\r\nhello"
+                b"POST /post HTTP/1.1\r\nHost: t\r\nContent-Length: 5\r\n\r\nworld"
+            )
+            responses = read_responses (sock, 3)
+        finally:
+            sock.close ()
+        self.assertEqual ([r[0] for r in responses], ["HTTP/1.1 200 OK"] * 3)
+        self.assertEqual ([r[1] for r in responses], [b"get", b"post hello", b"post world"])
+
+    def test_keep_alive_reuse_context (self):
+        sock = socket.create_connection (("127.0.0.1", PORT), timeout=5)
+        try:
+            sock.sendall (b"GET /get HTTP/1.1\r\nHost: t\r\n\r\n")
+            self.assertEqual (read_responses (sock, 1)[0][1], b"get")
+            for body in (b"aaaaa", b"bbbbb"):
+                sock.sendall (b"POST /post HTTP/1.1\r\nHost: t\r\nContent-Length: 5\r\n\r\n")
+                time.sleep (0.05) # 请求数据分开到达
+                sock.sendall (body)
+                self.assertEqual (read_responses (sock, 1), [("HTTP/1.1 200 OK", b"post " + body)])
+        finally:
+            sock.close ()
+
+    def test_stream_backpressure (self):
+        sock = socket.create_connection (("127.0.0.1", PORT), timeout=5)
+        try:
+            sock.sendall (b"GET /stream HTTP/1.0\r\nHost: t\r\n\r\n")
+            time.sleep (0.3) # 客户端暂时不读取
+            data = b""
+            while True:
+                chunk = sock.recv (65536)
+                if not chunk:
+                    break
+                data += chunk
+        finally:
+            sock.close ()
+        body = data[data.find (b"\r\n\r\n") + 4:]
+        self.assertEqual (len (body), 256 * 16 * 1024)
+        self.assertTrue (body.endswith (b"000000000000255\n"))
+        self.assertLessEqual (self.queued, micro_route.LOOP_OUTPUT_LIMIT + micro_route.STREAM_BUFFER_SIZE)
+
+if __name__ == "__main__":
+    unittest.main ()
@@ -0,0 +1,31 @@
+"""
+load_form_data () 和 _unquote () 的测试
+
+用法:
+    python -m unittest discover tests
+"""
+import os, sys, unittest
+
+sys.path.insert (0, os.path.join (os.path.dirname (os.path.abspath (__file__)), ".."))
+import micro_route
+
+class Form_Data_Test (unittest.TestCase):
+    def test_plain (self):
+        form = micro_route.load_form_data (b"a=1&b=x+y&a=2")
+        self.assertEqual (form.getlist ("a"), ["1", "2"])
+        self.assertEqual (form["b"], "x y")
+
+    def test_second_equal_sign (self):
+        self.assertEqual (dict (micro_route.load_form_data (b"a=b=c")), {"a" : "b=c"})
+        self.assertEqual (dict (micro_route.load_form_data (b"a=b%20=c&d==")), {"a" : "b =c", "d" : "="})
+
+    def test_encoded_separators (self):
+        form = micro_route.load_form_data (b"k%3D=v%26w&x=%E4%BD%A0")
+        self.assertEqual (dict (form), {"k=" : "v&w", "x" : "你"})
+
+    def test_invalid_escape (self):
+        self.assertEqual (dict (micro_route.load_form_data (b"e=%+f&g=%4")), {"e" : "% f", "g" : "%4"})
+        self.assertEqual (micro_route._unquote (b"%zz%41% 1"), b"%zzA% 1")
+
+if __name__ == "__main__":
+    unittest.main ()